@@ -11,25 +11,49 @@ Excel 依存なしで `dabimasFactor.json` を生成するスクリプト。
 処理の流れ:
 - 一覧ページ（または `--urls-file`）から馬詳細 URL を集める。
 - 各詳細ページを VBA の ALL 行レイアウト互換でパースする。
+- 取得・パースは並列で、完了した順に受け取る。書き出し直前に URL 順へ並べ直し、
+  種牡馬の重複（馬名 + 非凡）は key で判定してスキップする（`StallionDeduper`）。
 - ALL 行 1 件を dabimasFactor の JSON 1 件へ変換する。
 - 必要なら確認用に sparse ALL 行を NDJSON で出力する。
 
 出力:
 - `--output`: 最終 `{"horseLists":[...]}` JSON
-- `--all-output`: 任意の sparse ALL 行 NDJSON
+- `--hashed-assets`: 任意。公開物と brosData / inbreed-exceptions の内容ハッシュ入りコピー（manifest に記録）
+- `--summary-aggregates`: 任意。summary の各馬に血統の因子本数・因子持ちの祖先数・親系統ビットマスクを足す
+- `--all-output`: 任意の sparse ALL 行 NDJSON（隣に id / URL -> バイト位置の索引 `<名前>.index.json`）
+- `--profile`: 任意。parse / convert / write 各段の cProfile と tracemalloc レポート（3.12 以降は parse に convert を含む）
+- `--checkpoint`: 任意。取得済み ALL 行の追記型 NDJSON journal（`--resume` で再開）
+- `--diff-output`: 任意。前回の summary / detail chunk と比べた追加・削除・変更馬のレポート
+- `--url-state`: 任意。一覧 URL の初出時刻・前回実行からの追加・削除 URL・重複スキップした種牡馬を持つ状態 JSON
+- `--ancestor-index-output`: 任意。祖先名 -> (馬の序数, 血統スロット) の逆引き索引（summary と同じ世代で公開）
+- `--pedigree-output`: 任意。祖先名を種牡馬レコードへ解決した血統 DAG（summary と同じ世代で公開）
+- `--similarity-output`: 任意。血統の類似検索用の MinHash / LSH 索引（summary と同じ世代で公開）
+- `--sqlite-output`: 任意。馬・血統・因子・全兄弟グループを正規化した SQLite（分析用。`--sqlite-upsert` で id ごとの追加・更新）
+
+`--merge` を付けると全件クロールせず、`--urls-file`（`fetch_latest_news.py --urls-out`
+の出力など）の URL と、一覧ページにあって既存 summary に無い馬だけを取得し、既存の
+summary / detail chunk へ ruby 順で差し込んで書き直す。
 """
 
 from __future__ import annotations
 
 import argparse
+import cProfile
 import hashlib
+import heapq
 import json
+import os
+import pstats
 import re
+import sys
+import threading
 import time
-import unicodedata
+import tracemalloc
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
 from urllib.parse import urljoin
 
 import requests
@@ -37,6 +61,19 @@ from bs4 import BeautifulSoup
 from bs4.element import Tag
 from pykakasi import kakasi
 
+# detail chunk のファイル名規則と検索テキスト正規化は読み出し側ライブラリ（scripts/dabimas）と共有する。
+from dabimas.aggregates import SummaryAggregates
+from dabimas.allrows import AllRowsWriter, index_path_for
+from dabimas.ancestors import AncestorIndex
+from dabimas.database import HorseDatabase
+from dabimas.pedigree import PedigreeGraph
+from dabimas.publish import GenerationPublisher, manifest_entries, replace_file
+from dabimas.query import detail_chunk_filename
+from dabimas.siblings import SiblingIndex
+from dabimas.similarity import SimilarityIndex
+from dabimas.text import normalize_search_text
+from dabimas.validate import ArtifactValidator
+
 
 # スクレイピング対象 URL。
 BASE_URL = "https://dabimas.jp"
@@ -75,6 +112,36 @@ HD_FACTOR_T1 = 68
 
 ROW_SIZE = 112
 
+# 血統 15 頭分の列（馬名 / 親系統 / 子系統）と、子孫因子画像 45 枠。
+PEDIGREE_SIZE = 15
+FACTOR_SLOT_SIZE = 45
+
+# ALL 行のスカラー列（HD_GENDER..HD_NATURE）に対応する AllRow 属性名。列番号 - 1 が添字。
+ROW_SCALAR_FIELDS = (
+    "gender",
+    "serial_number",
+    "horse_id",
+    "rare",
+    "horse_name",
+    "parent_line",
+    "factor_name1",
+    "factor_name2",
+    "factor_name3",
+    "icon",
+    "distance_min",
+    "distance_max",
+    "growth",
+    "dirt",
+    "health",
+    "clemency",
+    "running_style",
+    "achievement",
+    "potential",
+    "stable",
+    "ability",
+    "nature",
+)
+
 
 # 因子番号 -> 1文字略称（出力 JSON で使用）。
 FACTOR_SHORT_DICT = {
@@ -94,6 +161,12 @@ FACTOR_SHORT_DICT = {
     14: "雷",
 }
 
+# json/ に手書きで置かれ、公開前検証の対象にする JSON。
+BROS_DATA_FILENAME = "brosData.json"
+INBREED_EXCEPTIONS_FILENAME = "inbreed-exceptions.json"
+# 検証エラーを表示する件数。
+VALIDATION_REPORT_LIMIT = 20
+
 # 親系統名 -> 2文字コード。
 # サイト上の表記ゆれを辞書で正規化する。
 PARENTAL_LINE_DICT = {
@@ -209,12 +282,108 @@ def to_hiragana_ruby(text: str) -> str:
     return "".join(part["hira"] for part in KAKASI_CONVERTER.convert(s))
 
 
-def new_row() -> list[str]:
-    """ALL 行バッファを作る（index 0 は未使用）。"""
-    return [""] * (ROW_SIZE + 1)
+EMPTY_PEDIGREE: tuple[str, ...] = ("",) * PEDIGREE_SIZE
+EMPTY_FACTOR_URLS: tuple[str, ...] = ("",) * FACTOR_SLOT_SIZE
+
+
+class AllRow:
+    """
+    ALL 行 1 件のコンパクト表現。
+
+    スカラー 22 列は `__slots__` 属性、血統 15 頭分の馬名 / 親系統 / 子系統と子孫因子
+    45 枠は固定長 tuple で持つ。空の血統・因子は共有の空 tuple を指すので、牝馬など
+    空列の多い行でも 113 要素のリストを作らない。
 
+    `row[HD_xxx]` の列番号アクセス（index 0 は未使用で常に空文字）と `len(row)` は
+    従来の list 行と互換。新しいコードは属性を直接使う。
+    """
 
-def row_get(row: list[str], idx: int) -> str:
+    __slots__ = ROW_SCALAR_FIELDS + ("names", "parent_lines", "sons", "factor_urls")
+
+    def __init__(self) -> None:
+        for field in ROW_SCALAR_FIELDS:
+            setattr(self, field, "")
+        self.names: tuple[str, ...] = EMPTY_PEDIGREE
+        self.parent_lines: tuple[str, ...] = EMPTY_PEDIGREE
+        self.sons: tuple[str, ...] = EMPTY_PEDIGREE
+        self.factor_urls: tuple[str, ...] = EMPTY_FACTOR_URLS
+
+    def _locate(self, idx: int) -> tuple[str, int]:
+        """列番号を (tuple 属性名, 添字) へ引く。スカラー列は添字 -1。"""
+        if HD_GENDER <= idx <= HD_NATURE:
+            return ROW_SCALAR_FIELDS[idx - 1], -1
+        if HD_NAME_T <= idx < HD_PARENT_LINE_T:
+            return "names", idx - HD_NAME_T
+        if HD_PARENT_LINE_T <= idx < HD_SON_T:
+            return "parent_lines", idx - HD_PARENT_LINE_T
+        if HD_SON_T <= idx < HD_FACTOR_T1:
+            return "sons", idx - HD_SON_T
+        if HD_FACTOR_T1 <= idx <= ROW_SIZE:
+            return "factor_urls", idx - HD_FACTOR_T1
+        raise IndexError(idx)
+
+    def __len__(self) -> int:
+        return ROW_SIZE + 1
+
+    def __getitem__(self, idx: int) -> str:
+        if idx == 0:
+            return ""
+        field, pos = self._locate(idx)
+        value = getattr(self, field)
+        return value if pos < 0 else value[pos]
+
+    def __setitem__(self, idx: int, value: str) -> None:
+        field, pos = self._locate(idx)
+        if pos < 0:
+            setattr(self, field, value)
+            return
+        # tuple 列への 1 セル代入は互換用の遅い経路（パーサは tuple を一括で入れる）。
+        cells = list(getattr(self, field))
+        cells[pos] = value
+        setattr(self, field, tuple(cells))
+
+    def to_sparse_dict(self) -> dict[str, str]:
+        """非空列のみを `{"列番号": 値}` で返す（列番号昇順）。"""
+        sparse: dict[str, str] = {}
+        for i, field in enumerate(ROW_SCALAR_FIELDS, start=HD_GENDER):
+            value = getattr(self, field)
+            if value != "":
+                sparse[str(i)] = value
+        for base, cells in (
+            (HD_NAME_T, self.names),
+            (HD_PARENT_LINE_T, self.parent_lines),
+            (HD_SON_T, self.sons),
+            (HD_FACTOR_T1, self.factor_urls),
+        ):
+            for i, value in enumerate(cells, start=base):
+                if value != "":
+                    sparse[str(i)] = value
+        return sparse
+
+    @classmethod
+    def from_sparse_dict(cls, sparse: dict[str, str]) -> "AllRow":
+        """`to_sparse_dict` の逆変換。範囲外の列番号は無視する。"""
+        row = cls()
+        for key, value in sparse.items():
+            idx = int(key)
+            if 1 <= idx <= ROW_SIZE:
+                row[idx] = value
+        return row
+
+
+def pad_cells(cells: list[str], size: int) -> tuple[str, ...]:
+    """先頭 `size` 件を空文字で埋めた固定長 tuple にする。"""
+    if len(cells) >= size:
+        return tuple(cells[:size])
+    return tuple(cells) + ("",) * (size - len(cells))
+
+
+def new_row() -> AllRow:
+    """空の ALL 行を作る。"""
+    return AllRow()
+
+
+def row_get(row: AllRow, idx: int) -> str:
     """範囲チェック付きの安全な行アクセス。"""
     if 0 <= idx < len(row):
         return row[idx]
@@ -263,10 +432,106 @@ def get_factor_short(factor_no: str) -> str:
         return ""
 
 
+class FactorUrlTable:
+    """
+    因子画像 URL -> 1文字略称 の表。
+
+    因子アイコンの URL は十数種類しかないので、URL ごとに 1 回だけ
+    `extract_numbers` + `get_factor_short` で解決して dict に載せ、以降は dict 引きだけにする。
+    略称に解決できない非空 URL（辞書にない新アイコン等）は `unknown` に出現数を数え、
+    実行の最後に警告として出す。変換はメインスレッドでのみ呼ぶ前提。
+    """
+
+    def __init__(self) -> None:
+        self._codes: dict[str, str] = {}
+        self.unknown: dict[str, int] = {}
+
+    def lookup(self, url: str) -> str:
+        """URL を略称へ引く。空 URL は空文字。"""
+        if not url:
+            return ""
+        code = self._codes.get(url)
+        if code is None:
+            code = self._codes[url] = get_factor_short(extract_numbers(url))
+        if not code:
+            self.unknown[url] = self.unknown.get(url, 0) + 1
+        return code
+
+    def shorts(self, url1: str, url2: str, url3: str) -> list[str]:
+        """`get_factor` と同じ右詰め規則で、因子画像 URL 最大3件を略称 [f1, f2, f3] にする。"""
+        if url3:
+            return [self.lookup(url1), self.lookup(url2), self.lookup(url3)]
+        if url2:
+            return ["", self.lookup(url1), self.lookup(url2)]
+        if url1:
+            return ["", "", self.lookup(url1)]
+        return ["", "", ""]
+
+
+FACTOR_URLS = FactorUrlTable()
+
+
+# 表記ゆれの別名 -> 親系統コード（旧 `get_parent_line_name` の Nas/Nat 置換と同じ）。
+PARENT_LINE_ALIASES = {"Nas": "Ns", "Nat": "Na"}
+
+
+class ParentLineTable:
+    """
+    親系統の表記（系統名 / 2文字コード / 別名）-> 2文字コード の正規化表。
+
+    馬本体の `parentLine` と血統 15 頭の親系統の両方をこの表で引く。表は
+    `PARENTAL_LINE_DICT` の系統名、既知コード自身、`PARENT_LINE_ALIASES` から作り、
+    `load()` で JSON（`{"表記": "コード", ...}`）の追加分を重ねられる。
+    表に無い非空の表記は従来どおり `get_parent_line_name`（先頭2文字）で補いつつ
+    `unknown` に出現数を数え、実行の最後に警告として出す。変換はメインスレッドでのみ呼ぶ前提。
+    """
+
+    def __init__(self, names: dict[str, str], aliases: dict[str, str]) -> None:
+        self.codes: set[str] = set(names.values())
+        self._table: dict[str, str] = {code: code for code in self.codes}
+        self._table.update(aliases)
+        self._table.update(names)
+        self.unknown: dict[str, int] = {}
+
+    def add(self, mapping: dict[str, str]) -> None:
+        """表記 -> コード を追加（既存の表記は上書き）。"""
+        for raw, code in mapping.items():
+            if not isinstance(raw, str) or not isinstance(code, str) or not code:
+                raise ValueError(f"invalid parent line mapping: {raw!r} -> {code!r}")
+            self._table[raw.strip()] = code
+            self._table[code] = code
+            self.codes.add(code)
+
+    def load(self, path: Path) -> int:
+        """追加マッピングの JSON を読み込み、件数を返す。"""
+        with path.open("r", encoding="utf-8") as fp:
+            mapping = json.load(fp)
+        if not isinstance(mapping, dict):
+            raise ValueError(f"{path}: expected a JSON object of name -> code")
+        self.add(mapping)
+        return len(mapping)
+
+    def lookup(self, raw: str) -> str:
+        """表記をコードへ引く。空は空文字。"""
+        code = self._table.get(raw)
+        if code is not None:
+            return code
+        s = safe_str(raw).strip()
+        if not s:
+            return ""
+        code = self._table.get(s)
+        if code is not None:
+            self._table[raw] = code
+            return code
+        self.unknown[s] = self.unknown.get(s, 0) + 1
+        return get_parent_line_name(s)
+
+
+PARENT_LINES = ParentLineTable(PARENTAL_LINE_DICT, PARENT_LINE_ALIASES)
+
+
 # 詳細ページ URL から末尾の数値（例: /kouryaku/stallions/12345.html → 12345）を拾う。
 HORSE_URL_NUM_RE = re.compile(r"/(\d+)\.html")
-# JS 側 normalizeSearchText と同じく、半角/全角スペース類を畳む。
-SEARCH_SPACE_RE = re.compile(r"[　\s]+")
 
 
 def derive_horse_id(sex: str, url: str) -> str:
@@ -288,29 +553,6 @@ def derive_horse_id(sex: str, url: str) -> str:
     return f"{prefix}h{digest}"
 
 
-def normalize_search_text(text: str) -> str:
-    """
-    index.html の `normalizeSearchText` と同じ正規化を Python で再現する。
-
-    NFKC 正規化 → trim → 小文字化 → 空白除去 → カタカナをひらがな化。
-    summary に焼き込む `searchText` を、アプリ実行時の検索インデックスと
-    一致させるために使う。
-    """
-    if not isinstance(text, str):
-        return ""
-    s = unicodedata.normalize("NFKC", text).strip().lower()
-    s = SEARCH_SPACE_RE.sub("", s)
-    out = []
-    for ch in s:
-        code = ord(ch)
-        # U+30A1..U+30F6（カタカナ）をひらがなへ。JS 実装と同じ範囲。
-        if 0x30A1 <= code <= 0x30F6:
-            out.append(chr(code - 0x60))
-        else:
-            out.append(ch)
-    return "".join(out)
-
-
 def build_display_name(name: str, sub_name: str, nature: str) -> str:
     """index.html の `getHorseBaseText` と同じ表示名を生成する。"""
     nature_tag = f"[{nature[0]}]" if nature else ""
@@ -385,6 +627,102 @@ def collect_horse_urls(fetcher: Fetcher) -> list[str]:
     return urls
 
 
+def load_url_state(path: Path) -> Optional[dict[str, str]]:
+    """`--url-state` を読み、URL -> 初出時刻（ISO 8601）を返す。ファイルが無ければ None。"""
+    if not path.exists():
+        return None
+    with path.open("r", encoding="utf-8") as fp:
+        obj = json.load(fp)
+    return {url: info.get("firstSeen", "") for url, info in obj.get("urls", {}).items()}
+
+
+def load_url_duplicates(path: Path) -> dict[str, str]:
+    """
+    `--url-state` から、前回 VBA 互換の重複スキップで落とした種牡馬の URL -> 残した馬の id を返す。
+
+    ファイルが無い・記録が無ければ空。
+    """
+    if not path.exists():
+        return {}
+    with path.open("r", encoding="utf-8") as fp:
+        obj = json.load(fp)
+    return {url: info["duplicateOf"] for url, info in obj.get("urls", {}).items() if info.get("duplicateOf")}
+
+
+def diff_url_state(
+    previous: Optional[dict[str, str]], urls: list[str], now: str
+) -> tuple[dict[str, str], list[str], list[str]]:
+    """
+    前回の URL 集合と今回の一覧 URL を比べ、(新しい状態, 追加 URL, 削除 URL) を返す。
+
+    追加・削除は今回の一覧順 / 前回の記録順。初回（`previous` が None）は全 URL を
+    今回初出として記録し、追加・削除は空とする（比較対象が無いので優先取得もしない）。
+    """
+    if previous is None:
+        return {url: now for url in urls}, [], []
+    current = set(urls)
+    added = [url for url in urls if url not in previous]
+    removed = [url for url in previous if url not in current]
+    state = {url: previous.get(url) or now for url in urls}
+    return state, added, removed
+
+
+def write_url_state(
+    path: Path,
+    state: dict[str, str],
+    added: list[str],
+    removed: list[str],
+    now: str,
+    duplicates: Optional[dict[str, str]] = None,
+) -> None:
+    """
+    `--url-state` を書き出す。直近の追加・削除 URL も `lastDelta` として残す。
+
+    `duplicates`（重複スキップした種牡馬の URL -> 残した馬の id）は該当 URL に `duplicateOf` として残し、
+    次の `--merge` で取り直さないようにする。
+    """
+    duplicates = duplicates or {}
+    urls: dict[str, dict[str, str]] = {}
+    for url, first_seen in state.items():
+        info = {"firstSeen": first_seen}
+        if url in duplicates:
+            info["duplicateOf"] = duplicates[url]
+        urls[url] = info
+    obj = {
+        "version": 1,
+        "updatedAt": now,
+        "lastDelta": {"added": added, "removed": removed},
+        "urls": urls,
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8", newline="\n") as fp:
+        json.dump(obj, fp, ensure_ascii=False, indent=1)
+        fp.write("\n")
+
+
+def select_merge_urls(
+    urls: list[str], listed_urls: list[str], base_ids: set[str], duplicates: dict[str, str]
+) -> list[str]:
+    """
+    `--merge` で取得する URL: `urls`（--urls-file の分）に、一覧にあって既存 entry に無い URL を一覧順で足す。
+
+    前回 VBA 互換の重複スキップで落とした種牡馬（`duplicates`: URL -> 残した馬の id）は、残した馬が
+    既存 entry にある限り足さない。取り直すと、比べる相手が今回の取得分に無いため重複と判定できず、
+    全件クロールでは入らない馬が差し込まれてしまう。
+    """
+    selected = list(urls)
+    seen = set(urls)
+    for url in listed_urls:
+        if url in seen:
+            continue
+        sex = "1" if "/broodmares/" in url else "0"
+        if derive_horse_id(sex, url) in base_ids or duplicates.get(url) in base_ids:
+            continue
+        seen.add(url)
+        selected.append(url)
+    return selected
+
+
 def load_horse_urls_from_file(urls_file: Path) -> list[str]:
     """
     URL リストファイルを読み込む。
@@ -412,19 +750,24 @@ def load_horse_urls_from_file(urls_file: Path) -> list[str]:
     return urls
 
 
-def fill_pedigree_and_factors(row: list[str], soup: BeautifulSoup) -> None:
-    """血統45件と子孫因子45枠を ALL 行へ格納する。"""
-    horse_elements = soup.select(".horse")
-    for i in range(min(45, len(horse_elements))):
-        row[HD_NATURE + 1 + i] = safe_str(horse_elements[i].get_text())
+def fill_pedigree_and_factors(row: AllRow, soup: BeautifulSoup) -> None:
+    """血統45件（馬名15 / 親系統15 / 子系統15 の順）と子孫因子45枠を ALL 行へ格納する。"""
+    horse_texts = [safe_str(el.get_text()) for el in soup.select(".horse")[: PEDIGREE_SIZE * 3]]
+    if horse_texts:
+        cells = pad_cells(horse_texts, PEDIGREE_SIZE * 3)
+        row.names = cells[:PEDIGREE_SIZE]
+        row.parent_lines = cells[PEDIGREE_SIZE:PEDIGREE_SIZE * 2]
+        row.sons = cells[PEDIGREE_SIZE * 2:]
 
-    factor_elements = soup.select(".factor")
-    for i in range(min(45, len(factor_elements))):
-        img = factor_elements[i].select_one("img")
-        row[HD_FACTOR_T1 + i] = normalize_src(img.get("src", "")) if img else ""
+    factor_urls: list[str] = []
+    for el in soup.select(".factor")[:FACTOR_SLOT_SIZE]:
+        img = el.select_one("img")
+        factor_urls.append(normalize_src(img.get("src", "")) if img else "")
+    if factor_urls:
+        row.factor_urls = pad_cells(factor_urls, FACTOR_SLOT_SIZE)
 
 
-def parse_stallion(url: str, serial_no: int, soup: BeautifulSoup) -> Optional[list[str]]:
+def parse_stallion(url: str, serial_no: int, soup: BeautifulSoup) -> Optional[AllRow]:
     """種牡馬詳細ページを ALL 行 1 件へ変換する。"""
     # 1) VBA と同じ DOM 前提で辿る:
     # content -> wrapper div -> detail div -> main table
@@ -455,16 +798,16 @@ def parse_stallion(url: str, serial_no: int, soup: BeautifulSoup) -> Optional[li
 
     # ALL 行を初期化して基本項目をセット。
     row = new_row()
-    row[HD_GENDER] = "0"
-    row[HD_SERIAL_NUMBER] = f"{serial_no:05d}"
-    row[HD_HORSE_ID] = url
-    row[HD_RARE] = str(star_count)
-    row[HD_ICON] = icon_src
+    row.gender = "0"
+    row.serial_number = f"{serial_no:05d}"
+    row.horse_id = url
+    row.rare = str(star_count)
+    row.icon = icon_src
 
     name_span = trs[1].find("span")
-    row[HD_HORSE_NAME] = safe_str(name_span.get_text()) if name_span else ""
+    row.horse_name = safe_str(name_span.get_text()) if name_span else ""
     pl_div = trs[2].find("div")
-    row[HD_PARENT_LINE] = safe_str(pl_div.get_text()) if pl_div else ""
+    row.parent_line = safe_str(pl_div.get_text()) if pl_div else ""
 
     # 画面上部の因子（最大3）をセット。
     factor_div = None
@@ -482,7 +825,7 @@ def parse_stallion(url: str, serial_no: int, soup: BeautifulSoup) -> Optional[li
         p = a_tags[0].find("p")
         if p:
             ability_name = safe_str(p.get_text())
-    row[HD_ABILITY] = ability_name
+    row.ability = ability_name
 
     # 詳細テーブル（距離・成長・各スペック）をパース。
     if detail is not None:
@@ -495,13 +838,13 @@ def parse_stallion(url: str, serial_no: int, soup: BeautifulSoup) -> Optional[li
 
                 if len(c0) > 0:
                     p = c0[0].find("p")
-                    row[HD_DISTANCE_MIN] = safe_str(p.get_text()) if p else ""
+                    row.distance_min = safe_str(p.get_text()) if p else ""
                 if len(c0) > 1:
                     p = c0[1].find("p")
-                    row[HD_GROWTH] = safe_str(p.get_text()) if p else ""
+                    row.growth = safe_str(p.get_text()) if p else ""
                 if len(c1) > 0:
                     p = c1[0].find("p")
-                    row[HD_RUNNING_STYLE] = safe_str(p.get_text()) if p else ""
+                    row.running_style = safe_str(p.get_text()) if p else ""
 
                 for cell_idx, target_idx in (
                     (2, HD_DIRT),
@@ -534,14 +877,14 @@ def parse_stallion(url: str, serial_no: int, soup: BeautifulSoup) -> Optional[li
             elif len(a_tags) >= 1:
                 p = a_tags[0].find("p")
             if p:
-                row[HD_NATURE] = safe_str(p.get_text())
+                row.nature = safe_str(p.get_text())
 
     # 血統45件 + 因子45件を埋める。
     fill_pedigree_and_factors(row, soup)
     return row
 
 
-def parse_broodmare(url: str, serial_no: int, soup: BeautifulSoup) -> Optional[list[str]]:
+def parse_broodmare(url: str, serial_no: int, soup: BeautifulSoup) -> Optional[AllRow]:
     """牝馬詳細ページを ALL 行 1 件へ変換する。"""
     # 牝馬ページは種牡馬ページと詳細構造が異なる。
     content = soup.select_one("#content")
@@ -552,14 +895,14 @@ def parse_broodmare(url: str, serial_no: int, soup: BeautifulSoup) -> Optional[l
 
     # 行を初期化し、基本識別子をセット。
     row = new_row()
-    row[HD_GENDER] = "1"
-    row[HD_SERIAL_NUMBER] = f"{serial_no:05d}"
-    row[HD_HORSE_ID] = url
+    row.gender = "1"
+    row.serial_number = f"{serial_no:05d}"
+    row.horse_id = url
 
     # レア情報は detail 配下の 4番目の <p>。
     p_tags = detail.find_all("p")
     if len(p_tags) >= 4:
-        row[HD_RARE] = safe_str(p_tags[3].get_text())
+        row.rare = safe_str(p_tags[3].get_text())
 
     bm_table = get_direct_child_by_tag(detail, "table")
     if bm_table is None:
@@ -572,22 +915,21 @@ def parse_broodmare(url: str, serial_no: int, soup: BeautifulSoup) -> Optional[l
     tds = trs[0].find_all("td")
     if len(tds) > 1:
         span = tds[1].find("span")
-        row[HD_HORSE_NAME] = safe_str(span.get_text()) if span else ""
+        row.horse_name = safe_str(span.get_text()) if span else ""
     if len(tds) > 0:
         img = tds[0].find("img")
-        row[HD_ICON] = normalize_src(img.get("src", "")) if img else ""
+        row.icon = normalize_src(img.get("src", "")) if img else ""
 
     detail_div = get_direct_child_by_tag(detail, "div")
-    row[HD_PARENT_LINE] = safe_str(detail_div.get_text()) if detail_div else ""
+    row.parent_line = safe_str(detail_div.get_text()) if detail_div else ""
 
     fill_pedigree_and_factors(row, soup)
     return row
 
 
-def all_row_to_dabifac_entry(row: list[str]) -> dict:
+def all_row_to_dabifac_entry(row: AllRow) -> dict:
     """ALL 行1件を dabimasFactor JSON 1件へ変換する。"""
-    # 入力は ALL レイアウト互換の配列。
-    horse_name = row_get(row, HD_HORSE_NAME)
+    horse_name = row.horse_name
 
     # 馬名の接尾情報（年号/因名）を subName に分離。
     sub_name = ""
@@ -597,69 +939,207 @@ def all_row_to_dabifac_entry(row: list[str]) -> dict:
         sub_name = m.group(0)
         pure_name = horse_name.replace(sub_name, "").replace("-", "")
 
-    parent_line_raw = row_get(row, HD_PARENT_LINE)
+    parent_line_raw = row.parent_line
 
-    f1, f2, f3 = get_factor(
-        row_get(row, HD_FACTOR_NAME1),
-        row_get(row, HD_FACTOR_NAME2),
-        row_get(row, HD_FACTOR_NAME3),
-    )
+    factors = FACTOR_URLS.shorts(row.factor_name1, row.factor_name2, row.factor_name3)
 
-    # 固定オフセット列から子孫15件を構築。
+    # 血統 tuple から子孫15件を構築。因子画像は 1 頭 3 枠。
     descendants = []
-    for i in range(15):
-        n = row_get(row, HD_NAME_T + i)
-        pl = get_parent_line_name(row_get(row, HD_PARENT_LINE_T + i))
-        son = row_get(row, HD_SON_T + i)
-        df1, df2, df3 = get_factor(
-            row_get(row, HD_FACTOR_T1 + i * 3),
-            row_get(row, HD_FACTOR_T1 + i * 3 + 1),
-            row_get(row, HD_FACTOR_T1 + i * 3 + 2),
-        )
+    factor_urls = row.factor_urls
+    for i, (n, pl_raw, son) in enumerate(zip(row.names, row.parent_lines, row.sons)):
+        pl = PARENT_LINES.lookup(pl_raw)
+        d_factors = FACTOR_URLS.shorts(factor_urls[i * 3], factor_urls[i * 3 + 1], factor_urls[i * 3 + 2])
         descendants.append(
             {
                 "name": n,
                 "parentLine": pl,
                 "son": son,
-                "factors": [
-                    get_factor_short(df1),
-                    get_factor_short(df2),
-                    get_factor_short(df3),
-                ],
+                "factors": d_factors,
             }
         )
 
-    sex = row_get(row, HD_GENDER)
+    sex = row.gender
 
-    # 親系統コードは辞書優先、見つからなければ2文字化で補完。
+    # 親系統コードは馬本体も血統も同じ正規化表で引く（未知の表記は2文字化で補完し警告）。
     return {
         # URL 由来の安定 id（指摘 A）。summary / detail の join key になる。
-        "id": derive_horse_id(sex, row_get(row, HD_HORSE_ID)),
+        "id": derive_horse_id(sex, row.horse_id),
         "name": pure_name,
         "ruby": to_hiragana_ruby(pure_name),
         "subName": sub_name,
-        "nature": row_get(row, HD_NATURE),
+        "nature": row.nature,
         "sex": sex,
-        "parentLine": PARENTAL_LINE_DICT.get(parent_line_raw.strip(), get_parent_line_name(parent_line_raw)),
+        "parentLine": PARENT_LINES.lookup(parent_line_raw),
         "son": parent_line_raw,
-        "factors": [
-            get_factor_short(f1),
-            get_factor_short(f2),
-            get_factor_short(f3),
-        ],
+        "factors": factors,
         "descendants": descendants,
     }
 
 
-def all_row_to_sparse_dict(row: list[str]) -> dict[str, str]:
+def all_row_to_sparse_dict(row: AllRow) -> dict[str, str]:
     """非空列のみを持つ sparse dict に変換する。"""
-    return {str(i): row[i] for i in range(1, ROW_SIZE + 1) if row[i] != ""}
+    return row.to_sparse_dict()
+
+
+def sparse_dict_to_all_row(sparse: dict[str, str]) -> AllRow:
+    """`all_row_to_sparse_dict` の逆変換。範囲外の列番号は無視する。"""
+    return AllRow.from_sparse_dict(sparse)
+
+
+class StallionDeduper:
+    """
+    種牡馬の重複スキップ（VBA 互換）を (馬名, 非凡) の key で判定する。
+
+    VBA は「直前に書いた種牡馬と馬名 + 非凡が同じならスキップ」だった。ここでは key ごとに
+    最小の URL 番号だけを残す。結果が届くたびに `offer()` で登録する（順不同でよい）。
+    書き出しでは URL 番号順に `keep()` を呼ぶ。どの順で届いても、残る馬は同じになる。
+
+    同じ key の種牡馬が URL 順の種牡馬の並び（牝馬・エラー・スキップ行を除く）で連続している限り、
+    VBA の判定と一致する。スキップされた種牡馬は、その前に書いた馬と同じ key を持つ。
+    そのため「直前に書いた馬と同じ」は「URL 順で直前の種牡馬と同じ」と同値になる。
+    連続していない重複（A, B, A）だけは結果が変わる。VBA は 2 頭目の A を残すが、ここでは落とす。
+    その件数を `non_adjacent` に数え、該当馬を呼び出し側で警告する。
+    """
 
+    def __init__(self) -> None:
+        self._first: dict[tuple[str, str], int] = {}
+        self._last_key: Optional[tuple[str, str]] = None
+        self.non_adjacent: list[tuple[int, str]] = []
+
+    def first_index(self, row: AllRow) -> Optional[int]:
+        """`row` と同じ key で残す種牡馬の URL 番号（種牡馬でない・未登録なら None）。"""
+        key = self.key(row)
+        return self._first.get(key) if key is not None else None
+
+    @staticmethod
+    def key(row: AllRow) -> Optional[tuple[str, str]]:
+        """種牡馬なら (馬名, 非凡)、それ以外は None。"""
+        return (row.horse_name, row.ability) if row.gender == "0" else None
+
+    def offer(self, idx: int, row: AllRow) -> None:
+        """届いた行を登録する。key ごとに最小の URL 番号を覚える。"""
+        key = self.key(row)
+        if key is not None and idx < self._first.get(key, idx + 1):
+            self._first[key] = idx
+
+    def keep(self, idx: int, row: AllRow) -> bool:
+        """URL 番号順に呼ぶ。書き出すなら True、重複でスキップするなら False。"""
+        key = self.key(row)
+        if key is None:
+            return True
+        previous, self._last_key = self._last_key, key
+        if self._first.get(key, idx) == idx:
+            return True
+        if key != previous:
+            self.non_adjacent.append((idx, row.horse_name))
+        return False
+
+
+# チェックポイント journal を fsync する間隔（記録件数）。
+CHECKPOINT_FSYNC_EVERY = 100
+
+
+class CheckpointJournal:
+    """
+    取得・解析が済んだ (idx, url, ALL 行) を追記する NDJSON journal（`--checkpoint`）。
+
+    1 行 1 件で `{"idx":..,"url":..,"row":sparse ALL 行 or null}` を書く。`row: null` は
+    「解析の結果スキップ」を表す。取得/解析エラーは記録しないので、再開時に再取得される。
+    クラッシュ時に途中まで書かれた末尾行は読み込み時に捨てる。
+
+    再開時は URL で突き合わせる（`replay`）。`idx` は記録時の URL 番号で、一覧の増減で位置が
+    ずれても、今回の URL リストでの位置と serial 番号を振り直して使う。
+    """
+
+    def __init__(self, path: Path, fsync_every: int = CHECKPOINT_FSYNC_EVERY):
+        self.path = path
+        self.fsync_every = max(1, fsync_every)
+        self._fp = None
+        self._pending = 0
+
+    def load(self) -> dict[str, Optional[AllRow]]:
+        """journal を読み、url -> ALL 行 or None を返す。壊れた行は無視し、同じ URL は後の記録を使う。"""
+        done: dict[str, Optional[AllRow]] = {}
+        if not self.path.exists():
+            return done
+        with self.path.open("r", encoding="utf-8") as fp:
+            for line in fp:
+                try:
+                    rec = json.loads(line)
+                    url = rec["url"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if not isinstance(url, str):
+                    continue
+                sparse = rec.get("row")
+                done[url] = sparse_dict_to_all_row(sparse) if sparse is not None else None
+        return done
+
+    def replay(self, urls: list[str]) -> dict[int, tuple[str, Optional[AllRow]]]:
+        """
+        journal のうち今回の `urls` にある分を、今回の URL 番号 -> (url, ALL 行 or None) で返す。
+
+        serial 番号は URL 番号から振るので、位置がずれた行は今回の番号で振り直す。
+        """
+        position = {url: idx for idx, url in enumerate(urls, start=1)}
+        replayed: dict[int, tuple[str, Optional[AllRow]]] = {}
+        for url, row in self.load().items():
+            idx = position.get(url)
+            if idx is None:
+                continue
+            if row is not None:
+                row.serial_number = f"{idx:05d}"
+            replayed[idx] = (url, row)
+        return replayed
+
+    def open(self, resume: bool) -> None:
+        """`resume` なら追記、そうでなければ journal を作り直す。"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if resume and self.path.exists() and self.path.stat().st_size > 0:
+            # 末尾行が途中で切れていると次の記録と連結されてしまうので改行で閉じる。
+            with self.path.open("rb") as fp:
+                fp.seek(-1, os.SEEK_END)
+                torn = fp.read(1) != b"\n"
+            self._fp = self.path.open("a", encoding="utf-8", newline="\n")
+            if torn:
+                self._fp.write("\n")
+        else:
+            self._fp = self.path.open("w", encoding="utf-8", newline="\n")
+
+    def record(self, idx: int, url: str, row: Optional[AllRow]) -> None:
+        """完了した 1 件を追記し、`fsync_every` 件ごとにディスクへ同期する。"""
+        if self._fp is None:
+            return
+        rec = {"idx": idx, "url": url, "row": all_row_to_sparse_dict(row) if row is not None else None}
+        self._fp.write(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._pending += 1
+        if self._pending >= self.fsync_every:
+            self.sync()
+
+    def sync(self) -> None:
+        """バッファを flush して fsync する。"""
+        if self._fp is None:
+            return
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._pending = 0
 
-def entry_to_summary(entry: dict, detail_chunk: int) -> dict:
-    """full entry 1 件を summary 1 件へ変換する（descendants は含めない）。"""
+    def close(self) -> None:
+        """同期してから閉じる。"""
+        if self._fp is None:
+            return
+        self.sync()
+        self._fp.close()
+        self._fp = None
+
+
+def entry_to_summary(entry: dict, detail_chunk: int, aggregates: Optional[SummaryAggregates] = None) -> dict:
+    """
+    full entry 1 件を summary 1 件へ変換する（descendants は含めない）。
+    `aggregates` を渡すと descendants から作った集計列（`dabimas.aggregates`）を足す。
+    """
     display_name = build_display_name(entry["name"], entry["subName"], entry["nature"])
-    return {
+    summary = {
         "id": entry["id"],
         "detailChunk": detail_chunk,
         "name": entry["name"],
@@ -675,25 +1155,46 @@ def entry_to_summary(entry: dict, detail_chunk: int) -> dict:
             entry["name"], entry["subName"], entry["ruby"], entry["nature"], display_name
         ),
     }
+    if aggregates is not None:
+        summary.update(aggregates.columns(entry["descendants"]))
+    return summary
+
 
+def partial_path(path: Path) -> Path:
+    """書き込み中の一時ファイル名。書き終えたら `replace_file` で本来の名前へ差し替える。"""
+    return path.with_name(path.name + ".partial")
 
-def write_summary(path: Path, entries: list[dict], chunk_size: int) -> None:
-    """summary JSON を書き出す。`detailChunk` は書き出し順 + chunk_size で焼き込む。"""
+
+def write_full(path: Path, entries: list[dict]) -> None:
+    """full JSON（`{"horseLists":[...]}`）を entry 列からまとめて書き出す（`--merge` 用）。"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = partial_path(path)
+    with tmp_path.open("w", encoding="utf-8", newline="\n") as fp:
+        json.dump({"horseLists": entries}, fp, ensure_ascii=False, separators=(",", ":"))
+        fp.write("\n")
+    replace_file(tmp_path, path)
+
+
+def write_summary(
+    path: Path, entries: list[dict], chunk_size: int, aggregates: Optional[SummaryAggregates] = None
+) -> None:
+    """
+    summary JSON を書き出す。`detailChunk` は書き出し順 + chunk_size で焼き込む。
+    `aggregates` があれば各馬に集計列を足し、列の並びを見出し `aggregates` に書く。
+    """
     horse_lists = [
-        entry_to_summary(entry, index // chunk_size) for index, entry in enumerate(entries)
+        entry_to_summary(entry, index // chunk_size, aggregates) for index, entry in enumerate(entries)
     ]
-    obj = {"version": 1, "chunkSize": chunk_size, "horseLists": horse_lists}
+    obj: dict = {"version": 1, "chunkSize": chunk_size}
+    if aggregates is not None:
+        obj["aggregates"] = aggregates.header()
+    obj["horseLists"] = horse_lists
     path.parent.mkdir(parents=True, exist_ok=True)
     with path.open("w", encoding="utf-8", newline="\n") as fp:
         json.dump(obj, fp, ensure_ascii=False, separators=(",", ":"))
         fp.write("\n")
 
 
-def detail_chunk_filename(chunk_index: int) -> str:
-    """detail chunk のファイル名（3桁ゼロ埋め）。"""
-    return f"dabimasFactor.details.{chunk_index:03d}.json"
-
-
 def write_details(dir_path: Path, entries: list[dict], chunk_size: int) -> int:
     """detail chunk 群を書き出し、chunk 数を返す。各 detail は id と descendants のみ。"""
     dir_path.mkdir(parents=True, exist_ok=True)
@@ -720,6 +1221,304 @@ def write_details(dir_path: Path, entries: list[dict], chunk_size: int) -> int:
     return num_chunks
 
 
+# diff で比較する entry フィールド。summary の派生列（displayName / searchText /
+# detailChunk）は他フィールドから決まるか並び順由来なので比較しない。
+DIFF_FIELDS = ("name", "ruby", "subName", "nature", "sex", "parentLine", "son", "factors", "descendants")
+
+
+def load_published_entries(summary_path: Path, details_dir: Optional[Path]) -> dict[str, dict]:
+    """
+    公開済み summary（+ あれば detail chunk）を id -> entry 形に読み戻す。
+
+    detail chunk は summary の `detailChunk` が指すファイルだけを 1 回ずつ読む。
+    chunk が無い/読めない馬は `descendants` を None にする（diff では比較対象外）。
+    """
+    if not summary_path.exists():
+        return {}
+    with summary_path.open("r", encoding="utf-8") as fp:
+        horse_lists = json.load(fp).get("horseLists", [])
+
+    descendants_by_id: dict[str, list] = {}
+    if details_dir is not None:
+        for chunk_index in sorted({h.get("detailChunk") for h in horse_lists if isinstance(h.get("detailChunk"), int)}):
+            chunk_path = details_dir / detail_chunk_filename(chunk_index)
+            if not chunk_path.exists():
+                continue
+            with chunk_path.open("r", encoding="utf-8") as fp:
+                for detail in json.load(fp).get("horseDetails", []):
+                    descendants_by_id[detail["id"]] = detail.get("descendants")
+
+    entries: dict[str, dict] = {}
+    for horse in horse_lists:
+        entry = {"id": horse["id"]}
+        for field in DIFF_FIELDS:
+            entry[field] = horse.get(field)
+        entry["descendants"] = descendants_by_id.get(horse["id"])
+        entries[horse["id"]] = entry
+    return entries
+
+
+def entry_fingerprint(entry: dict, fields: tuple[str, ...] = DIFF_FIELDS) -> str:
+    """`fields` の正規化 JSON の SHA-1。同じ値なら同じ指紋になる。"""
+    canonical = json.dumps(
+        [entry.get(field) for field in fields], ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def diff_entry_fields(old: dict, new: dict) -> dict:
+    """指紋が異なる 2 件のフィールド単位差分。descendants は変わった枠だけを出す。"""
+    changes: dict = {}
+    for field in DIFF_FIELDS:
+        old_value = old.get(field)
+        new_value = new.get(field)
+        if field == "descendants":
+            if old_value is None or old_value == new_value:
+                continue
+            slots = []
+            for slot in range(max(len(old_value), len(new_value))):
+                o = old_value[slot] if slot < len(old_value) else None
+                n = new_value[slot] if slot < len(new_value) else None
+                if o != n:
+                    slots.append({"slot": slot, "old": o, "new": n})
+            changes[field] = slots
+        elif old_value != new_value:
+            changes[field] = {"old": old_value, "new": new_value}
+    return changes
+
+
+def _diff_label(entry: dict) -> dict:
+    """diff レポートに載せる馬の識別情報。"""
+    return {"id": entry["id"], "name": entry.get("name"), "subName": entry.get("subName"), "sex": entry.get("sex")}
+
+
+def diff_entries(previous: dict[str, dict], entries: list[dict]) -> dict:
+    """
+    前回 entry（id -> entry）と今回 entry 列を id で突き合わせ、追加・削除・変更を返す。
+
+    各馬は指紋（SHA-1）で先に比較し、異なる馬だけフィールド差分を取るので全体で線形。
+    前回 detail が無い馬は descendants を除いた指紋で比較する。
+    """
+    scalar_fields = tuple(f for f in DIFF_FIELDS if f != "descendants")
+    added: list[dict] = []
+    changed: list[dict] = []
+    unchanged = 0
+    seen: set[str] = set()
+    for entry in entries:
+        seen.add(entry["id"])
+        old = previous.get(entry["id"])
+        if old is None:
+            added.append(_diff_label(entry))
+            continue
+        fields = DIFF_FIELDS if old.get("descendants") is not None else scalar_fields
+        if entry_fingerprint(old, fields) == entry_fingerprint(entry, fields):
+            unchanged += 1
+            continue
+        changed.append({**_diff_label(entry), "fields": diff_entry_fields(old, entry)})
+    removed = [_diff_label(old) for hid, old in previous.items() if hid not in seen]
+    return {
+        "version": 1,
+        "counts": {
+            "added": len(added),
+            "removed": len(removed),
+            "changed": len(changed),
+            "unchanged": unchanged,
+        },
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+    }
+
+
+def write_diff(path: Path, diff: dict) -> None:
+    """diff レポートを JSON で書き出す（人が読む前提でインデント付き）。"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8", newline="\n") as fp:
+        json.dump(diff, fp, ensure_ascii=False, indent=1)
+        fp.write("\n")
+
+
+# 出力の性別グループ順（種牡馬 → 牝馬）。各グループ内は ruby 昇順。
+SEX_ORDER = ("0", "1")
+
+
+def merge_entries(
+    base: list[dict], updates: list[dict], list_order: Optional[dict[str, int]] = None
+) -> list[dict]:
+    """
+    既存 entry 列 `base` に `updates` を差し込んだ新しい列を返す（`--merge`）。
+
+    `base` は一覧ページ由来で性別グループ（種牡馬 → 牝馬）ごとに ruby 昇順に並んでいる前提。
+    同じ id の entry は置き換え（ruby が変わっても正しい位置へ移す）、新しい id は
+    同じ性別グループ内の ruby 順の位置へ入れる。ruby が同じ馬どうしは `list_order`
+    （id -> 一覧ページでの位置）の順にして全件クロールと同じ並びにする。一覧に無い馬は同じ ruby の後ろ。
+    """
+    list_order = list_order or {}
+    unlisted = len(list_order)
+
+    def sort_key(entry: dict) -> tuple[str, int]:
+        return entry["ruby"], list_order.get(entry["id"], unlisted)
+
+    update_ids = {entry["id"] for entry in updates}
+    groups: dict[str, list[dict]] = {}
+    for entry in base:
+        if entry["id"] not in update_ids:
+            groups.setdefault(entry["sex"], []).append(entry)
+    additions: dict[str, list[dict]] = {}
+    for entry in updates:
+        additions.setdefault(entry["sex"], []).append(entry)
+
+    merged: list[dict] = []
+    for sex in list(SEX_ORDER) + [k for k in {**groups, **additions} if k not in SEX_ORDER]:
+        new_sorted = sorted(additions.get(sex, []), key=sort_key)
+        merged.extend(heapq.merge(groups.get(sex, []), new_sorted, key=sort_key))
+    return merged
+
+
+# `--profile` で計測する段。parse はワーカースレッド、convert / write はメインスレッドで走る。
+PROFILE_STAGES = ("parse", "convert", "write")
+# tracemalloc レポートに載せる上位件数。
+PROFILE_TOP_ALLOCATIONS = 25
+# 3.12 以降の cProfile は sys.monitoring 上のプロセス全体で 1 つしか有効にできず、
+# 有効な間は全スレッドの呼び出しを拾うので、スレッドごとの Profile は 3.11 までに限る。
+# 3.12 以降は取得・解析ループ全体（`StageProfiler.crawl()`）を 1 つの Profile で取る。
+PROFILE_PER_THREAD = sys.version_info < (3, 12)
+
+
+class StageProfiler:
+    """
+    段ごとの cProfile と tracemalloc スナップショットを取る（`--profile`）。
+
+    cProfile はスレッド単位でしかフックされないため、(段, スレッド) ごとに Profile を持ち、
+    計測区間は各スレッドが自分の Profile だけを有効にする（区間どうしは直列化しない）。
+    レポートを書くときに段ごとに `pstats` で合算する。3.12 以降（`PROFILE_PER_THREAD` が偽）は
+    Profile がプロセス全体で 1 つなので、メインスレッドが `crawl()` の区間で 1 つだけ有効にし、
+    全スレッドの取得・解析・変換をまとめて `parse.prof` に書く（区間内の `stage()` は回数だけ数える）。
+    write 段は取得・解析ループの後なので、どちらでも段ごとに計測する。
+    tracemalloc はプロセス全体で 1 本なので、段の切れ目でスナップショットを取り、
+    前スナップショットとの差分を上位割り当てとして出す。
+
+    `out_dir` が None のときは何もしない（通常実行のオーバーヘッドは分岐のみ）。
+    """
+
+    def __init__(self, out_dir: Optional[Path]):
+        self.out_dir = out_dir
+        self.enabled = out_dir is not None
+        self._lock = threading.Lock()
+        self._profiles: dict[tuple[str, int], cProfile.Profile] = {}
+        self._calls: dict[str, int] = {}
+        # 3.12 以降の取得・解析ループ全体の Profile と、その区間内で数えた段の回数。
+        self._crawl_profile: Optional[cProfile.Profile] = None
+        self._crawl_active = False
+        self._in_crawl: dict[str, int] = {}
+        self._snapshots: list[tuple[str, tracemalloc.Snapshot]] = []
+
+    def start(self) -> None:
+        """tracemalloc を開始し、基準スナップショットを取る。"""
+        if not self.enabled:
+            return
+        tracemalloc.start(10)
+        self.snapshot("start")
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """`name` 段の計測区間。ワーカースレッドから呼んでもよい。"""
+        if not self.enabled:
+            yield
+            return
+        key = (name, threading.get_ident())
+        if self._crawl_active:
+            # 3.12 以降: crawl() の Profile が全スレッドを計測中なので、回数だけ数える。
+            with self._lock:
+                self._calls[name] = self._calls.get(name, 0) + 1
+                self._in_crawl[name] = self._in_crawl.get(name, 0) + 1
+            yield
+            return
+        # ロックは Profile の登録と呼び出し回数の更新だけ。計測区間そのものは並列に走らせる。
+        with self._lock:
+            profile = self._profiles.get(key)
+            if profile is None:
+                profile = self._profiles[key] = cProfile.Profile()
+            self._calls[name] = self._calls.get(name, 0) + 1
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    @contextmanager
+    def crawl(self) -> Iterator[None]:
+        """
+        取得・解析ループ全体の計測区間。メインスレッドから呼ぶ。3.11 までは何もしない
+        （段ごとの Profile で足りる）。3.12 以降は 1 つの Profile で全スレッドを計測する。
+        """
+        if not self.enabled or PROFILE_PER_THREAD:
+            yield
+            return
+        profile = self._crawl_profile = self._crawl_profile or cProfile.Profile()
+        profile.enable()
+        self._crawl_active = True
+        try:
+            yield
+        finally:
+            self._crawl_active = False
+            profile.disable()
+
+    def snapshot(self, label: str) -> None:
+        """段の切れ目で tracemalloc スナップショットを取る。"""
+        if not self.enabled or not tracemalloc.is_tracing():
+            return
+        snap = tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            )
+        )
+        self._snapshots.append((label, snap))
+
+    def write_reports(self) -> list[Path]:
+        """`<段>.prof` と `tracemalloc.txt` を書き出し、書いたパスを返す。"""
+        if not self.enabled or self.out_dir is None:
+            return []
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        written: list[Path] = []
+
+        for name in PROFILE_STAGES:
+            profiles = [profile for (stage, _), profile in self._profiles.items() if stage == name]
+            if name == "parse" and self._crawl_profile is not None:
+                profiles = [self._crawl_profile]
+            if not profiles:
+                continue
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            prof_path = self.out_dir / f"{name}.prof"
+            stats.dump_stats(str(prof_path))
+            written.append(prof_path)
+
+        if self._snapshots:
+            report_path = self.out_dir / "tracemalloc.txt"
+            with report_path.open("w", encoding="utf-8", newline="\n") as fp:
+                for name in PROFILE_STAGES:
+                    if name in self._calls:
+                        in_crawl = self._in_crawl.get(name, 0)
+                        note = f" ({in_crawl} profiled together in parse.prof)" if in_crawl else ""
+                        fp.write(f"stage {name}: {self._calls[name]} calls{note}\n")
+                current, peak = tracemalloc.get_traced_memory()
+                fp.write(f"traced memory: current={current} peak={peak}\n")
+                for (prev_label, prev), (label, snap) in zip(self._snapshots, self._snapshots[1:]):
+                    fp.write(f"\n## {prev_label} -> {label} (top {PROFILE_TOP_ALLOCATIONS} by size diff)\n")
+                    for stat in snap.compare_to(prev, "lineno")[:PROFILE_TOP_ALLOCATIONS]:
+                        fp.write(f"{stat}\n")
+                label, last = self._snapshots[-1]
+                fp.write(f"\n## live at {label} (top {PROFILE_TOP_ALLOCATIONS} by size)\n")
+                for stat in last.statistics("lineno")[:PROFILE_TOP_ALLOCATIONS]:
+                    fp.write(f"{stat}\n")
+            written.append(report_path)
+            tracemalloc.stop()
+        return written
+
+
 def main(argv: Optional[list[str]] = None) -> int:
     """CLI エントリポイント。成功時0、`--fail-on-error` 条件で1を返す。"""
     # CLI の流れ: 引数解析 -> URL収集 -> ページ解析 -> 出力書き込み。
@@ -744,10 +1543,26 @@ def main(argv: Optional[list[str]] = None) -> int:
         default=128,
         help="detail chunk 1 ファイルあたりの件数（デフォルト128）。",
     )
+    parser.add_argument(
+        "--hashed-assets",
+        action="store_true",
+        help=(
+            "summary・detail chunk・同じ世代のファイルと、隣の brosData.json / inbreed-exceptions.json の"
+            "内容ハッシュ入りの名前のコピーを dabimasFactor-hashed/ に置き、manifest にハッシュ・サイズと並べて記録する。"
+        ),
+    )
+    parser.add_argument(
+        "--summary-aggregates",
+        action="store_true",
+        help=(
+            "summary の各馬に血統の集計列（因子ごとの本数・因子持ちの祖先数・親系統のビットマスク）を足す。"
+            "detail chunk を読まずに血統の因子で並べ替え・絞り込みできる。"
+        ),
+    )
     parser.add_argument(
         "--all-output",
         default=None,
-        help="任意: ALL 行 sparse NDJSON の出力パス。",
+        help="任意: ALL 行 sparse NDJSON の出力パス（id / URL で 1 行を引く位置索引も隣に書く）。",
     )
     parser.add_argument(
         "--urls-file",
@@ -765,7 +1580,104 @@ def main(argv: Optional[list[str]] = None) -> int:
         action="store_true",
         help="取得/解析エラーが1件でもあれば終了コード1にする。",
     )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        metavar="DIR",
+        help=(
+            "任意: parse/convert/write 各段の cProfile（<段>.prof）と tracemalloc.txt の出力ディレクトリ。"
+            "Python 3.12 以降の parse.prof は取得・解析ループ全体（convert を含む）。"
+        ),
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=None,
+        help="任意: 取得済み ALL 行を追記するチェックポイント journal（NDJSON）のパス。",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="--checkpoint の journal から完了済みの馬を再生し、残りだけ取得する。",
+    )
+    parser.add_argument(
+        "--diff-output",
+        default=None,
+        help="任意: 前回出力との差分（added/removed/changed）JSON の出力パス。",
+    )
+    parser.add_argument(
+        "--diff-base-summary",
+        default=None,
+        help="diff の比較元 summary JSON（省略時は --summary-output の既存ファイル）。",
+    )
+    parser.add_argument(
+        "--diff-base-details-dir",
+        default=None,
+        help="diff の比較元 detail chunk ディレクトリ（省略時は --details-output-dir）。",
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help=(
+            "全件クロールせず、--urls-file の URL と一覧ページの新規 URL だけを取得し、"
+            "既存の --summary-output / --details-output-dir へ差し込む。"
+        ),
+    )
+    parser.add_argument(
+        "--url-state",
+        default=None,
+        help=(
+            "任意: 一覧 URL の状態 JSON（URL ごとの初出時刻）。前回からの新規 URL を先に取得し、"
+            "消えた URL は --merge の既存分からも落とす。重複スキップした種牡馬も記録し、--merge で取り直さない。"
+        ),
+    )
+    parser.add_argument(
+        "--ancestor-index-output",
+        default=None,
+        help=(
+            "任意: 祖先の逆引き索引（祖先名 -> 馬の序数・血統スロット）の出力パス。"
+            "序数は summary の並びなので --summary-output と同じ世代で公開する。"
+        ),
+    )
+    parser.add_argument(
+        "--pedigree-output",
+        default=None,
+        help=(
+            "任意: 血統 DAG（祖先 15 枠の馬名を summary の種牡馬へ解決したもの）の出力パス。"
+            "--summary-output と同じ世代で公開する。"
+        ),
+    )
+    parser.add_argument(
+        "--similarity-output",
+        default=None,
+        help=(
+            "任意: 血統の類似検索用索引（祖先の重み + MinHash の LSH バケット）の出力パス。"
+            "--summary-output と同じ世代で公開する。"
+        ),
+    )
+    parser.add_argument(
+        "--sqlite-output",
+        default=None,
+        help="任意: 馬・血統・因子・全兄弟グループを索引付きで入れた SQLite データベースのパス。",
+    )
+    parser.add_argument(
+        "--sqlite-upsert",
+        action="store_true",
+        help="--sqlite-output を作り直さず、今回の馬だけを id で追加・更新する（他の馬は残す）。",
+    )
+    parser.add_argument(
+        "--parent-line-map",
+        default=None,
+        help="任意: 親系統の追加マッピング JSON（{\"表記\": \"2文字コード\"}）。組み込みの表より優先。",
+    )
     args = parser.parse_args(argv)
+    if args.resume and not args.checkpoint:
+        parser.error("--resume には --checkpoint が必要です。")
+    if args.parent_line_map:
+        try:
+            added = PARENT_LINES.load(Path(args.parent_line_map))
+        except (OSError, ValueError) as e:
+            parser.error(f"--parent-line-map を読めません: {e}")
+        print(f"parent-line-map: {args.parent_line_map} ({added} mappings)")
 
     output_path = Path(args.output)
     summary_output_path = Path(args.summary_output) if args.summary_output else None
@@ -773,6 +1685,39 @@ def main(argv: Optional[list[str]] = None) -> int:
     chunk_size = max(1, args.detail_chunk_size)
     all_output_path = Path(args.all_output) if args.all_output else None
     urls_file = Path(args.urls_file) if args.urls_file else None
+    profiler = StageProfiler(Path(args.profile) if args.profile else None)
+    journal = CheckpointJournal(Path(args.checkpoint)) if args.checkpoint else None
+    diff_output_path = Path(args.diff_output) if args.diff_output else None
+    diff_base_summary = Path(args.diff_base_summary) if args.diff_base_summary else summary_output_path
+    if args.diff_base_details_dir:
+        diff_base_details_dir: Optional[Path] = Path(args.diff_base_details_dir)
+    else:
+        diff_base_details_dir = details_output_dir
+    if diff_output_path is not None and diff_base_summary is None:
+        parser.error("--diff-output には --diff-base-summary か --summary-output が必要です。")
+    if args.merge and (summary_output_path is None or details_output_dir is None):
+        parser.error("--merge には既存の --summary-output と --details-output-dir が必要です。")
+    ancestor_index_path = Path(args.ancestor_index_output) if args.ancestor_index_output else None
+    if ancestor_index_path is not None and summary_output_path is None:
+        parser.error("--ancestor-index-output には --summary-output が必要です。")
+    pedigree_path = Path(args.pedigree_output) if args.pedigree_output else None
+    if pedigree_path is not None and summary_output_path is None:
+        parser.error("--pedigree-output には --summary-output が必要です。")
+    similarity_path = Path(args.similarity_output) if args.similarity_output else None
+    if similarity_path is not None and summary_output_path is None:
+        parser.error("--similarity-output には --summary-output が必要です。")
+    sqlite_path = Path(args.sqlite_output) if args.sqlite_output else None
+    if args.sqlite_upsert and sqlite_path is None:
+        parser.error("--sqlite-upsert には --sqlite-output が必要です。")
+    if args.hashed_assets and summary_output_path is None and details_output_dir is None:
+        parser.error("--hashed-assets には --summary-output か --details-output-dir が必要です。")
+    if args.summary_aggregates and summary_output_path is None:
+        parser.error("--summary-aggregates には --summary-output が必要です。")
+    # 親系統のビット位置は --parent-line-map を読んだ後の既知コードで決める。
+    summary_aggregates = (
+        SummaryAggregates.from_codes(FACTOR_SHORT_DICT.values(), PARENT_LINES.codes)
+        if args.summary_aggregates else None
+    )
 
     # 出力前に親ディレクトリを作成する。
     output_path.parent.mkdir(parents=True, exist_ok=True)
@@ -787,10 +1732,75 @@ def main(argv: Optional[list[str]] = None) -> int:
     # 1) --urls-file（明示指定）
     # 2) 一覧ページから自動収集
     fetcher = Fetcher(timeout=args.timeout, retries=args.retries)
-    if urls_file is not None:
+    url_state_path = Path(args.url_state) if args.url_state else None
+    url_state: Optional[dict[str, str]] = None
+    added_urls: list[str] = []
+    removed_urls: list[str] = []
+    # 重複スキップした種牡馬の URL -> 残した馬の id（url-state に残し、次の --merge で取り直さない）。
+    previous_duplicates: dict[str, str] = {}
+    url_duplicates: dict[str, str] = {}
+    now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+    def _collect_listed_urls() -> list[str]:
+        """一覧ページの URL を集め、`--url-state` があれば前回との追加・削除を求める。"""
+        nonlocal url_state, added_urls, removed_urls, previous_duplicates
+        listed_urls = collect_horse_urls(fetcher)
+        if url_state_path is not None:
+            previous_state = load_url_state(url_state_path)
+            previous_duplicates = load_url_duplicates(url_state_path)
+            url_state, added_urls, removed_urls = diff_url_state(previous_state, listed_urls, now)
+            if previous_state is None:
+                print(f"url-state: {url_state_path} (initialized with {len(listed_urls)} urls)")
+            else:
+                print(f"url-state: {url_state_path} (added {len(added_urls)}, removed {len(removed_urls)})")
+            for url in added_urls:
+                print(f"[new] {url}")
+            for url in removed_urls:
+                print(f"[removed] {url}")
+        return listed_urls
+
+    merge_base: list[dict] = []
+    list_order: dict[str, int] = {}
+    if args.merge:
+        # 差し込み先の既存 entry を読み、--urls-file の URL + 一覧にあって既存に無い URL を取得対象にする。
+        base_by_id = load_published_entries(summary_output_path, details_output_dir)
+        missing_detail = [hid for hid, entry in base_by_id.items() if entry["descendants"] is None]
+        if not base_by_id or missing_detail:
+            print(
+                f"[error] merge base is incomplete: {summary_output_path} "
+                f"({len(base_by_id)} horses, {len(missing_detail)} without detail)"
+            )
+            fetcher.close()
+            return 1
+        urls = load_horse_urls_from_file(urls_file) if urls_file is not None else []
+        listed_urls = _collect_listed_urls()
+        if url_state_path is None:
+            print("[warn] merge without --url-state: removed horses and skipped duplicate stallions are not tracked")
+        # 同じ ruby の馬の並びを全件クロールに揃えるための、id -> 一覧ページでの位置。
+        list_order = {
+            derive_horse_id("1" if "/broodmares/" in url else "0", url): position
+            for position, url in enumerate(listed_urls)
+        }
+        # 一覧から消えた馬は再取得せずに既存分から落とす。
+        removed_ids = {
+            derive_horse_id("1" if "/broodmares/" in url else "0", url) for url in removed_urls
+        }
+        merge_base = [entry for hid, entry in base_by_id.items() if hid not in removed_ids]
+        if removed_ids:
+            print(f"merge: dropped {len(base_by_id) - len(merge_base)} removed horses")
+        base_ids = {entry["id"] for entry in merge_base}
+        urls = select_merge_urls(urls, listed_urls, base_ids, previous_duplicates)
+        # 取り直さない重複は記録を引き継ぐ（取り直した分は今回の判定で記録し直す）。
+        fetched = set(urls)
+        url_duplicates = {
+            url: kept_id
+            for url, kept_id in previous_duplicates.items()
+            if url not in fetched and kept_id in base_ids
+        }
+    elif urls_file is not None:
         urls = load_horse_urls_from_file(urls_file)
     else:
-        urls = collect_horse_urls(fetcher)
+        urls = _collect_listed_urls()
     if args.limit > 0:
         urls = urls[: args.limit]
 
@@ -806,129 +1816,306 @@ def main(argv: Optional[list[str]] = None) -> int:
     if urls_file is not None:
         print(f"urls-file: {urls_file}")
     if all_output_path:
-        print(f"all-output: {all_output_path}")
-
-    written = 0
-    skipped = 0
-    errors = 0
-    stallion_last_name = ""
-    stallion_last_ability = ""
-    # summary / details を後段でまとめて書くため、書き出し順に entry を保持する。
-    # （full JSON は従来どおりストリーム書き込み。entry 約 2,800 件はメモリ上問題ない）
-    need_split_output = summary_output_path is not None or details_output_dir is not None
-    entries: list[dict] = []
-
-    all_fp = all_output_path.open("w", encoding="utf-8", newline="\n") if all_output_path else None
-
-    def _fetch_and_parse(idx: int, url: str) -> tuple[int, str, Optional[list[str]], Optional[str]]:
-        """ワーカースレッドで実行: フェッチ＋パースして (idx, url, row, error) を返す。"""
-        try:
-            soup = fetcher.fetch_soup(url)
-            if "/broodmares/" in url:
-                row = parse_broodmare(url, idx, soup)
-            else:
-                row = parse_stallion(url, idx, soup)
-            if args.delay > 0:
-                time.sleep(args.delay)
-            return idx, url, row, None
-        except Exception as e:  # noqa: BLE001
-            return idx, url, None, str(e)
-
+        print(f"all-output: {all_output_path} (index {index_path_for(all_output_path)})")
+    if args.merge:
+        print(f"merge: base {len(merge_base)} horses")
+    if profiler.enabled:
+        print(f"profile: {profiler.out_dir}")
+        profiler.start()
+
+    # 失敗で途中終了した回も、そこまでの profile を残す。
     try:
-        with output_path.open("w", encoding="utf-8", newline="\n") as out:
-            out.write('{"horseLists":[')
-            first = True
+        # 再開時は journal のうち今回の URL リストにある URL を、今回の位置に付け直して再生する。
+        replayed: dict[int, tuple[str, Optional[AllRow]]] = {}
+        if journal is not None:
+            if args.resume:
+                replayed = journal.replay(urls)
+                print(f"checkpoint: {journal.path} (resume {len(replayed)}/{len(urls)})")
+            else:
+                print(f"checkpoint: {journal.path}")
+            journal.open(resume=args.resume)
+
+        written = 0
+        skipped = 0
+        errors = 0
+        # summary / details を後段でまとめて書くため、書き出し順に entry を保持する。
+        # （full JSON は従来どおりストリーム書き込み。entry 約 2,800 件はメモリ上問題ない）
+        need_split_output = summary_output_path is not None or details_output_dir is not None
+        need_entries = need_split_output or diff_output_path is not None or args.merge or sqlite_path is not None
+        entries: list[dict] = []
+
+        all_writer = AllRowsWriter(all_output_path) if all_output_path else None
+
+        def _fetch_and_parse(idx: int, url: str) -> tuple[int, str, Optional[AllRow], Optional[str]]:
+            """ワーカースレッドで実行: フェッチ＋パースして (idx, url, row, error) を返す。"""
+            try:
+                soup = fetcher.fetch_soup(url)
+                with profiler.stage("parse"):
+                    if "/broodmares/" in url:
+                        row = parse_broodmare(url, idx, soup)
+                    else:
+                        row = parse_stallion(url, idx, soup)
+                if args.delay > 0:
+                    time.sleep(args.delay)
+                return idx, url, row, None
+            except Exception as e:  # noqa: BLE001
+                return idx, url, None, str(e)
 
-            # バッチ単位で並列フェッチし、元の URL 順で書き出す。
-            batch_size = workers * 2
-            for batch_start in range(0, len(urls), batch_size):
-                batch_urls = urls[batch_start:batch_start + batch_size]
-                # バッチ内の結果を idx 順に格納するバッファ。
-                results: dict[int, tuple[str, Optional[list[str]], Optional[str]]] = {}
-
-                with ThreadPoolExecutor(max_workers=workers) as pool:
-                    futures = {
-                        pool.submit(_fetch_and_parse, batch_start + i + 1, url): batch_start + i + 1
-                        for i, url in enumerate(batch_urls)
-                    }
+        # full JSON は通常ストリーム書き込み。--merge 時は既存分と合わせて後段でまとめて書く。
+        # 一時ファイルへ書き、最後まで書けて検証も通ったときだけ差し替える（途中で落ちても前回分が残る）。
+        out = None if args.merge else partial_path(output_path).open("w", encoding="utf-8", newline="\n")
+        out_complete = False
+        try:
+            # 取得は 1 つのプールへまとめて投げ、完了順に受け取る（バッチの区切りで待たない）。
+            # 前回から増えた URL を先に投げるので、途中で落ちても新馬は journal に残る。
+            # 書き出しは下で URL 番号順に並べ直してから行うので、出力順と重複スキップは変わらない。
+            priority = set(added_urls)
+            todo = [i + 1 for i, url in enumerate(urls) if (i + 1) not in replayed]
+            priority_idxs = [idx for idx in todo if urls[idx - 1] in priority]
+            if priority_idxs:
+                print(f"prefetch new urls: {len(priority_idxs)}")
+            todo = priority_idxs + [idx for idx in todo if urls[idx - 1] not in priority]
+
+            def _completed() -> Iterator[tuple[int, str, Optional[AllRow], Optional[str]]]:
+                """journal の再生分と、取得・解析が済んだ結果を完了順に返す。"""
+                for idx, (url, row) in sorted(replayed.items()):
+                    yield idx, url, row, None
+                pool = ThreadPoolExecutor(max_workers=workers)
+                try:
+                    futures = [pool.submit(_fetch_and_parse, idx, urls[idx - 1]) for idx in todo]
                     for future in as_completed(futures):
                         idx, url, row, err = future.result()
-                        results[idx] = (url, row, err)
-
-                # 元の URL 順で逐次書き出し（重複スキップロジックを維持）。
-                for i in range(len(batch_urls)):
-                    idx = batch_start + i + 1
-                    url, row, err = results[idx]
-
-                    if err is not None:
-                        errors += 1
-                        print(f"[error] {url}: {err}")
-                        continue
-
-                    if row is None:
-                        skipped += 1
-                        continue
-
-                    # VBA 互換: 種牡馬は「馬名 + 非凡」が連続重複ならスキップ。
-                    if row_get(row, HD_GENDER) == "0":
-                        current_name = row_get(row, HD_HORSE_NAME)
-                        current_ability = row_get(row, HD_ABILITY)
-                        if current_name == stallion_last_name and current_ability == stallion_last_ability:
-                            skipped += 1
-                            continue
-                        stallion_last_name = current_name
-                        stallion_last_ability = current_ability
-
-                    entry = all_row_to_dabifac_entry(row)
-                    serialized = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
-                    if not first:
-                        out.write(",")
-                    out.write(serialized)
-                    first = False
-
-                    if need_split_output:
-                        entries.append(entry)
+                        if journal is not None and err is None:
+                            journal.record(idx, url, row)
+                        yield idx, url, row, err
+                finally:
+                    # 途中で止まったときに残りの取得を待たない。
+                    pool.shutdown(wait=True, cancel_futures=True)
+
+            if out is not None:
+                out.write('{"horseLists":[')
+            first = True
 
-                    if all_fp is not None:
-                        all_fp.write(
-                            json.dumps(all_row_to_sparse_dict(row), ensure_ascii=False, separators=(",", ":"))
-                            + "\n"
-                        )
+            # 完了した結果を URL 番号で貯め、先頭から揃った分だけ元の URL 順で書き出す。
+            deduper = StallionDeduper()
+            results: dict[int, tuple[str, Optional[AllRow], Optional[str]]] = {}
+            next_idx = 1
+            # 3.12 以降の parse.prof はこの区間全体（全スレッド）を 1 つの Profile で取る。
+            with profiler.crawl():
+                for done_idx, done_url, done_row, done_err in _completed():
+                    results[done_idx] = (done_url, done_row, done_err)
+                    if done_row is not None:
+                        deduper.offer(done_idx, done_row)
+                    while next_idx in results:
+                        idx = next_idx
+                        next_idx += 1
+                        url, row, err = results.pop(idx)
+
+                        if err is not None:
+                            errors += 1
+                            print(f"[error] {url}: {err}")
+                            continue
 
-                    written += 1
-                    if args.progress > 0 and written % args.progress == 0:
-                        print(f"processed: {written} (source index {idx})")
+                        if row is None:
+                            skipped += 1
+                            continue
 
-            out.write("]}\n")
+                        # VBA 互換: 種牡馬は「馬名 + 非凡」が重複ならスキップ（StallionDeduper）。
+                        if not deduper.keep(idx, row):
+                            skipped += 1
+                            kept_url = urls[deduper.first_index(row) - 1]
+                            url_duplicates[url] = derive_horse_id("0", kept_url)
+                            continue
 
-    finally:
-        if all_fp is not None:
-            all_fp.close()
-        fetcher.close()
-
-    # summary / details の書き出し（指定時のみ）。
-    if need_split_output:
-        # id 一意性チェック（指摘 A / テスト計画 E）。重複は致命的なので即エラー終了。
-        id_counts: dict[str, int] = {}
-        for entry in entries:
-            id_counts[entry["id"]] = id_counts.get(entry["id"], 0) + 1
-        duplicate_ids = {hid: n for hid, n in id_counts.items() if n > 1}
-        if duplicate_ids:
-            sample = list(duplicate_ids.items())[:5]
-            print(f"[error] duplicate horse ids detected: {sample} (total {len(duplicate_ids)})")
+                        with profiler.stage("convert"):
+                            entry = all_row_to_dabifac_entry(row)
+                            serialized = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+                        if out is not None:
+                            if not first:
+                                out.write(",")
+                            out.write(serialized)
+                            first = False
+
+                        if need_entries:
+                            entries.append(entry)
+
+                        if all_writer is not None:
+                            all_writer.write(entry["id"], url, all_row_to_sparse_dict(row))
+
+                        written += 1
+                        if args.progress > 0 and written % args.progress == 0:
+                            print(f"processed: {written} (source index {idx})")
+
+            for idx, name in deduper.non_adjacent:
+                # VBA の「直前と同じならスキップ」では残っていた馬（URL 一覧の並びが変わった可能性）。
+                print(f"[warn] non-adjacent duplicate stallion skipped: {name} (source index {idx})")
+
+            if out is not None:
+                out.write("]}\n")
+            out_complete = True
+
+        finally:
+            if out is not None:
+                out.close()
+                if not out_complete:
+                    partial_path(output_path).unlink(missing_ok=True)
+            if all_writer is not None:
+                all_writer.close()
+            if journal is not None:
+                journal.close()
+            fetcher.close()
+        profiler.snapshot("crawl")
+
+        if args.merge:
+            fetched = len(entries)
+            entries = merge_entries(merge_base, entries, list_order)
+            print(f"merged: {fetched} fetched into {len(merge_base)} -> {len(entries)} horses")
+
+        # 差分は上書き前の公開物と比べる必要があるので、summary / details より先に取る。
+        if diff_output_path is not None and diff_base_summary is not None:
+            previous = load_published_entries(diff_base_summary, diff_base_details_dir)
+            diff = diff_entries(previous, entries)
+            write_diff(diff_output_path, diff)
+            counts = diff["counts"]
+            print(
+                f"diff written: {diff_output_path} (base {len(previous)} horses; "
+                f"added={counts['added']}, removed={counts['removed']}, changed={counts['changed']})"
+            )
+
+        # summary / details の書き出し（指定時のみ）。
+        if need_split_output:
+            # id 一意性チェック（指摘 A / テスト計画 E）。重複は致命的なので即エラー終了。
+            id_counts: dict[str, int] = {}
+            for entry in entries:
+                id_counts[entry["id"]] = id_counts.get(entry["id"], 0) + 1
+            duplicate_ids = {hid: n for hid, n in id_counts.items() if n > 1}
+            if duplicate_ids:
+                sample = list(duplicate_ids.items())[:5]
+                print(f"[error] duplicate horse ids detected: {sample} (total {len(duplicate_ids)})")
+                partial_path(output_path).unlink(missing_ok=True)
+                return 1
+
+            # ステージングへ書いてから世代ディレクトリとして置き、manifest を差し替えて公開する（dabimas.publish）。
+            # 固定パスの summary / details などは、その後に世代ディレクトリからコピーする互換用のミラー。
+            publisher = GenerationPublisher(summary_output_path, details_output_dir, hashed_copies=args.hashed_assets)
+            bros_path = publisher.manifest_path.parent / BROS_DATA_FILENAME
+            inbreed_path = publisher.manifest_path.parent / INBREED_EXCEPTIONS_FILENAME
+            if args.hashed_assets:
+                # 手書きの JSON も内容ハッシュ付きで manifest に載せ、クライアントが変更を検出できるようにする。
+                publisher.track_file(bros_path)
+                publisher.track_file(inbreed_path)
+            publisher.begin()
+            try:
+                with profiler.stage("write"):
+                    if publisher.staged_summary is not None:
+                        write_summary(publisher.staged_summary, entries, chunk_size, summary_aggregates)
+                    if publisher.staged_details is not None:
+                        num_chunks = write_details(publisher.staged_details, entries, chunk_size)
+                    if ancestor_index_path is not None:
+                        ancestor_index = AncestorIndex.from_descendants(e["descendants"] for e in entries)
+                        ancestor_index.write(publisher.stage_file(ancestor_index_path))
+                    if pedigree_path is not None:
+                        pedigree = PedigreeGraph.build(entries, [e["descendants"] for e in entries])
+                        pedigree.write(publisher.stage_file(pedigree_path))
+                    if similarity_path is not None:
+                        similarity = SimilarityIndex.build(e["descendants"] for e in entries)
+                        similarity.write(publisher.stage_file(similarity_path))
+                # 検証ゲート: ステージングの内容（と同じ場所の手書き JSON）が壊れていれば公開しない。
+                validator = ArtifactValidator(FACTOR_SHORT_DICT.values(), PARENT_LINES.codes)
+                started = time.perf_counter()
+                problems = validator.validate_files(
+                    publisher.staged_summary,
+                    publisher.staged_details,
+                    bros_path if bros_path.exists() else None,
+                    inbreed_path if inbreed_path.exists() else None,
+                )
+                if problems:
+                    for problem in problems[:VALIDATION_REPORT_LIMIT]:
+                        print(f"[error] validation: {problem}")
+                    print(f"[error] validation failed: {len(problems)} problems; nothing was published")
+                    publisher.abort()
+                    partial_path(output_path).unlink(missing_ok=True)
+                    return 1
+                print(f"validation passed: {len(entries)} horses ({time.perf_counter() - started:.3f}s)")
+                with profiler.stage("write"):
+                    manifest = publisher.publish(chunk_size, len(entries))
+            except BaseException:
+                publisher.abort()
+                raise
+            if summary_output_path is not None:
+                print(f"summary written: {summary_output_path} ({len(entries)} horses)")
+            if details_output_dir is not None:
+                print(f"details written: {details_output_dir} ({num_chunks} chunks)")
+            if ancestor_index_path is not None:
+                print(f"ancestor index written: {ancestor_index_path} ({len(ancestor_index)} ancestors)")
+            if pedigree_path is not None:
+                stats = pedigree.stats
+                print(
+                    f"pedigree written: {pedigree_path} (resolved {stats.resolved}, unresolved {stats.unresolved}, "
+                    f"ambiguous {stats.ambiguous}, cut cycles {stats.cut_edges})"
+                )
+            if similarity_path is not None:
+                print(
+                    f"similarity index written: {similarity_path} "
+                    f"({similarity.num_perm} hashes in {similarity.bands} bands)"
+                )
+            print(
+                f"manifest written: {publisher.manifest_path} "
+                f"(generation {manifest['generation']} in {manifest['directory']})"
+            )
+            if publisher.hashed_dir is not None:
+                hashed = manifest_entries(manifest)
+                print(
+                    f"hashed copies: {publisher.hashed_dir} ({len(hashed)} files, "
+                    f"{sum(entry['size'] for entry in hashed)} bytes referenced)"
+                )
+            profiler.snapshot("write")
+
+        if sqlite_path is not None:
+            # 全兄弟グループは summary（無ければ full JSON）と同じ場所の brosData.json から取る。
+            bros_path = (summary_output_path or output_path).parent / BROS_DATA_FILENAME
+            siblings = SiblingIndex.load(bros_path) if bros_path.exists() else None
+            with profiler.stage("write"), HorseDatabase.open(sqlite_path) as database:
+                if args.sqlite_upsert:
+                    db_stats = database.upsert(entries, siblings)
+                else:
+                    db_stats = database.replace(entries, siblings)
+            print(
+                f"sqlite {'upserted' if args.sqlite_upsert else 'written'}: {sqlite_path} "
+                f"({db_stats.horses} horses, {db_stats.descendants} descendants, {db_stats.factors} factors, "
+                f"{db_stats.sibling_names} sibling names; {db_stats.seconds:.3f}s)"
+            )
+
+        # full JSON は検証を通ってから差し替える（--merge は合流後の entry 列から書く）。
+        if args.merge:
+            write_full(output_path, entries)
+        else:
+            replace_file(partial_path(output_path), output_path)
+
+        # 略称に解決できなかった因子画像（FACTOR_SHORT_DICT 未登録の新アイコン等）を報告する。
+        for url, count in sorted(FACTOR_URLS.unknown.items(), key=lambda kv: -kv[1]):
+            print(f"[warn] unknown factor icon: {url} ({count})")
+        # 正規化表に無かった親系統の表記（新系統・表記ゆれ）と、補完したコードを報告する。
+        for raw, count in sorted(PARENT_LINES.unknown.items(), key=lambda kv: -kv[1]):
+            print(f"[warn] unknown parent line: {raw!r} -> {get_parent_line_name(raw)!r} ({count})")
+
+        print(f"done: written={written}, skipped={skipped}, errors={errors}")
+        if FACTOR_URLS.unknown:
+            print(f"unknown factor icons: {len(FACTOR_URLS.unknown)} urls, {sum(FACTOR_URLS.unknown.values())} slots")
+        if PARENT_LINES.unknown:
+            print(
+                f"unknown parent lines: {len(PARENT_LINES.unknown)} values, "
+                f"{sum(PARENT_LINES.unknown.values())} occurrences (add them with --parent-line-map)"
+            )
+        if args.fail_on_error and errors > 0:
             return 1
-
-        if summary_output_path is not None:
-            write_summary(summary_output_path, entries, chunk_size)
-            print(f"summary written: {summary_output_path} ({len(entries)} horses)")
-        if details_output_dir is not None:
-            num_chunks = write_details(details_output_dir, entries, chunk_size)
-            print(f"details written: {details_output_dir} ({num_chunks} chunks)")
-
-    print(f"done: written={written}, skipped={skipped}, errors={errors}")
-    if args.fail_on_error and errors > 0:
-        return 1
-    return 0
+        # 状態は実行が通ったときだけ進める（失敗した回の新規 URL は次回も新規として扱う）。
+        if url_state_path is not None and url_state is not None:
+            write_url_state(url_state_path, url_state, added_urls, removed_urls, now, url_duplicates)
+        return 0
+    finally:
+        for report_path in profiler.write_reports():
+            print(f"profile written: {report_path}")
 
 
 if __name__ == "__main__":
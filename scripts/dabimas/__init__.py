@@ -0,0 +1,55 @@
+"""
+dabimas
+
+`build_dabimas_stream.py` が出力する公開 JSON（summary + detail chunk）を
+Python から引くための小さなライブラリ。
+
+- `query.DabimasDataset`: summary を 1 回だけ読み、id / 馬名 / 親系統 / 因子の索引を持つ。
+  detail chunk は `detailChunk` を頼りに必要になった chunk だけを読み、LRU に保持する。
+- `publish.GenerationPublisher`: ステージングへ書いた summary / chunk を不変な世代ディレクトリとして
+  置き、manifest（現在の世代へのポインタ）の置き換えで公開する。固定パスの公開物は互換用のミラー。
+- `aggregates.SummaryAggregates`: summary の集計列（血統の因子本数・因子持ちの祖先数・親系統ビットマスク）の
+  並びと作り方。detail chunk を読まずに血統の因子で並べ替え・絞り込みできる。
+- `allrows.AllRowsReader`: `--all-output` の NDJSON を mmap し、隣の位置索引で id / URL の 1 行だけを読む。
+- `ancestors.AncestorIndex`: 祖先名 -> (馬の序数, 血統スロット) の逆引き索引。複数祖先の
+  積集合は posting list の突き合わせで求める（`DabimasDataset.with_ancestors()`）。
+- `pedigree.PedigreeGraph`: 祖先 15 枠の馬名を種牡馬レコードへ解決した血統 DAG。解決済みの
+  祖先の血統を継ぎ足して任意の深さまで展開する（`DabimasDataset.ancestry()`）。
+- `siblings.SiblingIndex`: brosData.json を union-find でまとめた全兄弟・全姉妹グループ。
+  兄弟判定・メンバー取得は O(1)、冗長な brosData.json をコンパクト形式から作り直せる。
+- `similarity.SimilarityIndex`: 祖先の重み付き集合の MinHash / LSH 索引。候補だけを正確な
+  類似度で並べ直して「血統が似ている馬」の上位 k 頭を返す（`DabimasDataset.similar()`）。
+- `database.HorseDatabase`: 馬・血統・因子・全兄弟グループを正規化した SQLite（WAL、1 トランザクションで
+  全入れ替え / id ごとの upsert）。分析用の索引付き SQL を標準ライブラリだけで引ける。
+- `mating.judge_crosses`: 種牡馬 x 繁殖牝馬の血統表でアプリの judgeInbreed と同じクロス枠を求める
+  （`scripts/top_mates.py` が種牡馬ごとのお勧め繁殖牝馬の計算に使う）。
+- `validate.ArtifactValidator`: 公開 JSON と brosData / inbreed-exceptions の構造検証（公開前のゲート）。
+"""
+
+from dabimas.aggregates import SummaryAggregates
+from dabimas.allrows import AllRowsReader
+from dabimas.ancestors import AncestorIndex
+from dabimas.database import HorseDatabase
+from dabimas.mating import judge_crosses
+from dabimas.pedigree import PedigreeGraph
+from dabimas.publish import GenerationChangedError, GenerationPublisher
+from dabimas.query import DabimasDataset, detail_chunk_filename
+from dabimas.siblings import SiblingIndex
+from dabimas.similarity import SimilarityIndex
+from dabimas.validate import ArtifactValidator
+
+__all__ = [
+    "AllRowsReader",
+    "AncestorIndex",
+    "ArtifactValidator",
+    "DabimasDataset",
+    "GenerationChangedError",
+    "GenerationPublisher",
+    "HorseDatabase",
+    "PedigreeGraph",
+    "SiblingIndex",
+    "SimilarityIndex",
+    "SummaryAggregates",
+    "detail_chunk_filename",
+    "judge_crosses",
+]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+summary に焼き込む血統の集計列（`--summary-aggregates`）。
+
+「血統に短因子が何本あるか」で並べ替え・絞り込みをするのに detail chunk を全部読まずに
+済むよう、descendants（15 頭）から次の列を作って summary の各馬に足す:
+
+- `pedigreeFactors`: 因子ごとの本数（祖先 15 頭の因子枠を数えたもの）。並びは見出しの `factors`。
+- `factorAncestors`: 因子を 1 つ以上持つ祖先の頭数。
+- `parentLineMask`: 祖先に現れる親系統のビットマスク。ビット i が見出しの `parentLines[i]`。
+
+列の並びは summary の先頭の見出しに 1 回だけ書く:
+
+    {"version": 1, "chunkSize": 128,
+     "aggregates": {"factors": ["短", "速", ...], "parentLines": ["Ec", "Fa", ...]},
+     "horseLists": [{..., "pedigreeFactors": [0, 2, ...], "factorAncestors": 5, "parentLineMask": 1061}, ...]}
+
+親系統のビット位置は既知コードの並び（`--parent-line-map` で増えうる）で決まるので、読み手は
+毎回見出しから引く。既知コードに無い親系統（表に無い表記の補い）はマスクに入れない。
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, Sequence
+
+
+class SummaryAggregates:
+    """集計列の並び（因子略称 / 親系統コード）と、descendants -> 集計列の変換。"""
+
+    def __init__(self, factors: Sequence[str], parent_lines: Sequence[str]):
+        self.factors = list(factors)
+        self.parent_lines = list(parent_lines)
+        self._factor_slot = {factor: i for i, factor in enumerate(self.factors)}
+        self._parent_line_bit = {code: 1 << i for i, code in enumerate(self.parent_lines)}
+
+    @classmethod
+    def from_codes(cls, factors: Iterable[str], parent_lines: Iterable[str]) -> "SummaryAggregates":
+        """因子略称（因子番号順）と親系統コード（集合でよい。コード順に並べる）から作る。"""
+        return cls(list(factors), sorted(set(parent_lines)))
+
+    @classmethod
+    def from_header(cls, header: dict) -> "SummaryAggregates":
+        """summary の `aggregates` 見出しから作る。"""
+        return cls(header["factors"], header["parentLines"])
+
+    def header(self) -> dict:
+        return {"factors": self.factors, "parentLines": self.parent_lines}
+
+    def columns(self, descendants: Iterable[dict]) -> dict:
+        """descendants から summary 1 件分の集計列を作る。"""
+        counts = [0] * len(self.factors)
+        ancestors = 0
+        mask = 0
+        for d in descendants:
+            has_factor = False
+            for factor in d.get("factors") or ():
+                slot = self._factor_slot.get(factor)
+                if slot is not None:
+                    counts[slot] += 1
+                    has_factor = True
+            ancestors += has_factor
+            mask |= self._parent_line_bit.get(d.get("parentLine", ""), 0)
+        return {"pedigreeFactors": counts, "factorAncestors": ancestors, "parentLineMask": mask}
+
+    def factor_count(self, horse: dict, factor: str) -> int:
+        """summary 1 件の血統にある `factor` の本数（未知の略称は 0）。"""
+        slot = self._factor_slot.get(factor)
+        return horse["pedigreeFactors"][slot] if slot is not None else 0
+
+    def parent_lines_of(self, horse: dict) -> list[str]:
+        """summary 1 件の `parentLineMask` を親系統コードの列に戻す。"""
+        mask = horse["parentLineMask"]
+        return [code for i, code in enumerate(self.parent_lines) if mask >> i & 1]
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+`--all-output`（sparse ALL 行の NDJSON）の位置索引と、1 行だけを読む reader。
+
+writer（`AllRowsWriter`）は NDJSON を書きながら各行のバイト位置と長さを数え、閉じるときに
+隣へ索引（`<NDJSON 名>.index.json`）を書く:
+
+    {"version": 1, "size": <NDJSON のバイト数>, "ids": [...], "urls": [...], "offsets": [...], "lengths": [...]}
+
+4 つの配列は NDJSON の行順。reader（`AllRowsReader`）は NDJSON を mmap し、id か URL で引いた
+1 行だけを JSON デコードする。何 MB のダンプでも、1 頭分の生のパース結果をすぐ見られる。
+索引の `size` が NDJSON と合わなければ（書き直し途中・別の実行の索引）`ValueError` にする。
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional
+
+from dabimas.publish import replace_file
+
+
+INDEX_SUFFIX = ".index.json"
+
+
+def index_path_for(path: Path) -> Path:
+    """NDJSON `path` の索引ファイルのパス。"""
+    return path.with_name(path.name + INDEX_SUFFIX)
+
+
+class AllRowsWriter:
+    """sparse ALL 行を 1 行ずつ NDJSON へ書き、(id, URL) -> (位置, 長さ) を記録する。"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fp: Optional[BinaryIO] = path.open("wb")
+        self._offset = 0
+        self._ids: list[str] = []
+        self._urls: list[str] = []
+        self._offsets: list[int] = []
+        self._lengths: list[int] = []
+
+    def write(self, horse_id: str, url: str, sparse: dict[str, str]) -> None:
+        """1 行書く。長さは末尾の改行を含まない。"""
+        line = json.dumps(sparse, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self._fp.write(line + b"\n")
+        self._ids.append(horse_id)
+        self._urls.append(url)
+        self._offsets.append(self._offset)
+        self._lengths.append(len(line))
+        self._offset += len(line) + 1
+
+    def close(self) -> None:
+        """NDJSON を閉じ、索引を書く（NDJSON を書き終えてから索引を置く）。"""
+        if self._fp is None:
+            return
+        self._fp.close()
+        self._fp = None
+        index = {
+            "version": 1,
+            "size": self._offset,
+            "ids": self._ids,
+            "urls": self._urls,
+            "offsets": self._offsets,
+            "lengths": self._lengths,
+        }
+        tmp_path = index_path_for(self.path).with_suffix(".partial")
+        with tmp_path.open("w", encoding="utf-8", newline="\n") as fp:
+            json.dump(index, fp, ensure_ascii=False, separators=(",", ":"))
+            fp.write("\n")
+        replace_file(tmp_path, index_path_for(self.path))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class AllRowsReader:
+    """mmap した NDJSON から、索引で引いた行だけをデコードする。"""
+
+    def __init__(self, path: Path, index_path: Optional[Path] = None):
+        self.path = Path(path)
+        with (index_path or index_path_for(self.path)).open("r", encoding="utf-8") as fp:
+            index = json.load(fp)
+        size = self.path.stat().st_size
+        if index.get("size") != size:
+            raise ValueError(f"{self.path.name} is {size} bytes but its index expects {index.get('size')}")
+        spans = list(zip(index["offsets"], index["lengths"]))
+        self._by_key: dict[str, tuple[int, int]] = {}
+        for key, span in zip(index["ids"], spans):
+            self._by_key.setdefault(key, span)
+        for key, span in zip(index["urls"], spans):
+            self._by_key.setdefault(key, span)
+        self._ids: list[str] = index["ids"]
+        self._file = self.path.open("rb")
+        # 空ファイルは mmap できないので、行が無いものとして扱う。
+        self._map: Optional[mmap.mmap] = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self) -> "AllRowsReader":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._by_key
+
+    def ids(self) -> list[str]:
+        """NDJSON の行順の id。"""
+        return list(self._ids)
+
+    def raw(self, key: str) -> Optional[bytes]:
+        """id か URL の行（改行なしのバイト列）。無ければ None。"""
+        span = self._by_key.get(key)
+        if span is None or self._map is None:
+            return None
+        offset, length = span
+        return self._map[offset:offset + length]
+
+    def get(self, key: str) -> Optional[dict[str, str]]:
+        """id か URL の sparse ALL 行（`{"列番号": 値}`）。無ければ None。"""
+        line = self.raw(key)
+        return json.loads(line) if line is not None else None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ids)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+祖先の逆引き索引: 祖先名 -> (馬の序数, 血統スロット) の posting list。
+
+馬の序数は summary の `horseLists` での位置（0 始まり）、スロットは detail の
+`descendants` の位置（0〜14）。1 件を `序数 * SLOT_STRIDE + スロット` の整数に詰め、
+昇順に並べて持つ。ファイル（`dabimasFactor.ancestors.json`）では差分符号化して小さくする:
+
+    {"version": 1, "horses": N, "slotStride": 16, "names": [...], "postings": [[d0, d1, ...], ...]}
+
+`postings[i]` は `names[i]` の posting を先頭からの差分で並べたもの。序数は summary と
+同じ世代でしか意味を持たないので、build は summary / chunk と同じ世代として公開する。
+"""
+
+from __future__ import annotations
+
+import json
+from bisect import bisect_left
+from itertools import accumulate
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+
+ANCESTORS_FILENAME = "dabimasFactor.ancestors.json"
+# 1 頭あたりのスロット数（15）を収める刻み。
+SLOT_STRIDE = 16
+
+# intersect() の条件: 祖先名だけ、または (祖先名, スロットの集合)。
+AncestorTerm = Union[str, tuple[str, Iterable[int]]]
+
+
+class AncestorIndex:
+    """祖先名ごとの posting list（`序数 * SLOT_STRIDE + スロット` の昇順）。"""
+
+    def __init__(self, names: list[str], postings: list[list[int]], horses: int):
+        self.horses = horses
+        self._postings: dict[str, list[int]] = dict(zip(names, postings))
+
+    @classmethod
+    def from_descendants(cls, pedigrees: Iterable[Optional[list]]) -> "AncestorIndex":
+        """summary 順に並んだ各馬の descendants（無い馬は None）から作る。"""
+        postings: dict[str, list[int]] = {}
+        horses = 0
+        for ordinal, descendants in enumerate(pedigrees):
+            horses = ordinal + 1
+            for slot, ancestor in enumerate(descendants or ()):
+                name = ancestor.get("name", "")
+                if name:
+                    postings.setdefault(name, []).append(ordinal * SLOT_STRIDE + slot)
+        names = sorted(postings)
+        # 序数順・スロット順に追加しているので各 posting は既に昇順。
+        return cls(names, [postings[name] for name in names], horses)
+
+    @classmethod
+    def from_obj(cls, obj: dict) -> "AncestorIndex":
+        stride = obj.get("slotStride", SLOT_STRIDE)
+        if stride != SLOT_STRIDE:
+            raise ValueError(f"unsupported slotStride: {stride}")
+        postings = [list(accumulate(deltas)) for deltas in obj["postings"]]
+        return cls(obj["names"], postings, obj["horses"])
+
+    @classmethod
+    def load(cls, path: Path) -> "AncestorIndex":
+        with Path(path).open("r", encoding="utf-8") as fp:
+            return cls.from_obj(json.load(fp))
+
+    def to_obj(self) -> dict:
+        names = sorted(self._postings)
+        deltas = []
+        for name in names:
+            posting = self._postings[name]
+            deltas.append([posting[0]] + [b - a for a, b in zip(posting, posting[1:])])
+        return {
+            "version": 1,
+            "horses": self.horses,
+            "slotStride": SLOT_STRIDE,
+            "names": names,
+            "postings": deltas,
+        }
+
+    def write(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w", encoding="utf-8", newline="\n") as fp:
+            json.dump(self.to_obj(), fp, ensure_ascii=False, separators=(",", ":"))
+            fp.write("\n")
+
+    def __len__(self) -> int:
+        return len(self._postings)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._postings
+
+    def names(self) -> list[str]:
+        """索引にある祖先名（名前順）。"""
+        return sorted(self._postings)
+
+    def postings(self, name: str) -> list[tuple[int, int]]:
+        """祖先 `name` の (序数, スロット) 列（序数順）。"""
+        return [divmod(packed, SLOT_STRIDE) for packed in self._postings.get(name, ())]
+
+    def horses_with(self, name: str, slots: Optional[Iterable[int]] = None) -> list[int]:
+        """血統に `name` を持つ馬の序数（昇順・重複なし）。`slots` 指定時はそのスロットに限る。"""
+        wanted = frozenset(slots) if slots is not None else None
+        ordinals: list[int] = []
+        last = -1
+        for packed in self._postings.get(name, ()):
+            ordinal, slot = divmod(packed, SLOT_STRIDE)
+            if ordinal != last and (wanted is None or slot in wanted):
+                ordinals.append(ordinal)
+                last = ordinal
+        return ordinals
+
+    def slots_of(self, name: str, ordinal: int) -> list[int]:
+        """序数 `ordinal` の馬の血統で `name` が入っているスロット。"""
+        posting = self._postings.get(name, [])
+        i = bisect_left(posting, ordinal * SLOT_STRIDE)
+        slots = []
+        while i < len(posting) and posting[i] // SLOT_STRIDE == ordinal:
+            slots.append(posting[i] % SLOT_STRIDE)
+            i += 1
+        return slots
+
+    def intersect(self, terms: Iterable[AncestorTerm]) -> list[int]:
+        """
+        すべての条件を満たす馬の序数（昇順）。条件は祖先名か (祖先名, スロット集合)。
+
+        最も短い序数列を基準に、他の列を二分探索で前進させながら突き合わせる
+        （全馬の走査ではなく posting の長さに比例する）。
+        """
+        lists = []
+        for term in terms:
+            if isinstance(term, str):
+                lists.append(self.horses_with(term))
+            else:
+                name, slots = term
+                lists.append(self.horses_with(name, slots))
+        if not lists:
+            return []
+        lists.sort(key=len)
+        result = lists[0]
+        for other in lists[1:]:
+            if not result:
+                break
+            merged = []
+            lo = 0
+            for ordinal in result:
+                lo = bisect_left(other, ordinal, lo)
+                if lo == len(other):
+                    break
+                if other[lo] == ordinal:
+                    merged.append(ordinal)
+            result = merged
+        return result
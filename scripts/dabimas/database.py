@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+公開データの SQLite 版（分析用）: 馬・血統・因子・全兄弟グループを正規化した表に入れる。
+
+標準ライブラリの sqlite3 だけで、索引付きの SQL を引ける。表:
+
+    horses(id PK, name, ruby, sub_name, nature, sex, parent_line, son)
+    descendants(horse_id, slot, path, name, parent_line, son)          -- PK (horse_id, slot)
+    factors(horse_id, slot, position, factor)                          -- PK (horse_id, slot, position)
+    sibling_groups(name PK, group_id, sister)
+
+- `id` は `derive_horse_id` の安定 id（s<番号> / b<番号>）。
+- `slot` は detail の descendants の位置（0〜14）、`path` はその経路（`dabimas.pedigree.SLOT_PATHS`）。
+  `factors.slot` が `OWN_SLOT`（-1）の行は馬自身の因子。空の因子は入れない。
+- `sibling_groups` は brosData.json の全兄弟・全姉妹グループ（`dabimas.siblings`）。馬名で引く。
+
+例（ヘイローを父父に持ち、自身に「速」因子を持つ種牡馬）:
+
+    SELECT h.id, h.name FROM horses h
+    JOIN descendants d ON d.horse_id = h.id AND d.slot = 1 AND d.name = 'ヘイロー'
+    JOIN factors f ON f.horse_id = h.id AND f.slot = -1 AND f.factor = '速'
+    WHERE h.sex = '0';
+
+書き込みは WAL モードの 1 トランザクションで行い、読み手は常に前後どちらかの状態だけを見る。
+`replace()` は全表を入れ替え、`upsert()` は渡した馬だけを id で追加・更新する（他の馬は残す）。
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+
+from dabimas.pedigree import SLOT_PATHS
+from dabimas.siblings import SiblingIndex
+
+
+# スキーマの版（PRAGMA user_version）。表の形を変えたら上げる。
+SCHEMA_VERSION = 1
+# factors.slot で馬自身の因子を表す値。
+OWN_SLOT = -1
+TABLES = ("factors", "descendants", "sibling_groups", "horses")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS horses (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    ruby TEXT NOT NULL,
+    sub_name TEXT NOT NULL,
+    nature TEXT NOT NULL,
+    sex TEXT NOT NULL,
+    parent_line TEXT NOT NULL,
+    son TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS descendants (
+    horse_id TEXT NOT NULL REFERENCES horses(id) ON DELETE CASCADE,
+    slot INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    parent_line TEXT NOT NULL,
+    son TEXT NOT NULL,
+    PRIMARY KEY (horse_id, slot)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS factors (
+    horse_id TEXT NOT NULL REFERENCES horses(id) ON DELETE CASCADE,
+    slot INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    factor TEXT NOT NULL,
+    PRIMARY KEY (horse_id, slot, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sibling_groups (
+    name TEXT PRIMARY KEY,
+    group_id INTEGER NOT NULL,
+    sister INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS horses_name ON horses(name);
+CREATE INDEX IF NOT EXISTS horses_sex_parent_line ON horses(sex, parent_line);
+CREATE INDEX IF NOT EXISTS descendants_name ON descendants(name, slot);
+CREATE INDEX IF NOT EXISTS descendants_parent_line ON descendants(parent_line, slot);
+CREATE INDEX IF NOT EXISTS factors_factor ON factors(factor, slot);
+CREATE INDEX IF NOT EXISTS sibling_groups_group ON sibling_groups(group_id);
+"""
+
+_UPSERT_HORSE = """
+INSERT INTO horses (id, name, ruby, sub_name, nature, sex, parent_line, son)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET
+    name = excluded.name, ruby = excluded.ruby, sub_name = excluded.sub_name,
+    nature = excluded.nature, sex = excluded.sex, parent_line = excluded.parent_line,
+    son = excluded.son
+"""
+
+
+class DatabaseStats(NamedTuple):
+    horses: int
+    descendants: int
+    factors: int
+    sibling_names: int
+    seconds: float
+
+
+def _rows(entries: Iterable[dict]) -> tuple[list[tuple], list[tuple], list[tuple]]:
+    """entry 列を horses / descendants / factors の行にする。"""
+    horses, descendants, factors = [], [], []
+    for entry in entries:
+        horse_id = entry["id"]
+        horses.append((
+            horse_id, entry.get("name", ""), entry.get("ruby", ""), entry.get("subName", ""),
+            entry.get("nature", ""), entry.get("sex", ""), entry.get("parentLine", ""), entry.get("son", ""),
+        ))
+        for position, factor in enumerate(entry.get("factors") or ()):
+            if factor:
+                factors.append((horse_id, OWN_SLOT, position, factor))
+        for slot, ancestor in enumerate((entry.get("descendants") or ())[:len(SLOT_PATHS)]):
+            descendants.append((
+                horse_id, slot, SLOT_PATHS[slot], ancestor.get("name", ""),
+                ancestor.get("parentLine", ""), ancestor.get("son", ""),
+            ))
+            for position, factor in enumerate(ancestor.get("factors") or ()):
+                if factor:
+                    factors.append((horse_id, slot, position, factor))
+    return horses, descendants, factors
+
+
+class HorseDatabase:
+    """SQLite ファイル 1 つ。`open()` で WAL モード・外部キー有効の接続を作る。"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    @classmethod
+    def open(cls, path: Path) -> "HorseDatabase":
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # トランザクションは自前で BEGIN / COMMIT する。
+        conn = sqlite3.connect(str(path), isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        return cls(conn)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "HorseDatabase":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def _prepare(self, drop_old_schema: bool) -> None:
+        """スキーマを作る。版が違う既存の表は、全入れ替えなら作り直し、upsert ならエラー。"""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            if not drop_old_schema:
+                raise ValueError(f"database schema version {version} != {SCHEMA_VERSION}; rebuild it first")
+            for table in TABLES:
+                self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+        self.conn.executescript(SCHEMA)
+        self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def replace(self, entries: Iterable[dict], siblings: Optional[SiblingIndex] = None) -> DatabaseStats:
+        """全表を `entries`（と全兄弟グループ）で入れ替える（1 トランザクション）。"""
+        return self._write(entries, siblings, replace=True)
+
+    def upsert(self, entries: Iterable[dict], siblings: Optional[SiblingIndex] = None) -> DatabaseStats:
+        """
+        `entries` の馬だけを id で追加・更新する（1 トランザクション）。その馬の血統・因子は
+        入れ替え、他の馬には触れない。`siblings` を渡せば全兄弟グループは全体を入れ替える。
+        """
+        return self._write(entries, siblings, replace=False)
+
+    def _write(self, entries: Iterable[dict], siblings: Optional[SiblingIndex], replace: bool) -> DatabaseStats:
+        started = time.perf_counter()
+        horses, descendants, factors = _rows(entries)
+        conn = self.conn
+        self._prepare(drop_old_schema=replace)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if replace:
+                for table in TABLES:
+                    conn.execute(f"DELETE FROM {table}")
+            else:
+                ids = [(row[0],) for row in horses]
+                conn.executemany("DELETE FROM descendants WHERE horse_id = ?", ids)
+                conn.executemany("DELETE FROM factors WHERE horse_id = ?", ids)
+            conn.executemany(_UPSERT_HORSE, horses)
+            conn.executemany("INSERT INTO descendants VALUES (?, ?, ?, ?, ?, ?)", descendants)
+            conn.executemany("INSERT INTO factors VALUES (?, ?, ?, ?)", factors)
+            sibling_rows = []
+            if siblings is not None:
+                sibling_rows = [
+                    (name, group_id, int(siblings.is_sister(name)))
+                    for group_id, members in enumerate(siblings.to_compact()["groups"])
+                    for name in members
+                ]
+                conn.execute("DELETE FROM sibling_groups")
+                conn.executemany("INSERT INTO sibling_groups VALUES (?, ?, ?)", sibling_rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("PRAGMA optimize")
+        return DatabaseStats(len(horses), len(descendants), len(factors), len(sibling_rows),
+                             time.perf_counter() - started)
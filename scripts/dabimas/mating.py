@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+種牡馬 x 繁殖牝馬の組み合わせのクロス判定（アプリの `judgeInbreed` の Python 版）。
+
+アプリの血統表と同じ 32 枠で考える:
+
+- 父側 0〜15: 0 が種牡馬本人、1〜15 が種牡馬の descendants（`TABLE_ORDER` の順）
+- 母側 16〜30: 繁殖牝馬の descendants（`TABLE_ORDER` の順）。31 は空
+
+判定は `vue/logic/inbreed/inbreed-detector.js` と同じ手順で行う:
+
+1. 父側と母側で同名の組をクロス候補にし、世代の合計が小さい順に並べる
+2. inbreed-exceptions.json の例外ルールを先に当て、認定（`recognizeAsCross`）と
+   祖先の除外（`excludeAncestors` / `excludeAncestorBranches`）を決める
+3. 候補を順に見て、例外で除外された組・既に認定したクロスの祖先同士の組を飛ばし、残りを認定する
+4. 認定したクロスの馬名を持つ枠（両側すべて）をクロス枠とする。その数がアプリのクロス数
+
+アプリでは母側の枠に `(繁殖牝馬名)` の subName が付くため、全兄弟（brosData）による
+クロスは種牡馬 x 繁殖牝馬の組み合わせでは成立しない。ここでもそれに合わせて扱わない。
+祖先同士の除外は、アプリのように組を集合へ展開せず、認定済みの組の祖先集合と突き合わせる。
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional, Sequence
+
+
+INBREED_EXCEPTIONS_FILENAME = "inbreed-exceptions.json"
+# 血統表の枠 1〜15（父側）/ 16〜30（母側）に入れる descendants の位置。
+TABLE_ORDER = (0, 1, 8, 2, 5, 9, 12, 3, 4, 6, 7, 10, 11, 13, 14)
+TABLE_SIZE = 32
+DAM_OFFSET = 16
+# 枠 -> 世代（アプリの generationMap。母側も 16 を 1 代目として数える）。
+GENERATION_MAP = (
+    1, 2, 3, 3, 4, 4, 4, 4, 5, 5, 5, 5, 5, 5, 5, 5,
+    1, 2, 3, 3, 4, 4, 4, 4, 5, 5, 5, 5, 5, 5, 5, 5,
+)
+# 枠 -> (父, 母)。100 番台・200 番台は表に出ない牝馬の仮想枠（アプリの parentChildMap）。
+PARENT_MAP: dict[int, tuple[int, ...]] = {
+    0: (1, 100), 100: (3, 107), 107: (7, 115), 115: (15,),
+    1: (2, 101), 101: (5, 111), 111: (11,),
+    2: (4, 102), 102: (9,),
+    3: (6, 103), 103: (13,),
+    4: (8,), 5: (10,), 6: (12,), 7: (14,),
+    16: (17, 200), 200: (19, 207), 207: (23, 215), 215: (31,),
+    17: (18, 201), 201: (21, 211), 211: (27,),
+    18: (20, 202), 202: (25,),
+    19: (22, 203), 203: (29,),
+    20: (24,), 21: (26,), 22: (28,), 23: (30,),
+}
+# クロス判定の対象外にする馬名の接頭辞（アプリの isInbreedExcludedHorse）。
+EXCLUDED_PREFIX = "★"
+
+
+def load_exceptions(path: Path) -> list[dict]:
+    """inbreed-exceptions.json の例外ルール一覧。ファイルが無ければ空。"""
+    try:
+        with Path(path).open("r", encoding="utf-8") as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return []
+
+
+def _collect_ancestors(index: int) -> frozenset[int]:
+    found: set[int] = set()
+    stack = [index]
+    while stack:
+        for parent in PARENT_MAP.get(stack.pop(), ()):
+            if parent not in found:
+                found.add(parent)
+                stack.append(parent)
+    return frozenset(found)
+
+
+# 枠 -> その枠より上の全祖先枠（仮想枠を含む）。
+ANCESTORS: dict[int, frozenset[int]] = {
+    index: _collect_ancestors(index) for index in set(range(TABLE_SIZE)) | set(PARENT_MAP)
+}
+
+_OPERATORS = {
+    "<": lambda gen, target: gen < target,
+    "<=": lambda gen, target: gen <= target,
+    ">": lambda gen, target: gen > target,
+    ">=": lambda gen, target: gen >= target,
+    "==": lambda gen, target: gen == target,
+}
+
+
+def _generation_ok(gen: int, target: object, operator: object) -> bool:
+    """アプリの checkGenerationCondition（世代・演算子が欠けていれば不成立）。"""
+    compare = _OPERATORS.get(operator) if isinstance(operator, str) else None
+    return compare is not None and isinstance(target, int) and compare(gen, target)
+
+
+def _side_of(index: int) -> str:
+    return "stallion" if index < DAM_OFFSET else "broodmare"
+
+
+def _branch_root(index: int, path: object) -> Optional[int]:
+    """`["mother", "father"]` / `"mother.father"` の経路を枠からたどる（アプリの resolveExceptionBranchRoot）。"""
+    steps = path.split(".") if isinstance(path, str) else path if isinstance(path, list) else []
+    current = index
+    for step in steps:
+        if not step:
+            continue
+        parents = PARENT_MAP.get(current)
+        if not parents:
+            return None
+        if step in ("father", "sire"):
+            position = 0
+        elif step in ("mother", "dam"):
+            position = 1
+        else:
+            return None
+        if position >= len(parents):
+            return None
+        current = parents[position]
+    return current
+
+
+class PedigreeSide(NamedTuple):
+    """血統表の片側: 枠 -> 馬名 / 因子と、馬名 -> 枠の列。"""
+
+    names: dict[int, str]
+    factors: dict[int, tuple[str, ...]]
+    by_name: dict[str, tuple[int, ...]]
+
+
+def _side(entries: Iterable[tuple[int, Optional[dict]]]) -> PedigreeSide:
+    names: dict[int, str] = {}
+    factors: dict[int, tuple[str, ...]] = {}
+    by_name: dict[str, list[int]] = {}
+    for index, node in entries:
+        name = (node or {}).get("name") or ""
+        if not name or name.lstrip().startswith(EXCLUDED_PREFIX):
+            continue
+        names[index] = name
+        factors[index] = tuple(f for f in (node or {}).get("factors") or () if f)
+        by_name.setdefault(name, []).append(index)
+    return PedigreeSide(names, factors, {name: tuple(found) for name, found in by_name.items()})
+
+
+def sire_side(horse: dict, descendants: Optional[Sequence[dict]]) -> PedigreeSide:
+    """種牡馬を父側（枠 0〜15）に置く。"""
+    descendants = descendants or ()
+    entries = [(0, horse)]
+    for offset, slot in enumerate(TABLE_ORDER, start=1):
+        entries.append((offset, descendants[slot] if slot < len(descendants) else None))
+    return _side(entries)
+
+
+def dam_side(descendants: Optional[Sequence[dict]]) -> PedigreeSide:
+    """繁殖牝馬の血統を母側（枠 16〜30）に置く。"""
+    descendants = descendants or ()
+    return _side(
+        (DAM_OFFSET + offset, descendants[slot] if slot < len(descendants) else None)
+        for offset, slot in enumerate(TABLE_ORDER)
+    )
+
+
+class CrossResult(NamedTuple):
+    """クロス枠（昇順）と、その枠の因子の種類数・本数。"""
+
+    indexes: tuple[int, ...]
+    coverage: int
+    factors: int
+
+    @property
+    def count(self) -> int:
+        return len(self.indexes)
+
+
+def judge_crosses(sire: PedigreeSide, dam: PedigreeSide, rules: Sequence[dict]) -> CrossResult:
+    """父側・母側と例外ルールから、アプリと同じクロス枠を求める。"""
+    if not sire.names or not dam.names:
+        return CrossResult((), 0, 0)
+    shared = sire.by_name.keys() & dam.by_name.keys()
+    triggered = [
+        rule for rule in rules
+        if rule["trigger"].get("horse") in sire.by_name or rule["trigger"].get("horse") in dam.by_name
+    ]
+    if not shared and not triggered:
+        return CrossResult((), 0, 0)
+
+    candidates = [
+        (GENERATION_MAP[s] + GENERATION_MAP[b], s, b)
+        for name in shared
+        for s in sire.by_name[name]
+        for b in dam.by_name[name]
+    ]
+    # アプリは父側の枠順 -> 母側の枠順に候補を作ってから世代合計で安定ソートする。
+    candidates.sort()
+
+    recognized_names: set[str] = set()
+    excluded_targets: set[int] = set()
+    # 例外で除外した組は「祖先集合 A と B の間の組」として持つ。
+    exception_blocks: list[tuple[frozenset[int], frozenset[int]]] = []
+    for rule in triggered:
+        trigger, target, action = rule["trigger"], rule["target"], rule["action"]
+        trigger_indexes = [
+            i for side in (sire, dam) for i in side.by_name.get(trigger.get("horse"), ())
+            if _generation_ok(GENERATION_MAP[i], trigger.get("generation"), trigger.get("operator"))
+            # "stallion" / "broodmare" 以外（"either" など）はどちら側でもよい。
+            and trigger.get("side") not in ({"stallion", "broodmare"} - {_side_of(i)})
+        ]
+        for trigger_index in trigger_indexes:
+            trigger_side = _side_of(trigger_index)
+            wanted = target.get("side")
+            if wanted == "opposite":
+                sides = [dam] if trigger_side == "stallion" else [sire]
+            elif wanted == "same":
+                sides = [sire] if trigger_side == "stallion" else [dam]
+            elif wanted == "either":
+                sides = [sire, dam]
+            else:
+                continue
+            for side in sides:
+                for target_index in side.by_name.get(target.get("horse"), ()):
+                    if isinstance(target.get("generation"), int) and not _generation_ok(
+                        GENERATION_MAP[target_index], target["generation"], target.get("operator")
+                    ):
+                        continue
+                    if target_index in excluded_targets:
+                        continue
+                    if action.get("recognizeAsCross") is not False:
+                        recognized_names.add(side.names[target_index])
+                    if action.get("excludeAncestors"):
+                        branches = action.get("excludeAncestorBranches")
+                        if isinstance(branches, list) and branches:
+                            for branch in branches:
+                                t_root = _branch_root(trigger_index, branch.get("trigger"))
+                                g_root = _branch_root(target_index, branch.get("target"))
+                                t_anc = ANCESTORS.get(t_root, frozenset()) if t_root is not None else frozenset()
+                                g_anc = ANCESTORS.get(g_root, frozenset()) if g_root is not None else frozenset()
+                                excluded_targets.update(g_anc)
+                                exception_blocks.append((t_anc, g_anc))
+                        else:
+                            g_anc = ANCESTORS[target_index]
+                            excluded_targets.update(g_anc)
+                            exception_blocks.append((ANCESTORS[trigger_index] | {trigger_index}, g_anc))
+
+    accepted: list[tuple[int, int]] = []
+    for _, s, b in candidates:
+        if any((s in a and b in g) or (s in g and b in a) for a, g in exception_blocks):
+            continue
+        if any(s in ANCESTORS[rs] and b in ANCESTORS[rb] for rs, rb in accepted):
+            continue
+        accepted.append((s, b))
+        recognized_names.add(sire.names[s])
+
+    indexes = sorted(
+        i for side in (sire, dam) for name in recognized_names for i in side.by_name.get(name, ())
+    )
+    kinds: set[str] = set()
+    total = 0
+    for i in indexes:
+        own = sire.factors[i] if i < DAM_OFFSET else dam.factors[i]
+        kinds.update(own)
+        total += len(own)
+    return CrossResult(tuple(indexes), len(kinds), total)
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+血統の DAG: detail の祖先（15 枠）の馬名を summary の種牡馬レコードへ解決してつなぐ。
+
+15 枠はすべて牡の位置で、馬からの経路（F=父、M=母）は `SLOT_PATHS` のとおり:
+
+    0 F   1 FF   2 FFF   3 FFFF   4 FFMF   5 FMF   6 FMFF   7 FMMF
+    8 MF  9 MFF  10 MFFF  11 MFMF  12 MMF  13 MMFF  14 MMMF
+
+祖先が summary にいれば、その馬の 15 枠を経路の先へ継ぎ足せるので、クロールを増やさずに
+5 代より深い血統を展開できる（`PedigreeGraph.ancestry()`）。
+
+名前の解決（`PedigreeGraph.build()`）:
+
+- 候補は同名の種牡馬（sex "0"）。同じ馬の別カード（subName 違い）は血統が同じなので
+  1 つのノード（summary 順で先頭、subName が空のカードを優先）にまとめる。
+- 血統の違う同名馬が残れば、祖先の `son`（系統名）で絞り、それでも残れば
+  「その枠の馬の血統」と「元の馬の血統の該当経路」が一致する枠数で選ぶ（決まらなければ曖昧として数える）。
+- 解決した辺で循環ができた場合（同名異馬の取り違え）は DFS の後退辺を切って DAG にする。
+
+ファイル（`dabimasFactor.pedigree.json`）:
+
+    {"version": 1, "horses": N, "names": [...], "slots": [[c0, ..., c14], ...], "cutEdges": [[o, slot], ...]}
+
+`slots[o][s]` が 0 以上なら解決先の馬の序数（summary の位置）、負なら `names[-c - 1]`（未解決の馬名）。
+序数は summary と同じ世代でしか意味を持たないので、build は summary と同じ世代で公開する。
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional, Sequence
+
+
+PEDIGREE_FILENAME = "dabimasFactor.pedigree.json"
+SLOT_PATHS = (
+    "F", "FF", "FFF", "FFFF", "FFMF", "FMF", "FMFF", "FMMF",
+    "MF", "MFF", "MFFF", "MFMF", "MMF", "MMFF", "MMMF",
+)
+SLOT_INDEX = {path: slot for slot, path in enumerate(SLOT_PATHS)}
+STALLION = "0"
+# 枠 s の馬の枠 t が、元の馬のどの枠に当たるか（15 枠の範囲内に収まる組だけ）。
+_NESTED_SLOTS = tuple(
+    tuple((t, SLOT_INDEX[SLOT_PATHS[s] + SLOT_PATHS[t]]) for t in range(len(SLOT_PATHS))
+          if SLOT_PATHS[s] + SLOT_PATHS[t] in SLOT_INDEX)
+    for s in range(len(SLOT_PATHS))
+)
+
+
+class Ancestor(NamedTuple):
+    """展開した祖先 1 頭。`ordinal` は summary にいれば序数、いなければ None。"""
+
+    path: str
+    name: str
+    ordinal: Optional[int]
+
+
+class ResolveStats(NamedTuple):
+    resolved: int
+    unresolved: int
+    ambiguous: int
+    cut_edges: int
+
+
+class PedigreeGraph:
+    """馬の序数 -> 15 枠（解決先の序数 or 未解決名）の DAG と、展開結果のメモ。"""
+
+    def __init__(self, horse_names: Sequence[str], names: list[str], slots: list[list[int]],
+                 cut_edges: Iterable[Sequence[int]] = ()):
+        if len(slots) != len(horse_names):
+            raise ValueError(f"pedigree has {len(slots)} horses but the summary has {len(horse_names)}")
+        self.horse_names = list(horse_names)
+        self.names = names
+        self.slots = slots
+        self.cut_edges = [tuple(edge) for edge in cut_edges]
+        self.stats: Optional[ResolveStats] = None
+        # (序数, 深さ) -> 経路 -> Ancestor。同じ祖先を何度も展開しない。
+        self._memo: dict[tuple[int, int], dict[str, Ancestor]] = {}
+
+    @property
+    def horses(self) -> int:
+        return len(self.slots)
+
+    @classmethod
+    def build(cls, horses: Sequence[dict], pedigrees: Sequence[Optional[list]]) -> "PedigreeGraph":
+        """summary 順の馬レコードと、それぞれの descendants（無ければ None）から作る。"""
+        blank = [{"name": "", "son": ""}] * len(SLOT_PATHS)
+        pedigrees = [p if p else blank for p in pedigrees]
+
+        # 同名の種牡馬を血統ごとにまとめる: 馬名 -> [(代表の序数, 血統の馬名列)]。
+        candidates: dict[str, list[tuple[int, tuple[str, ...]]]] = {}
+        for ordinal, horse in enumerate(horses):
+            if horse.get("sex") != STALLION:
+                continue
+            signature = tuple(d.get("name", "") for d in pedigrees[ordinal])
+            groups = candidates.setdefault(horse.get("name", ""), [])
+            for i, (rep, rep_signature) in enumerate(groups):
+                if rep_signature == signature:
+                    if horses[rep].get("subName") and not horse.get("subName"):
+                        groups[i] = (ordinal, signature)
+                    break
+            else:
+                groups.append((ordinal, signature))
+
+        interned: dict[str, int] = {}
+        slots: list[list[int]] = []
+        resolved = unresolved = ambiguous = 0
+        for ordinal, descendants in enumerate(pedigrees):
+            own = [d.get("name", "") for d in descendants]
+            codes = []
+            for slot, d in enumerate(descendants):
+                name = d.get("name", "")
+                groups = candidates.get(name, [])
+                if len(groups) > 1:
+                    same_line = [g for g in groups if horses[g[0]].get("son") == d.get("son")]
+                    groups = same_line or groups
+                if len(groups) > 1:
+                    scores = [
+                        sum(signature[t] == own[u] for t, u in _NESTED_SLOTS[slot])
+                        for _, signature in groups
+                    ]
+                    best = max(scores)
+                    if scores.count(best) > 1:
+                        ambiguous += 1
+                    groups = [groups[scores.index(best)]]
+                if groups and name:
+                    codes.append(groups[0][0])
+                    resolved += 1
+                else:
+                    codes.append(-1 - interned.setdefault(name, len(interned)))
+                    if name:
+                        unresolved += 1
+            slots.append(codes)
+
+        cut_edges = _cut_cycles(slots, pedigrees, interned)
+        names = list(interned)
+        graph = cls([h.get("name", "") for h in horses], names, slots, cut_edges)
+        graph.stats = ResolveStats(resolved, unresolved, ambiguous, len(cut_edges))
+        return graph
+
+    @classmethod
+    def from_obj(cls, obj: dict, horse_names: Sequence[str]) -> "PedigreeGraph":
+        return cls(horse_names, obj["names"], obj["slots"], obj.get("cutEdges", ()))
+
+    @classmethod
+    def load(cls, path: Path, horse_names: Sequence[str]) -> "PedigreeGraph":
+        with Path(path).open("r", encoding="utf-8") as fp:
+            return cls.from_obj(json.load(fp), horse_names)
+
+    def to_obj(self) -> dict:
+        return {
+            "version": 1,
+            "horses": self.horses,
+            "names": self.names,
+            "slots": self.slots,
+            "cutEdges": [list(edge) for edge in self.cut_edges],
+        }
+
+    def write(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w", encoding="utf-8", newline="\n") as fp:
+            json.dump(self.to_obj(), fp, ensure_ascii=False, separators=(",", ":"))
+            fp.write("\n")
+
+    def _ancestor(self, path: str, code: int) -> Ancestor:
+        if code >= 0:
+            return Ancestor(path, self.horse_names[code], code)
+        return Ancestor(path, self.names[-code - 1], None)
+
+    def parents(self, ordinal: int) -> list[Ancestor]:
+        """15 枠をそのまま（空の枠も含めて）返す。"""
+        return [self._ancestor(SLOT_PATHS[s], code) for s, code in enumerate(self.slots[ordinal])]
+
+    def ancestry(self, ordinal: int, depth: int) -> dict[str, Ancestor]:
+        """
+        `depth` 代前までの牡の祖先を経路 -> Ancestor で返す（空の枠は含めない）。
+
+        自分の 15 枠を置き、解決済みの枠の馬の展開（深さを経路長だけ減らしたもの）を継ぎ足す。
+        同じ経路に両方あるときは自分の detail の値を優先する。(序数, 深さ) ごとにメモするので、
+        展開の手間は結果の大きさに比例する。循環は build 時に切ってあるが、念のため
+        展開中の馬に戻る枠はそれ以上たどらない。
+        """
+        return dict(self._expand(ordinal, depth, set()))
+
+    def _expand(self, ordinal: int, depth: int, visiting: set[int]) -> dict[str, Ancestor]:
+        key = (ordinal, depth)
+        cached = self._memo.get(key)
+        if cached is not None:
+            return cached
+        result: dict[str, Ancestor] = {}
+        if depth <= 0:
+            return result
+        codes = self.slots[ordinal]
+        for slot, code in enumerate(codes):
+            path = SLOT_PATHS[slot]
+            if len(path) <= depth and (code >= 0 or self.names[-code - 1]):
+                result[path] = self._ancestor(path, code)
+        visiting.add(ordinal)
+        for slot, code in enumerate(codes):
+            path = SLOT_PATHS[slot]
+            if code < 0 or len(path) >= depth or code in visiting:
+                continue
+            for sub_path, ancestor in self._expand(code, depth - len(path), visiting).items():
+                full = path + sub_path
+                if full not in result:
+                    result[full] = Ancestor(full, ancestor.name, ancestor.ordinal)
+        visiting.discard(ordinal)
+        self._memo[key] = result
+        return result
+
+    def crosses(self, ordinal: int, depth: int) -> dict[str, list[str]]:
+        """`depth` 代前までに 2 回以上現れる祖先名 -> 経路（短い順）。"""
+        paths: dict[str, list[str]] = {}
+        for path, ancestor in self.ancestry(ordinal, depth).items():
+            paths.setdefault(ancestor.name, []).append(path)
+        return {
+            name: sorted(found, key=lambda p: (len(p), p))
+            for name, found in paths.items()
+            if len(found) > 1
+        }
+
+
+def _cut_cycles(slots: list[list[int]], pedigrees: Sequence[list], interned: dict[str, int]) -> list[tuple[int, int]]:
+    """解決済みの辺の DFS で後退辺を見つけ、元の馬名の未解決枠に戻す。切った (序数, 枠) を返す。"""
+    WHITE, GREY, BLACK = 0, 1, 2
+    color = [WHITE] * len(slots)
+    cut: list[tuple[int, int]] = []
+    for start in range(len(slots)):
+        if color[start] != WHITE:
+            continue
+        color[start] = GREY
+        stack = [(start, 0)]
+        while stack:
+            node, slot = stack[-1]
+            if slot == len(slots[node]):
+                color[node] = BLACK
+                stack.pop()
+                continue
+            stack[-1] = (node, slot + 1)
+            target = slots[node][slot]
+            if target < 0:
+                continue
+            if color[target] == GREY:
+                name = pedigrees[node][slot].get("name", "")
+                slots[node][slot] = -1 - interned.setdefault(name, len(interned))
+                cut.append((node, slot))
+            elif color[target] == WHITE:
+                color[target] = GREY
+                stack.append((target, 0))
+    return cut
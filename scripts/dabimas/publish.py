@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+公開 JSON（summary + detail chunk）の世代単位の差し替え。
+
+各世代は世代ごとの不変なディレクトリ（`dabimasFactor-generations/<世代番号6桁>/`）に置く。
+書き出しは公開先と同じファイルシステム上のステージングへ行い、全ファイルを fsync してから
+ステージングごと世代ディレクトリへ rename する。最後に世代番号・世代ディレクトリ・各ファイルの
+SHA-1 / サイズを持つ manifest（`dabimasFactor.manifest.json`）を rename で置き換えた時点が
+公開（コミット点）。manifest が「今の世代」を指す唯一のポインタになる。
+
+- 世代ディレクトリは公開後に書き換えないので、manifest を読んだ読み手はその世代の summary と
+  chunk を最後まで揃って読める（新しい世代が公開されても旧世代のまま応答を続けられる）。
+- 今回と前回の manifest が指す世代ディレクトリだけを残し、それより古いものは公開後に消す。
+  2 世代以上前の manifest で開いたままの読み手だけが、消えたファイルを `GenerationChangedError`
+  として検出する（`DabimasDataset` は manifest の SHA-1 と照合する）。
+- summary の序数に依存する索引（祖先の逆引きなど）は `stage_file()` で同じ世代ディレクトリに載せ、
+  manifest の `files` に SHA-1 / サイズを記録する。
+- 従来の固定パス（`dabimasFactor.summary.json` / `dabimasFactor-details/` など）は、manifest を
+  読まないアプリのための互換用のミラーとして、公開後に世代ディレクトリからコピーし直す。
+  ミラーは 1 ファイルずつ rename で入れ替えるだけで世代としては不可分でないので、
+  世代の揃った読み込みが要る読み手は manifest から辿ること。
+- `hashed_copies=True` なら、各ファイルの内容ハッシュ入りの名前のコピー
+  （`dabimasFactor-hashed/<名前>.<SHA-1 先頭16桁>.json`）を manifest より前に置き、各項目の
+  `hashedPath` に記録する。手書きの brosData.json などは `track_file()` で `assets` に載せる。
+  内容が同じなら名前も同じなので、クライアントは manifest のハッシュが変わったファイルだけを
+  取り直せばよく、コピーは不変として長期キャッシュできる。今回と前回の manifest から
+  指されないコピーは公開後に消す（前回の manifest を読んだ読み手のために 1 世代分は残す）。
+  アプリのデータ読み込みはまだ `hashedPath` を使わないので、週次の workflow では有効にしていない
+  （それまでは service-worker.js の CACHE_NAME の bump で更新を配る）。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+
+MANIFEST_FILENAME = "dabimasFactor.manifest.json"
+STAGING_DIRNAME = ".staging"
+GENERATIONS_DIRNAME = "dabimasFactor-generations"
+DETAIL_CHUNK_GLOB = "dabimasFactor.details.*.json"
+HASHED_DIRNAME = "dabimasFactor-hashed"
+# 内容ハッシュ入りの名前に使う SHA-1 の桁数。
+HASHED_DIGITS = 16
+
+
+class GenerationChangedError(RuntimeError):
+    """読み込み中に公開物が別世代へ差し替わった（manifest の SHA-1 と一致しない）。"""
+
+
+def file_digest(path: Path) -> tuple[str, int]:
+    """ファイルの (SHA-1 16進, サイズ)。"""
+    data = path.read_bytes()
+    return hashlib.sha1(data).hexdigest(), len(data)
+
+
+def fsync_file(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_dir(path: Path) -> None:
+    """rename をディレクトリエントリごと永続化する（ディレクトリ fsync 不可の OS では何もしない）。"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def replace_file(src: Path, dst: Path) -> None:
+    """`src` を fsync してから `dst` へ rename で差し替える。"""
+    fsync_file(src)
+    os.replace(src, dst)
+    fsync_dir(dst.parent)
+
+
+def hashed_name(name: str, sha1: str) -> str:
+    """`dabimasFactor.summary.json` -> `dabimasFactor.summary.<SHA-1 先頭16桁>.json`。"""
+    path = Path(name)
+    return f"{path.stem}.{sha1[:HASHED_DIGITS]}{path.suffix}"
+
+
+def generation_dirname(generation: int) -> str:
+    """世代ディレクトリ名（6桁ゼロ埋め）。"""
+    return f"{generation:06d}"
+
+
+def manifest_entries(manifest: dict) -> list[dict]:
+    """manifest のファイル項目（summary / chunks / files / assets）をすべて返す。"""
+    entries = [manifest["summary"]] if manifest.get("summary") else []
+    for key in ("chunks", "files", "assets"):
+        entries.extend(manifest.get(key) or ())
+    return entries
+
+
+def load_manifest(path: Path) -> Optional[dict]:
+    """manifest を読む。無ければ None。"""
+    try:
+        with path.open("r", encoding="utf-8") as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return None
+
+
+def manifest_path_for(summary_path: Optional[Path], details_dir: Optional[Path]) -> Path:
+    """manifest は summary の隣（summary を出さないときは details ディレクトリの隣）に置く。"""
+    if summary_path is not None:
+        return summary_path.parent / MANIFEST_FILENAME
+    if details_dir is not None:
+        return details_dir.parent / MANIFEST_FILENAME
+    raise ValueError("summary_path or details_dir is required")
+
+
+class GenerationPublisher:
+    """
+    summary / detail chunk をステージングへ書かせ、`publish()` で 1 世代として公開する。
+
+    使い方: `begin()` → `staged_summary` / `staged_details` へ書く → `publish(...)`。
+    ステージングは公開先と同じディレクトリ配下に作るので、世代ディレクトリへの rename は
+    同一ファイルシステム内で済む。ステージングの中身の配置がそのまま世代ディレクトリの配置になる。
+    """
+
+    def __init__(self, summary_path: Optional[Path], details_dir: Optional[Path], hashed_copies: bool = False):
+        self.summary_path = summary_path
+        self.details_dir = details_dir
+        self.manifest_path = manifest_path_for(summary_path, details_dir)
+        root = self.manifest_path.parent
+        self.staging_dir = root / STAGING_DIRNAME
+        self.generations_dir = root / GENERATIONS_DIRNAME
+        self.hashed_dir = root / HASHED_DIRNAME if hashed_copies else None
+        self.staged_summary = self.staging_dir / summary_path.name if summary_path is not None else None
+        self.staged_details = self.staging_dir / details_dir.name if details_dir is not None else None
+        # 追加で同じ世代に載せるファイル: ステージング上のパス -> 互換ミラーの公開先。
+        self._extra_files: dict[Path, Path] = {}
+        # 書き換えずに manifest の `assets` へ載せるだけのファイル。
+        self._tracked_files: list[Path] = []
+
+    def begin(self) -> None:
+        """前回の中断で残ったステージングを捨てて作り直す。"""
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        if self.staged_details is not None:
+            self.staged_details.mkdir(parents=True, exist_ok=True)
+
+    def stage_file(self, target: Path) -> Path:
+        """
+        `target` を同じ世代で公開する。返すステージング上のパスへ書いておくこと。
+        世代ディレクトリでは summary の隣に置く（`DabimasDataset` は summary の隣から読む）。
+        """
+        staged = self.staging_dir / target.name
+        self._extra_files[staged] = target
+        return staged
+
+    def track_file(self, path: Path) -> None:
+        """build が書かないファイル（brosData.json など）を manifest の `assets` に載せる。"""
+        self._tracked_files.append(path)
+
+    def abort(self) -> None:
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    def _relative(self, path: Path) -> str:
+        return Path(os.path.relpath(path, self.manifest_path.parent)).as_posix()
+
+    def publish(self, chunk_size: int, horses: int) -> dict:
+        """
+        ステージングの内容を新しい世代ディレクトリとして公開し、新しい manifest を返す。
+
+        順序: 全ファイルを fsync → ステージングを世代ディレクトリへ rename → manifest（コミット点）
+        → 互換ミラーの差し替え → 今回・前回の manifest から指されない世代ディレクトリを削除。
+        manifest より前に落ちても、読み手は旧 manifest が指す旧世代をそのまま読める。
+        """
+        previous = load_manifest(self.manifest_path) or {}
+        generation = int(previous.get("generation", 0)) + 1
+        generation_dir = self.generations_dir / generation_dirname(generation)
+        manifest: dict = {
+            "version": 1,
+            "generation": generation,
+            "publishedAt": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "directory": self._relative(generation_dir),
+            "chunkSize": chunk_size,
+            "horses": horses,
+            "summary": None,
+            "chunks": [],
+            "files": [],
+        }
+        if self._tracked_files:
+            manifest["assets"] = []
+        # manifest の項目と、内容ハッシュ入りのコピー元（ステージング上 / 公開済みのファイル）。
+        sources: list[tuple[dict, Path]] = []
+        # ステージング上のファイルと互換ミラーの公開先。
+        staged_files: list[tuple[Path, Path]] = []
+
+        def add(key: str, staged: Path, mirror: Path) -> None:
+            sha1, size = file_digest(staged)
+            path = generation_dir / staged.relative_to(self.staging_dir)
+            item = {"path": self._relative(path), "sha1": sha1, "size": size}
+            if key == "summary":
+                manifest["summary"] = item
+            else:
+                manifest[key].append(item)
+            sources.append((item, staged))
+            staged_files.append((staged, mirror))
+
+        published_chunks: set[str] = set()
+        if self.staged_details is not None and self.details_dir is not None:
+            for staged in sorted(self.staged_details.glob(DETAIL_CHUNK_GLOB)):
+                add("chunks", staged, self.details_dir / staged.name)
+                published_chunks.add(staged.name)
+        if self.staged_summary is not None and self.summary_path is not None:
+            add("summary", self.staged_summary, self.summary_path)
+        for staged, target in self._extra_files.items():
+            if staged.exists():
+                add("files", staged, target)
+        for path in self._tracked_files:
+            if not path.exists():
+                continue
+            sha1, size = file_digest(path)
+            manifest["assets"].append({"path": self._relative(path), "sha1": sha1, "size": size})
+            sources.append((manifest["assets"][-1], path))
+        if self.hashed_dir is not None:
+            self._write_hashed_copies(sources)
+
+        # 世代ディレクトリ: 中身とディレクトリエントリを永続化してから 1 回の rename で置く。
+        for staged, _ in staged_files:
+            fsync_file(staged)
+        for directory in {staged.parent for staged, _ in staged_files} | {self.staging_dir}:
+            fsync_dir(directory)
+        self.generations_dir.mkdir(parents=True, exist_ok=True)
+        # 前回 manifest の前で落ちた同じ番号の世代は、どの manifest からも指されていない。
+        shutil.rmtree(generation_dir, ignore_errors=True)
+        os.replace(self.staging_dir, generation_dir)
+        fsync_dir(self.generations_dir)
+
+        staged_manifest = self.manifest_path.with_name(self.manifest_path.name + ".partial")
+        with staged_manifest.open("w", encoding="utf-8", newline="\n") as fp:
+            json.dump(manifest, fp, ensure_ascii=False, indent=2)
+            fp.write("\n")
+        replace_file(staged_manifest, self.manifest_path)
+
+        self._write_mirror(
+            [(generation_dir / staged.relative_to(self.staging_dir), mirror) for staged, mirror in staged_files]
+        )
+        if self.details_dir is not None:
+            for stale in self.details_dir.glob(DETAIL_CHUNK_GLOB):
+                if stale.name not in published_chunks:
+                    stale.unlink()
+        self._prune_generations(manifest, previous)
+        if self.hashed_dir is not None:
+            self._prune_hashed_copies(manifest, previous)
+        return manifest
+
+    def _write_mirror(self, copies: list[tuple[Path, Path]]) -> None:
+        """世代ディレクトリのファイルを互換ミラー（従来の固定パス）へ 1 ファイルずつ rename で差し替える。"""
+        for source, target in copies:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = target.with_name(target.name + ".partial")
+            shutil.copyfile(source, tmp_path)
+            fsync_file(tmp_path)
+            os.replace(tmp_path, target)
+        for directory in {target.parent for _, target in copies}:
+            fsync_dir(directory)
+
+    def _prune_generations(self, manifest: dict, previous: dict) -> None:
+        """今回と前回の manifest のどちらからも指されない世代ディレクトリを消す。"""
+        keep = {Path(m["directory"]).name for m in (manifest, previous) if m.get("directory")}
+        for stale in self.generations_dir.iterdir():
+            if stale.is_dir() and stale.name not in keep:
+                shutil.rmtree(stale, ignore_errors=True)
+
+    def _write_hashed_copies(self, sources: list[tuple[dict, Path]]) -> None:
+        """各項目の内容ハッシュ入りのコピーを置き、`hashedPath` を記録する（同名があれば内容も同じ）。"""
+        self.hashed_dir.mkdir(parents=True, exist_ok=True)
+        for entry, source in sources:
+            target = self.hashed_dir / hashed_name(source.name, entry["sha1"])
+            if not target.exists():
+                tmp_path = target.with_name(target.name + ".partial")
+                shutil.copyfile(source, tmp_path)
+                replace_file(tmp_path, target)
+            entry["hashedPath"] = self._relative(target)
+
+    def _prune_hashed_copies(self, manifest: dict, previous: dict) -> None:
+        """今回と前回の manifest のどちらからも指されないコピーを消す。"""
+        keep = {
+            Path(entry["hashedPath"]).name
+            for entry in manifest_entries(manifest) + manifest_entries(previous)
+            if entry.get("hashedPath")
+        }
+        for stale in self.hashed_dir.iterdir():
+            if stale.is_file() and stale.name not in keep:
+                stale.unlink()
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+公開 JSON（`json/dabimasFactor.summary.json` + `json/dabimasFactor-details/*.json`）の
+読み込みと索引付き検索。
+
+summary は 1 回だけ読み、id / 馬名 / 親系統 / 因子の索引を作る。detail chunk は
+summary の `detailChunk` が指すファイルだけを必要時に読み、デコード済み chunk を
+LRU で `cache_chunks` 個まで保持する。1 頭分の血統を引くのに全 chunk を読まない。
+
+`open()` はディレクトリに manifest（`dabimas.publish`）があれば、それが指す世代ディレクトリの
+summary / chunk を SHA-1 で照合しながら読む。世代ディレクトリは不変なので、開いた後に新しい
+世代が公開されても同じ世代を読み続けられる。その世代が古くなって消されたときだけ
+`GenerationChangedError` になるので、呼び出し側は開き直せばよい。
+
+祖先での絞り込み（`with_ancestors()`）は summary の隣の逆引き索引
+（`dabimas.ancestors`）を使う。索引ファイルが無ければ全 chunk を 1 回読んで作る。血統の深い展開（`ancestry()`）も
+同様に血統 DAG（`dabimas.pedigree`）のファイルを使い、無ければ作る。全兄弟・全姉妹の
+判定（`siblings()`）は `assets_dir`（既定は summary の隣）の brosData.json から作る。血統の類似検索（`similar()`）も
+類似索引（`dabimas.similarity`）のファイルを使い、無ければ作る。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Optional
+
+from dabimas.ancestors import ANCESTORS_FILENAME, AncestorIndex, AncestorTerm
+from dabimas.pedigree import PEDIGREE_FILENAME, Ancestor, PedigreeGraph
+from dabimas.publish import MANIFEST_FILENAME, GenerationChangedError, load_manifest
+from dabimas.siblings import BROS_DATA_FILENAME, SiblingIndex
+from dabimas.similarity import SIMILARITY_FILENAME, SimilarityIndex
+from dabimas.text import normalize_search_text
+
+
+# 既定の公開物の配置（リポジトリの json/ 配下）。
+SUMMARY_FILENAME = "dabimasFactor.summary.json"
+DETAILS_DIRNAME = "dabimasFactor-details"
+# デコード済み detail chunk を保持する既定数（128 件 chunk で 1 個あたり約 200KB）。
+DEFAULT_CACHE_CHUNKS = 8
+
+
+def detail_chunk_filename(chunk_index: int) -> str:
+    """detail chunk のファイル名（3桁ゼロ埋め）。"""
+    return f"dabimasFactor.details.{chunk_index:03d}.json"
+
+
+class DabimasDataset:
+    """
+    summary と detail chunk をまとめて引くためのデータセット。
+
+    返す summary レコードは読み込んだ dict そのもの（共有）なので、呼び出し側で
+    変更しないこと。`horse()` は summary + descendants を合わせた新しい dict を返す。
+    """
+
+    def __init__(
+        self,
+        summary_path: Path,
+        details_dir: Optional[Path] = None,
+        cache_chunks: int = DEFAULT_CACHE_CHUNKS,
+        manifest: Optional[dict] = None,
+        assets_dir: Optional[Path] = None,
+    ):
+        self.summary_path = Path(summary_path)
+        self.details_dir = Path(details_dir) if details_dir is not None else None
+        # 世代を持たない手書きの JSON（brosData.json）の置き場所。
+        self.assets_dir = Path(assets_dir) if assets_dir is not None else self.summary_path.parent
+        self.cache_chunks = max(1, cache_chunks)
+        # manifest 付きで開いたときの世代番号と、chunk ファイル名 -> 期待 SHA-1。
+        self.generation: Optional[int] = None
+        self._chunk_digests: Optional[dict[str, str]] = None
+        # manifest の `files`（同じ世代の索引など）: ファイル名 -> 期待 SHA-1。
+        self._file_digests: dict[str, str] = {}
+        if manifest is not None:
+            self.generation = manifest.get("generation")
+            self._chunk_digests = {
+                Path(item["path"]).name: item["sha1"] for item in manifest.get("chunks", [])
+            }
+            self._file_digests = {
+                Path(item["path"]).name: item["sha1"] for item in manifest.get("files", [])
+            }
+            expected = (manifest.get("summary") or {}).get("sha1")
+            summary = json.loads(self._read_verified(self.summary_path, expected))
+        else:
+            with self.summary_path.open("r", encoding="utf-8") as fp:
+                summary = json.load(fp)
+        self.chunk_size: int = summary.get("chunkSize", 0)
+        self.horses: list[dict] = summary.get("horseLists", [])
+
+        self._by_id: dict[str, dict] = {}
+        self._by_name: dict[str, list[dict]] = {}
+        self._by_parent_line: dict[str, list[dict]] = {}
+        self._by_factor: dict[str, list[dict]] = {}
+        for horse in self.horses:
+            self._by_id[horse["id"]] = horse
+            self._by_name.setdefault(horse.get("name", ""), []).append(horse)
+            self._by_parent_line.setdefault(horse.get("parentLine", ""), []).append(horse)
+            for factor in set(horse.get("factors") or ()):
+                if factor:
+                    self._by_factor.setdefault(factor, []).append(horse)
+
+        self._chunks: OrderedDict[int, dict[str, list]] = OrderedDict()
+        self._lock = threading.Lock()
+        # 実際にディスクから読んだ chunk 数（LRU の効き具合の確認用）。
+        self.chunk_reads = 0
+        self._ancestors: Optional[AncestorIndex] = None
+        self._pedigree: Optional[PedigreeGraph] = None
+        self._siblings: Optional[SiblingIndex] = None
+        self._similarity: Optional[SimilarityIndex] = None
+        self._ordinals: dict[str, int] = {horse["id"]: i for i, horse in enumerate(self.horses)}
+
+    @classmethod
+    def open(cls, json_dir: Path, cache_chunks: int = DEFAULT_CACHE_CHUNKS) -> "DabimasDataset":
+        """
+        リポジトリの `json/` と同じ配置のディレクトリから開く。manifest があれば
+        その世代のファイルを照合付きで読む。
+        """
+        json_dir = Path(json_dir)
+        manifest = load_manifest(json_dir / MANIFEST_FILENAME)
+        if manifest is None:
+            return cls(json_dir / SUMMARY_FILENAME, json_dir / DETAILS_DIRNAME, cache_chunks)
+        summary_path = json_dir / manifest["summary"]["path"]
+        chunks = manifest.get("chunks", [])
+        details_dir = (json_dir / chunks[0]["path"]).parent if chunks else json_dir / DETAILS_DIRNAME
+        return cls(summary_path, details_dir, cache_chunks, manifest=manifest, assets_dir=json_dir)
+
+    @staticmethod
+    def _read_verified(path: Path, expected_sha1: Optional[str]) -> bytes:
+        """ファイルを読み、manifest の SHA-1 と違えば（別世代 / 削除済み）`GenerationChangedError`。"""
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError as e:
+            if expected_sha1 is None:
+                raise
+            raise GenerationChangedError(f"{path.name} was removed by a newer generation") from e
+        if expected_sha1 is not None and hashlib.sha1(data).hexdigest() != expected_sha1:
+            raise GenerationChangedError(f"{path.name} does not match the manifest")
+        return data
+
+    def __len__(self) -> int:
+        return len(self.horses)
+
+    def by_id(self, horse_id: str) -> Optional[dict]:
+        """id の summary レコード。無ければ None。"""
+        return self._by_id.get(horse_id)
+
+    def by_name(self, name: str) -> list[dict]:
+        """馬名（subName を除いた `name`）が一致する summary レコード（出力順）。"""
+        return list(self._by_name.get(name, ()))
+
+    def by_parent_line(self, parent_line: str) -> list[dict]:
+        """親系統コード（例: "Ne"）が一致する summary レコード（出力順）。"""
+        return list(self._by_parent_line.get(parent_line, ()))
+
+    def by_factor(self, factor: str) -> list[dict]:
+        """自身の因子に `factor`（例: "短"）を持つ summary レコード（出力順）。"""
+        return list(self._by_factor.get(factor, ()))
+
+    def search(self, query: str, limit: Optional[int] = None) -> list[dict]:
+        """
+        `normalize_search_text` で正規化したクエリを `searchText` に部分一致させる
+        （アプリの `filterHorse` と同じ判定）。空クエリは全件。
+        """
+        needle = normalize_search_text(query)
+        hits: list[dict] = []
+        for horse in self.horses:
+            if needle and needle not in horse.get("searchText", ""):
+                continue
+            hits.append(horse)
+            if limit is not None and len(hits) >= limit:
+                break
+        return hits
+
+    def select(
+        self,
+        factors: Iterable[str] = (),
+        parent_line: Optional[str] = None,
+        sex: Optional[str] = None,
+    ) -> list[dict]:
+        """
+        自身の因子に `factors` をすべて持ち、親系統・性別が一致する馬（出力順）。
+
+        最も件数の少ない索引から候補を取り、残りの条件で絞る。
+        """
+        wanted = [f for f in dict.fromkeys(factors) if f]
+        candidates: list[list[dict]] = [self._by_factor.get(f, []) for f in wanted]
+        if parent_line:
+            candidates.append(self._by_parent_line.get(parent_line, []))
+        if not candidates:
+            base: Iterable[dict] = self.horses
+        else:
+            base = min(candidates, key=len)
+        hits = []
+        for horse in base:
+            if parent_line and horse.get("parentLine") != parent_line:
+                continue
+            if sex is not None and horse.get("sex") != sex:
+                continue
+            own = horse.get("factors") or ()
+            if all(f in own for f in wanted):
+                hits.append(horse)
+        return hits
+
+    def parent_lines(self) -> list[str]:
+        """データ中の親系統コード一覧。"""
+        return sorted(code for code in self._by_parent_line if code)
+
+    def factors(self) -> list[str]:
+        """データ中の因子略称一覧。"""
+        return sorted(self._by_factor)
+
+    def chunk(self, chunk_index: int) -> dict[str, list]:
+        """detail chunk を id -> descendants で返す。LRU に無ければ読む。"""
+        with self._lock:
+            cached = self._chunks.get(chunk_index)
+            if cached is not None:
+                self._chunks.move_to_end(chunk_index)
+                return cached
+        if self.details_dir is None:
+            raise FileNotFoundError("details_dir is not configured")
+        name = detail_chunk_filename(chunk_index)
+        if self._chunk_digests is None:
+            with (self.details_dir / name).open("r", encoding="utf-8") as fp:
+                obj = json.load(fp)
+        else:
+            if name not in self._chunk_digests:
+                raise FileNotFoundError(f"{name} is not part of generation {self.generation}")
+            obj = json.loads(self._read_verified(self.details_dir / name, self._chunk_digests[name]))
+        decoded = {detail["id"]: detail["descendants"] for detail in obj.get("horseDetails", [])}
+        with self._lock:
+            self.chunk_reads += 1
+            self._chunks[chunk_index] = decoded
+            self._chunks.move_to_end(chunk_index)
+            while len(self._chunks) > self.cache_chunks:
+                self._chunks.popitem(last=False)
+        return decoded
+
+    def descendants(self, horse_id: str) -> Optional[list]:
+        """id の血統 15 頭（detail の descendants）。馬が無ければ None。"""
+        horse = self._by_id.get(horse_id)
+        if horse is None:
+            return None
+        return self.chunk(horse["detailChunk"]).get(horse_id)
+
+    def horse(self, horse_id: str) -> Optional[dict]:
+        """summary レコードに descendants を足した新しい dict。馬が無ければ None。"""
+        horse = self._by_id.get(horse_id)
+        if horse is None:
+            return None
+        return {**horse, "descendants": self.descendants(horse_id)}
+
+    def _load_sibling(self, filename: str) -> Optional[dict]:
+        """
+        summary の隣にある同じ世代の派生ファイルを読む（manifest 付きなら照合する）。
+        manifest 付きで開いたのに manifest に載っていない、または馬数が合わなければ None。
+        """
+        path = self.summary_path.parent / filename
+        expected = self._file_digests.get(filename)
+        if expected is None and (self._chunk_digests is not None or not path.exists()):
+            return None
+        obj = json.loads(self._read_verified(path, expected))
+        return obj if obj.get("horses") == len(self.horses) else None
+
+    def ancestor_index(self) -> AncestorIndex:
+        """祖先の逆引き索引。索引ファイルが無いときは全 chunk の descendants から作る。"""
+        if self._ancestors is not None:
+            return self._ancestors
+        obj = self._load_sibling(ANCESTORS_FILENAME)
+        index = AncestorIndex.from_obj(obj) if obj is not None else None
+        if index is None:
+            index = AncestorIndex.from_descendants(self.descendants(h["id"]) for h in self.horses)
+        self._ancestors = index
+        return index
+
+    def with_ancestors(self, terms: Iterable[AncestorTerm], sex: Optional[str] = None) -> list[dict]:
+        """
+        血統に条件の祖先をすべて持つ馬の summary レコード（出力順）。
+
+        条件は祖先名か (祖先名, スロット集合)。スロットは descendants の位置（0〜14）。
+        例: `with_ancestors(["ノーザンダンサー", ("ナスルーラ", {1, 2})], sex="1")`
+        """
+        hits = [self.horses[i] for i in self.ancestor_index().intersect(terms)]
+        if sex is not None:
+            hits = [horse for horse in hits if horse.get("sex") == sex]
+        return hits
+
+    def pedigree_graph(self) -> PedigreeGraph:
+        """血統 DAG。ファイルが無いときは全 chunk の descendants から作る。"""
+        if self._pedigree is not None:
+            return self._pedigree
+        names = [horse.get("name", "") for horse in self.horses]
+        obj = self._load_sibling(PEDIGREE_FILENAME)
+        if obj is not None:
+            graph = PedigreeGraph.from_obj(obj, names)
+        else:
+            graph = PedigreeGraph.build(self.horses, [self.descendants(h["id"]) for h in self.horses])
+        self._pedigree = graph
+        return graph
+
+    def ancestry(self, horse_id: str, depth: int) -> Optional[list[dict]]:
+        """
+        `depth` 代前までの牡の祖先（経路の短い順）。各要素は path（F=父 / M=母の並び）、
+        name、id（summary にいる馬なら id、いなければ None）。馬が無ければ None。
+        """
+        ordinal = self._ordinals.get(horse_id)
+        if ordinal is None:
+            return None
+        found = self.pedigree_graph().ancestry(ordinal, depth)
+        return [self._ancestor_record(found[path]) for path in sorted(found, key=lambda p: (len(p), p))]
+
+    def _ancestor_record(self, ancestor: Ancestor) -> dict:
+        horse_id = self.horses[ancestor.ordinal]["id"] if ancestor.ordinal is not None else None
+        return {"path": ancestor.path, "name": ancestor.name, "id": horse_id}
+
+    def siblings(self) -> SiblingIndex:
+        """`assets_dir` の brosData.json の全兄弟・全姉妹グループ（無ければ空）。"""
+        if self._siblings is None:
+            path = self.assets_dir / BROS_DATA_FILENAME
+            self._siblings = SiblingIndex.load(path) if path.exists() else SiblingIndex((), ())
+        return self._siblings
+
+    def similarity_index(self) -> SimilarityIndex:
+        """血統の類似索引。ファイルが無いときは全 chunk の descendants から作る。"""
+        if self._similarity is None:
+            obj = self._load_sibling(SIMILARITY_FILENAME)
+            if obj is not None:
+                self._similarity = SimilarityIndex.from_obj(obj)
+            else:
+                self._similarity = SimilarityIndex.build(self.descendants(h["id"]) for h in self.horses)
+        return self._similarity
+
+    def similar(self, horse_id: str, k: int = 10, sex: Optional[str] = None) -> Optional[list[dict]]:
+        """
+        血統が似ている馬（本人を除く、類似度の高い順に最大 k 頭）。summary レコードに
+        `similarity`（重み付き Jaccard）を足した新しい dict を返す。馬が無ければ None。
+        """
+        ordinal = self._ordinals.get(horse_id)
+        if ordinal is None:
+            return None
+        accept = (lambda o: self.horses[o].get("sex") == sex) if sex is not None else None
+        hits = self.similarity_index().similar(ordinal, k, accept)
+        return [{**self.horses[o], "similarity": round(score, 4)} for o, score in hits]
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+全兄弟・全姉妹のグループ索引（`json/brosData.json` から作る）。
+
+brosData.json は 1 頭ごとに「自分以外の全兄弟 / 全姉妹」を 2 枠（足りない分は ""）で持つので、
+同じグループが各メンバーの視点で繰り返し書かれている。ここでは union-find で
+グループ番号にまとめ、馬名 -> グループ番号・グループ -> メンバーの表にしておく。
+交配評価のたびに呼ぶ `are_siblings()` / `members()` は dict 1 回の参照で済む。
+
+読み込み時に対称性も検査する（`problems`）:
+
+- 一覧に挙がった馬が key として存在し、相手側にも自分が挙がっていること
+- 同じ馬が兄弟としても姉妹としても挙がっていないこと
+- 各 key の一覧がグループの自分以外の全員と一致すること（推移的に欠けていない）
+
+冗長な brosData.json はコンパクト形式（グループの並びと牝馬の一覧）から作り直せる:
+
+    {"version": 1, "groups": [["ダンスインザダーク", "ダンスパートナー", ...], ...], "sisters": ["ダンスパートナー", ...],
+     "order": {"ペール": ["ミステリー", "パーソロン"]}}
+
+各 key の一覧は既定ではグループの並びで書き出す。元の一覧がそれと違う key だけ、`order` に元の並び
+（兄弟、続けて姉妹）を持つ。アプリは `fullBrothers[0]` を使うので、並びも元どおりに戻す必要がある。
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Iterable, Optional
+
+
+BROS_DATA_FILENAME = "brosData.json"
+# brosData.json の兄弟・姉妹の枠数（足りない分は "" で埋める）。
+BROS_SLOTS = 2
+
+
+class _UnionFind:
+    """馬名の union-find（経路圧縮 + サイズ併合）。"""
+
+    def __init__(self) -> None:
+        self.parent: dict[str, str] = {}
+        self.size: dict[str, int] = {}
+
+    def add(self, name: str) -> None:
+        if name not in self.parent:
+            self.parent[name] = name
+            self.size[name] = 1
+
+    def find(self, name: str) -> str:
+        root = name
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[name] != root:
+            self.parent[name], name = root, self.parent[name]
+        return root
+
+    def union(self, a: str, b: str) -> None:
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return
+        if self.size[ra] < self.size[rb]:
+            ra, rb = rb, ra
+        self.parent[rb] = ra
+        self.size[ra] += self.size[rb]
+
+
+class SiblingIndex:
+    """馬名 -> グループ番号と、グループ番号 -> メンバー（出現順）の表。"""
+
+    def __init__(
+        self,
+        groups: Iterable[Iterable[str]],
+        sisters: Iterable[str],
+        order: Optional[dict[str, Iterable[str]]] = None,
+    ):
+        self._members: list[tuple[str, ...]] = [tuple(group) for group in groups]
+        self._group: dict[str, int] = {
+            name: gid for gid, members in enumerate(self._members) for name in members
+        }
+        self._sisters = frozenset(sisters)
+        # グループの並びと違う順で一覧を書く key -> 元の一覧の並び。
+        self._order: dict[str, tuple[str, ...]] = {key: tuple(names) for key, names in (order or {}).items()}
+        self.problems: list[str] = []
+
+    @classmethod
+    def from_bros_data(cls, obj: dict) -> "SiblingIndex":
+        """brosData.json の内容からグループを作り、対称性の問題を `problems` に入れる。"""
+        records = obj.get("brosData", [])
+        uf = _UnionFind()
+        listed: dict[str, set[str]] = {}
+        sequences: dict[str, list[str]] = {}
+        sex_of: dict[str, str] = {}
+        problems: list[str] = []
+        for record in records:
+            key = record["key"]
+            uf.add(key)
+            others = listed.setdefault(key, set())
+            sequence = sequences.setdefault(key, [])
+            for field, sex in (("fullBrothers", "0"), ("fullSisters", "1")):
+                for name in record["bros"].get(field, ()):
+                    if not name:
+                        continue
+                    uf.add(name)
+                    uf.union(key, name)
+                    others.add(name)
+                    sequence.append(name)
+                    if sex_of.setdefault(name, sex) != sex:
+                        problems.append(f"{name}: listed as both a brother and a sister")
+
+        # グループはメンバーの出現順（key と一覧の初出順）で並べる。
+        order: dict[str, list[str]] = {}
+        for name in uf.parent:
+            order.setdefault(uf.find(name), []).append(name)
+        index = cls(order.values(), (name for name, sex in sex_of.items() if sex == "1"))
+        for key, sequence in sequences.items():
+            if index._siblings_of(key) != index._split(sequence):
+                index._order[key] = tuple(sequence)
+
+        for key, others in listed.items():
+            expected = set(index.members(key)) - {key}
+            if others != expected:
+                missing = sorted(expected - others)
+                problems.append(f"{key}: sibling list is missing {missing}")
+        for name in uf.parent:
+            if name not in listed:
+                problems.append(f"{name}: listed as a sibling but has no brosData entry")
+        for name, others in listed.items():
+            if name in others:
+                problems.append(f"{name}: lists itself as a sibling")
+        index.problems = problems
+        return index
+
+    @classmethod
+    def load(cls, path: Path) -> "SiblingIndex":
+        with Path(path).open("r", encoding="utf-8") as fp:
+            return cls.from_bros_data(json.load(fp))
+
+    @classmethod
+    def from_compact(cls, obj: dict) -> "SiblingIndex":
+        return cls(obj["groups"], obj.get("sisters", ()), obj.get("order"))
+
+    def to_compact(self) -> dict:
+        sisters = [name for members in self._members for name in members if name in self._sisters]
+        compact = {"version": 1, "groups": [list(members) for members in self._members], "sisters": sisters}
+        if self._order:
+            compact["order"] = {key: list(names) for key, names in self._order.items()}
+        return compact
+
+    def _split(self, names: Iterable[str]) -> tuple[list[str], list[str]]:
+        """馬名の並びを (兄弟, 姉妹) に分ける（それぞれ並びはそのまま）。"""
+        names = list(names)
+        return [n for n in names if n not in self._sisters], [n for n in names if n in self._sisters]
+
+    def _siblings_of(self, key: str) -> tuple[list[str], list[str]]:
+        """`key` の一覧に書く (兄弟, 姉妹)。`order` があればその並び、無い馬はグループの並びで後ろへ。"""
+        others = [n for n in self.members(key) if n != key]
+        sequence = self._order.get(key)
+        if sequence is not None:
+            rank = {name: i for i, name in enumerate(sequence)}
+            others.sort(key=lambda name: rank.get(name, len(rank)))
+        return self._split(others)
+
+    def to_bros_data(self) -> dict:
+        """冗長な brosData.json の形（グループ順・メンバー順に 1 頭 1 件、一覧は元の並び）に戻す。"""
+        records = []
+        for members in self._members:
+            for key in members:
+                brothers, sisters = self._siblings_of(key)
+                records.append({
+                    "key": key,
+                    "bros": {
+                        "fullBrothers": brothers + [""] * (BROS_SLOTS - len(brothers)),
+                        "fullSisters": sisters + [""] * (BROS_SLOTS - len(sisters)),
+                    },
+                })
+        return {"brosData": records}
+
+    def write_bros_data(self, path: Path) -> None:
+        """brosData.json と同じ書式（1 行 1 件）で書き出す。"""
+        lines = [
+            json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+            for record in self.to_bros_data()["brosData"]
+        ]
+        with path.open("w", encoding="utf-8", newline="\n") as fp:
+            fp.write('{\n"brosData":\n[\n' + ",\n".join(lines) + "\n]\n}")
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._group
+
+    def group_of(self, name: str) -> Optional[int]:
+        """馬名のグループ番号。brosData に無ければ None。"""
+        return self._group.get(name)
+
+    def members(self, name: str) -> tuple[str, ...]:
+        """`name` を含むグループの全員（本人を含む）。無ければ空。"""
+        gid = self._group.get(name)
+        return self._members[gid] if gid is not None else ()
+
+    def are_siblings(self, a: str, b: str) -> bool:
+        """`a` と `b` が全兄弟（全姉妹）か。同じ馬名は False。"""
+        if a == b:
+            return False
+        gid = self._group.get(a)
+        return gid is not None and gid == self._group.get(b)
+
+    def is_sister(self, name: str) -> bool:
+        return name in self._sisters
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+血統の類似検索（MinHash + LSH）: 「この馬と血統が似ている馬」を全組み合わせ比較なしで引く。
+
+各馬の血統 15 枠を祖先名 -> 重みの多重集合にする。重みは代が近いほど大きく
+（父 8、2 代前 4、3 代前 2、4 代前 1）、同じ祖先が複数の枠にいれば足し合わせる。
+類似度は重み付き Jaccard（Σmin / Σmax）。
+
+- MinHash: 重み w の祖先を (名前, 0..w-1) の w 個のトークンに展開し、`num_perm` 個のハッシュ関数で
+  最小値を取る。2 頭の署名の一致率が重み付き Jaccard の推定値になる。トークンごとのハッシュ列は
+  1 回だけ計算して使い回す。
+- LSH: 署名を `bands` 個の帯に分け、帯ごとのバケットに入れる。同じバケットに 1 つでも入った馬だけを
+  候補にし（既定の 32 帯 x 2 行で類似度 0.2 前後から拾い始める）、候補を重みから正確な類似度で並べ直す。
+
+ファイル（`dabimasFactor.similarity.json`）:
+
+    {"version": 1, "horses": N, "numPerm": 64, "bands": 32, "seed": 1, "names": [...],
+     "weights": [[name_idx, w, name_idx, w, ...], ...], "bandKeys": [[k0, ..., k31], ...]}
+
+序数は summary の位置なので、build は summary と同じ世代で公開する。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import heapq
+import json
+import random
+import struct
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Sequence
+
+from dabimas.pedigree import SLOT_PATHS
+
+
+SIMILARITY_FILENAME = "dabimasFactor.similarity.json"
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 32
+DEFAULT_SEED = 1
+# 4 代前の重みを 1 とし、代が 1 つ近づくごとに倍にする。
+SLOT_WEIGHTS = tuple(2 ** (4 - len(path)) for path in SLOT_PATHS)
+# 署名の値域（ハッシュ関数は 2^61-1 を法とする一次式の下位 32 ビット）。
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+
+
+def pedigree_weights(descendants: Optional[list]) -> dict[str, int]:
+    """descendants（15 枠）を祖先名 -> 重みにする。空の枠は数えない。"""
+    weights: dict[str, int] = {}
+    for weight, ancestor in zip(SLOT_WEIGHTS, descendants or ()):
+        name = ancestor.get("name", "")
+        if name:
+            weights[name] = weights.get(name, 0) + weight
+    return weights
+
+
+def weighted_jaccard(a: dict[str, int], b: dict[str, int]) -> float:
+    """重み付き Jaccard 係数（両方空なら 0）。"""
+    if len(a) > len(b):
+        a, b = b, a
+    shared = sum(min(w, b[name]) for name, w in a.items() if name in b)
+    total = sum(a.values()) + sum(b.values()) - shared
+    return shared / total if total else 0.0
+
+
+class MinHasher:
+    """`seed` で決まる `num_perm` 個のハッシュ関数。トークンのハッシュ列をメモする。"""
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, seed: int = DEFAULT_SEED):
+        rnd = random.Random(seed)
+        self.num_perm = num_perm
+        self._coefficients = [(rnd.randrange(1, _PRIME), rnd.randrange(0, _PRIME)) for _ in range(num_perm)]
+        self._tokens: dict[tuple[str, int], tuple[int, ...]] = {}
+
+    def _token(self, name: str, copy: int) -> tuple[int, ...]:
+        key = (name, copy)
+        cached = self._tokens.get(key)
+        if cached is None:
+            digest = hashlib.blake2b(f"{name}\x00{copy}".encode("utf-8"), digest_size=8).digest()
+            x = int.from_bytes(digest, "big")
+            cached = tuple(((a * x + b) % _PRIME) & _MASK for a, b in self._coefficients)
+            self._tokens[key] = cached
+        return cached
+
+    def signature(self, weights: dict[str, int]) -> tuple[int, ...]:
+        """重み付き集合の MinHash 署名。空集合は全要素が最大値。"""
+        vectors = [self._token(name, copy) for name, w in weights.items() for copy in range(w)]
+        if not vectors:
+            return (_MASK,) * self.num_perm
+        return tuple(map(min, zip(*vectors)))
+
+
+def band_keys(signature: Sequence[int], bands: int) -> list[int]:
+    """署名を `bands` 個の帯に分け、帯ごとのバケットキー（32 ビット）を返す。"""
+    rows = len(signature) // bands
+    keys = []
+    for band in range(bands):
+        chunk = signature[band * rows:(band + 1) * rows]
+        digest = hashlib.blake2b(struct.pack(f">{rows}I", *chunk), digest_size=4).digest()
+        keys.append(int.from_bytes(digest, "big"))
+    return keys
+
+
+class SimilarityIndex:
+    """馬ごとの祖先の重みと LSH バケット。`similar()` が候補の正確な類似度で上位 k 頭を返す。"""
+
+    def __init__(
+        self,
+        weights: list[dict[str, int]],
+        keys: list[list[int]],
+        num_perm: int = DEFAULT_NUM_PERM,
+        bands: int = DEFAULT_BANDS,
+        seed: int = DEFAULT_SEED,
+    ):
+        if num_perm % bands:
+            raise ValueError(f"numPerm {num_perm} is not divisible by bands {bands}")
+        self.weights = weights
+        self.keys = keys
+        self.num_perm = num_perm
+        self.bands = bands
+        self.seed = seed
+        self._hasher: Optional[MinHasher] = None
+        # 帯番号ごとのバケットキー -> 序数の列。空の血統はどのバケットにも入れない。
+        self._buckets: list[dict[int, list[int]]] = [{} for _ in range(bands)]
+        for ordinal, horse_keys in enumerate(keys):
+            if not weights[ordinal]:
+                continue
+            for band, key in enumerate(horse_keys):
+                self._buckets[band].setdefault(key, []).append(ordinal)
+
+    @property
+    def horses(self) -> int:
+        return len(self.weights)
+
+    @property
+    def hasher(self) -> MinHasher:
+        if self._hasher is None:
+            self._hasher = MinHasher(self.num_perm, self.seed)
+        return self._hasher
+
+    @classmethod
+    def build(
+        cls,
+        pedigrees: Iterable[Optional[list]],
+        num_perm: int = DEFAULT_NUM_PERM,
+        bands: int = DEFAULT_BANDS,
+        seed: int = DEFAULT_SEED,
+    ) -> "SimilarityIndex":
+        """summary 順の descendants（無い馬は None）から署名と LSH バケットを作る。"""
+        hasher = MinHasher(num_perm, seed)
+        weights = [pedigree_weights(descendants) for descendants in pedigrees]
+        keys = [band_keys(hasher.signature(w), bands) for w in weights]
+        index = cls(weights, keys, num_perm, bands, seed)
+        index._hasher = hasher
+        return index
+
+    @classmethod
+    def from_obj(cls, obj: dict) -> "SimilarityIndex":
+        names = obj["names"]
+        weights = [
+            {names[flat[i]]: flat[i + 1] for i in range(0, len(flat), 2)} for flat in obj["weights"]
+        ]
+        return cls(weights, obj["bandKeys"], obj["numPerm"], obj["bands"], obj["seed"])
+
+    @classmethod
+    def load(cls, path: Path) -> "SimilarityIndex":
+        with Path(path).open("r", encoding="utf-8") as fp:
+            return cls.from_obj(json.load(fp))
+
+    def to_obj(self) -> dict:
+        interned: dict[str, int] = {}
+        flat_weights = []
+        for weights in self.weights:
+            flat: list[int] = []
+            for name, w in weights.items():
+                flat.extend((interned.setdefault(name, len(interned)), w))
+            flat_weights.append(flat)
+        return {
+            "version": 1,
+            "horses": self.horses,
+            "numPerm": self.num_perm,
+            "bands": self.bands,
+            "seed": self.seed,
+            "names": list(interned),
+            "weights": flat_weights,
+            "bandKeys": self.keys,
+        }
+
+    def write(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w", encoding="utf-8", newline="\n") as fp:
+            json.dump(self.to_obj(), fp, ensure_ascii=False, separators=(",", ":"))
+            fp.write("\n")
+
+    def candidates(self, keys: Sequence[int]) -> set[int]:
+        """いずれかの帯でバケットを共有する馬の序数。"""
+        found: set[int] = set()
+        for band, key in enumerate(keys):
+            found.update(self._buckets[band].get(key, ()))
+        return found
+
+    def query(
+        self,
+        weights: dict[str, int],
+        k: int,
+        accept: Optional[Callable[[int], bool]] = None,
+    ) -> list[tuple[int, float]]:
+        """
+        重み付き祖先集合に似た馬を (序数, 類似度) で k 件（類似度の高い順、同率は序数順）。
+
+        LSH の候補だけを正確な重み付き Jaccard で並べ直す。`accept` で候補を絞れる
+        （性別の指定など）。候補が k に満たなければ、その分だけ少なく返す。
+        """
+        keys = band_keys(self.hasher.signature(weights), self.bands)
+        return self._rank(weights, self.candidates(keys), k, accept)
+
+    def similar(
+        self,
+        ordinal: int,
+        k: int,
+        accept: Optional[Callable[[int], bool]] = None,
+    ) -> list[tuple[int, float]]:
+        """序数 `ordinal` の馬に似た馬（本人を除く）。保存済みのバケットキーを使う。"""
+        found = self.candidates(self.keys[ordinal])
+        found.discard(ordinal)
+        return self._rank(self.weights[ordinal], found, k, accept)
+
+    def _rank(
+        self,
+        weights: dict[str, int],
+        found: Iterable[int],
+        k: int,
+        accept: Optional[Callable[[int], bool]],
+    ) -> list[tuple[int, float]]:
+        scored = [
+            (ordinal, weighted_jaccard(weights, self.weights[ordinal]))
+            for ordinal in found
+            if accept is None or accept(ordinal)
+        ]
+        return heapq.nsmallest(k, scored, key=lambda item: (-item[1], item[0]))
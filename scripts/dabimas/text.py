@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+検索テキストの正規化（JS 側 `normalizeSearchText` と同じ規則）。
+
+build 時に summary へ焼き込む `searchText` と、Python 側の検索クエリの両方で使う。
+"""
+
+from __future__ import annotations
+
+import re
+import unicodedata
+
+
+# JS 側 normalizeSearchText と同じく、半角/全角スペース類を畳む。
+SEARCH_SPACE_RE = re.compile(r"[　\s]+")
+
+
+def normalize_search_text(text: str) -> str:
+    """
+    index.html の `normalizeSearchText` と同じ正規化を Python で再現する。
+
+    NFKC 正規化 → trim → 小文字化 → 空白除去 → カタカナをひらがな化。
+    summary に焼き込む `searchText` を、アプリ実行時の検索インデックスと
+    一致させるために使う。
+    """
+    if not isinstance(text, str):
+        return ""
+    s = unicodedata.normalize("NFKC", text).strip().lower()
+    s = SEARCH_SPACE_RE.sub("", s)
+    out = []
+    for ch in s:
+        code = ord(ch)
+        # U+30A1..U+30F6（カタカナ）をひらがなへ。JS 実装と同じ範囲。
+        if 0x30A1 <= code <= 0x30F6:
+            out.append(chr(code - 0x60))
+        else:
+            out.append(ch)
+    return "".join(out)
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+公開 JSON の構造検証。
+
+スキーマ（dict / list / 型の入れ子）は起動時に 1 回だけ検査関数へ組み立てておき、
+3,000 頭規模の summary + detail chunk を 1 パスで検査する。検査するもの:
+
+- summary / detail chunk / brosData.json / inbreed-exceptions.json のキーと型
+- summary の id が一意で、`detailChunk` が指す chunk にちょうど 1 件の detail があること
+  （どの summary からも指されない detail も不正）
+- descendants が 15 頭であること
+- 因子略称が既知の略称（`FACTOR_SHORT_DICT` の値）か空であること
+- 親系統コードが既知のコード（`PARENTAL_LINE_DICT` の値）であること
+  （祖先は馬名も空の枠に限り空コードを許す）
+- summary に集計列（`dabimas.aggregates`）があれば、全馬にあり detail の descendants と一致すること
+- brosData の兄弟・姉妹の一覧が対称で、グループの全員を挙げていること（`dabimas.siblings`）
+
+build ではステージングに書いた成果物をこれで検査し、問題があれば公開しない。
+"""
+
+from __future__ import annotations
+
+import json
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from dabimas.aggregates import SummaryAggregates
+from dabimas.siblings import SiblingIndex
+
+
+# 血統の頭数と、1 頭あたりの因子枠数。
+PEDIGREE_SIZE = 15
+FACTOR_SLOTS = 3
+# 報告する問題の上限（壊れ方がひどいときに出力が溢れないように）。
+MAX_PROBLEMS = 200
+
+# スキーマ記法: dict はキー -> スキーマ（キー末尾 "?" は省略可）、[x] は要素が x のリスト、
+# 型はその型（bool は int と区別する）。
+DESCENDANT_SCHEMA = {"name": str, "parentLine": str, "son": str, "factors": [str]}
+SUMMARY_HORSE_SCHEMA = {
+    "id": str,
+    "detailChunk": int,
+    "name": str,
+    "ruby": str,
+    "subName": str,
+    "nature": str,
+    "sex": str,
+    "parentLine": str,
+    "son": str,
+    "factors": [str],
+    "displayName": str,
+    "searchText": str,
+    "pedigreeFactors?": [int],
+    "factorAncestors?": int,
+    "parentLineMask?": int,
+}
+SUMMARY_SCHEMA = {
+    "version": int,
+    "chunkSize": int,
+    "aggregates?": {"factors": [str], "parentLines": [str]},
+    "horseLists": [SUMMARY_HORSE_SCHEMA],
+}
+DETAIL_CHUNK_SCHEMA = {
+    "version": int,
+    "chunkIndex": int,
+    "horseDetails": [{"id": str, "descendants": [DESCENDANT_SCHEMA]}],
+}
+BROS_DATA_SCHEMA = {
+    "brosData": [{"key": str, "bros": {"fullBrothers": [str], "fullSisters": [str]}}],
+}
+INBREED_SIDE_SCHEMA = {"horse": str, "side": str, "generation?": int, "operator?": str}
+INBREED_EXCEPTIONS_SCHEMA = [
+    {
+        "id": str,
+        "name": str,
+        "description?": str,
+        "trigger": INBREED_SIDE_SCHEMA,
+        "target": INBREED_SIDE_SCHEMA,
+        "action": {
+            "recognizeAsCross": bool,
+            "excludeAncestors": bool,
+            "displayInSameNameGroups": bool,
+            "excludeAncestorBranches?": [{"trigger": [str], "target": [str]}],
+        },
+    }
+]
+
+SEX_CODES = frozenset({"0", "1"})
+
+Checker = Callable[[object, str, list], None]
+
+
+def compile_schema(schema: object) -> Checker:
+    """スキーマを `check(value, path, problems)` 関数に組み立てる。"""
+    if isinstance(schema, type):
+        expected = schema
+        name = expected.__name__
+
+        if expected is int:
+            def check_int(value: object, path: str, problems: list) -> None:
+                if type(value) is not int:
+                    problems.append(f"{path}: expected int, got {type(value).__name__}")
+            return check_int
+
+        def check_type(value: object, path: str, problems: list) -> None:
+            if not isinstance(value, expected):
+                problems.append(f"{path}: expected {name}, got {type(value).__name__}")
+        return check_type
+
+    if isinstance(schema, list):
+        item_check = compile_schema(schema[0])
+
+        def check_list(value: object, path: str, problems: list) -> None:
+            if not isinstance(value, list):
+                problems.append(f"{path}: expected list, got {type(value).__name__}")
+                return
+            for i, item in enumerate(value):
+                item_check(item, f"{path}[{i}]", problems)
+        return check_list
+
+    if isinstance(schema, dict):
+        # 必須のスカラー列は関数呼び出しを挟まず、型の完全一致だけをその場で見る（高速経路）。
+        # 入れ子・省略可の列と、型が合わなかったときの詳細はフィールドごとの検査関数に任せる。
+        scalars: list[tuple[str, type]] = []
+        fields: list[tuple[str, bool, Checker]] = []
+        nested: list[tuple[str, bool, Checker]] = []
+        for key, sub in schema.items():
+            optional = key.endswith("?")
+            field = (key.rstrip("?"), optional, compile_schema(sub))
+            fields.append(field)
+            if isinstance(sub, type) and not optional:
+                scalars.append((key, sub))
+            else:
+                nested.append(field)
+
+        def check_dict(value: object, path: str, problems: list) -> None:
+            if not isinstance(value, dict):
+                problems.append(f"{path}: expected object, got {type(value).__name__}")
+                return
+            get = value.get
+            for key, expected in scalars:
+                if type(get(key)) is not expected:
+                    break
+            else:
+                for key, optional, sub_check in nested:
+                    if key in value:
+                        sub_check(value[key], f"{path}.{key}", problems)
+                    elif not optional:
+                        problems.append(f"{path}: missing key {key!r}")
+                return
+            for key, optional, sub_check in fields:
+                if key in value:
+                    sub_check(value[key], f"{path}.{key}", problems)
+                elif not optional:
+                    problems.append(f"{path}: missing key {key!r}")
+        return check_dict
+
+    raise TypeError(f"unsupported schema node: {schema!r}")
+
+
+class ArtifactValidator:
+    """
+    既知の因子略称・親系統コードを受け取り、スキーマを組み立て済みで持つ検証器。
+
+    各 `validate_*` は問題の説明文リストを返す（空なら合格）。
+    """
+
+    def __init__(self, factor_letters: Iterable[str], parent_line_codes: Iterable[str]):
+        self.factor_letters = frozenset(factor_letters) | {""}
+        self.parent_line_codes = frozenset(parent_line_codes)
+        self._check_summary = compile_schema(SUMMARY_SCHEMA)
+        self._check_chunk = compile_schema(DETAIL_CHUNK_SCHEMA)
+        self._check_bros = compile_schema(BROS_DATA_SCHEMA)
+        self._check_inbreed = compile_schema(INBREED_EXCEPTIONS_SCHEMA)
+
+    def _check_factors(self, factors: list, path: str, problems: list) -> None:
+        if len(factors) != FACTOR_SLOTS:
+            problems.append(f"{path}.factors: expected {FACTOR_SLOTS} slots, got {len(factors)}")
+        for factor in factors:
+            if factor not in self.factor_letters:
+                problems.append(f"{path}.factors: unknown factor {factor!r}")
+
+    def validate_published(self, summary: object, chunks: Optional[dict[int, object]]) -> list[str]:
+        """
+        summary と chunk 番号 -> chunk オブジェクトを検査する。片方だけ（もう片方は None）でもよく、
+        そのときは相手の要る突き合わせ（`detailChunk`・集計列・参照されない detail）だけを省く。
+        """
+        problems: list[str] = []
+        if summary is not None:
+            self._check_summary(summary, "summary", problems)
+        for chunk_index, chunk in sorted((chunks or {}).items()):
+            self._check_chunk(chunk, f"chunk[{chunk_index}]", problems)
+        if problems:
+            # 型が崩れていると以降の検査が例外になるので、ここで打ち切る。
+            return problems[:MAX_PROBLEMS]
+
+        # detail の所在: id -> 載っている chunk 番号の列。集計列があれば detail から作り直した値も持つ。
+        located: dict[str, list[int]] = {}
+        aggregates = None
+        if summary is not None and "aggregates" in summary:
+            aggregates = SummaryAggregates.from_header(summary["aggregates"])
+        expected_columns: dict[str, dict] = {}
+        for chunk_index, chunk in (chunks or {}).items():
+            if chunk["chunkIndex"] != chunk_index:
+                problems.append(f"chunk[{chunk_index}]: chunkIndex is {chunk['chunkIndex']}")
+            for detail in chunk["horseDetails"]:
+                located.setdefault(detail["id"], []).append(chunk_index)
+                path = f"chunk[{chunk_index}].{detail['id']}"
+                descendants = detail["descendants"]
+                if aggregates is not None:
+                    expected_columns[detail["id"]] = aggregates.columns(descendants)
+                if len(descendants) != PEDIGREE_SIZE:
+                    problems.append(f"{path}: expected {PEDIGREE_SIZE} descendants, got {len(descendants)}")
+                for slot, d in enumerate(descendants):
+                    code = d["parentLine"]
+                    if code not in self.parent_line_codes and (code or d["name"]):
+                        problems.append(f"{path}.descendants[{slot}]: unknown parentLine {code!r}")
+                    factors = d["factors"]
+                    if len(factors) != FACTOR_SLOTS or not self.factor_letters.issuperset(factors):
+                        self._check_factors(factors, f"{path}.descendants[{slot}]", problems)
+
+        if summary is None:
+            return problems[:MAX_PROBLEMS]
+        seen: set[str] = set()
+        for horse in summary["horseLists"]:
+            horse_id = horse["id"]
+            path = f"summary.{horse_id}"
+            if horse_id in seen:
+                problems.append(f"{path}: duplicate id")
+                continue
+            seen.add(horse_id)
+            where = located.get(horse_id, [])
+            if chunks is not None and where != [horse["detailChunk"]]:
+                problems.append(f"{path}: detailChunk {horse['detailChunk']} but detail found in {where}")
+            if horse["sex"] not in SEX_CODES:
+                problems.append(f"{path}: unknown sex {horse['sex']!r}")
+            if horse["parentLine"] not in self.parent_line_codes:
+                problems.append(f"{path}: unknown parentLine {horse['parentLine']!r}")
+            self._check_factors(horse["factors"], path, problems)
+            if aggregates is not None:
+                expected = expected_columns.get(horse_id)
+                for key, value in (expected or {}).items():
+                    if horse.get(key) != value:
+                        problems.append(f"{path}.{key}: {horse.get(key)!r} but the detail gives {value!r}")
+            if len(problems) >= MAX_PROBLEMS:
+                return problems[:MAX_PROBLEMS]
+        for horse_id in located.keys() - seen:
+            problems.append(f"detail {horse_id}: not referenced by the summary")
+        return problems[:MAX_PROBLEMS]
+
+    def validate_bros_data(self, obj: object) -> list[str]:
+        problems: list[str] = []
+        self._check_bros(obj, "brosData", problems)
+        if not problems:
+            problems.extend(f"brosData: {p}" for p in SiblingIndex.from_bros_data(obj).problems)  # type: ignore[arg-type]
+        return problems[:MAX_PROBLEMS]
+
+    def validate_inbreed_exceptions(self, obj: object) -> list[str]:
+        problems: list[str] = []
+        self._check_inbreed(obj, "inbreedExceptions", problems)
+        if not problems:
+            ids = [rule["id"] for rule in obj]  # type: ignore[union-attr]
+            for rule_id in sorted(i for i, n in Counter(ids).items() if n > 1):
+                problems.append(f"inbreedExceptions: duplicate id {rule_id!r}")
+        return problems[:MAX_PROBLEMS]
+
+    def validate_files(
+        self,
+        summary_path: Optional[Path],
+        details_dir: Optional[Path],
+        bros_path: Optional[Path] = None,
+        inbreed_path: Optional[Path] = None,
+    ) -> list[str]:
+        """
+        ファイルから読んで検査する。summary と details_dir は両方あれば突き合わせ、片方だけなら
+        その側を単独で検査する。読めない / JSON でないファイルも問題として返す。
+        """
+        problems: list[str] = []
+
+        def load(path: Path) -> object:
+            try:
+                with path.open("r", encoding="utf-8") as fp:
+                    return json.load(fp)
+            except (OSError, ValueError) as e:
+                problems.append(f"{path}: {e}")
+                return None
+
+        if summary_path is not None or details_dir is not None:
+            summary = load(summary_path) if summary_path is not None else None
+            chunks: Optional[dict[int, object]] = None
+            if details_dir is not None:
+                chunks = {}
+                for path in sorted(details_dir.glob("dabimasFactor.details.*.json")):
+                    index = path.name.split(".")[-2]
+                    if index.isdigit():
+                        chunks[int(index)] = load(path)
+            if not problems:
+                problems.extend(self.validate_published(summary, chunks))
+        if bros_path is not None:
+            bros = load(bros_path)
+            if bros is not None:
+                problems.extend(self.validate_bros_data(bros))
+        if inbreed_path is not None:
+            inbreed = load(inbreed_path)
+            if inbreed is not None:
+                problems.extend(self.validate_inbreed_exceptions(inbreed))
+        return problems[:MAX_PROBLEMS]
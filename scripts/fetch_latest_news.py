@@ -3,10 +3,14 @@
 import argparse
 import re
 import sys
+from urllib.parse import urljoin
 
 import requests
 from bs4 import BeautifulSoup, Tag
 
+# Detail pages that build_dabimas_stream.py can parse.
+HORSE_DETAIL_PATH_RE = re.compile(r"/kouryaku/(stallions|broodmares)/\d+\.html$")
+
 
 def _normalize_spaces(text: str) -> str:
     # Collapse runs of whitespace while keeping readable separators.
@@ -61,6 +65,21 @@ def extract_latest_stallions_text(html: str) -> str:
     return "\n".join([*stallion_names, suffix])
 
 
+def extract_latest_horse_urls(html: str, base_url: str) -> list[str]:
+    # Absolute detail URLs linked from the first news row, in page order, deduplicated.
+    first_item = _find_latest_news_item(html)
+
+    urls: list[str] = []
+    seen: set[str] = set()
+    for a_tag in first_item.find_all("a", href=True):
+        url = urljoin(base_url, a_tag["href"].strip())
+        if not HORSE_DETAIL_PATH_RE.search(url) or url in seen:
+            continue
+        seen.add(url)
+        urls.append(url)
+    return urls
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(
         description=(
@@ -83,6 +102,14 @@ def main() -> int:
         default=None,
         help="Optional output path for the normalized first news row",
     )
+    parser.add_argument(
+        "--urls-out",
+        default=None,
+        help=(
+            "Optional output path for the detail URLs linked from the first news row "
+            "(usable as build_dabimas_stream.py --urls-file)"
+        ),
+    )
     parser.add_argument(
         "--timeout",
         type=float,
@@ -96,6 +123,7 @@ def main() -> int:
 
     news_text = extract_latest_news_text(response.text)
     text = extract_latest_stallions_text(response.text)
+    horse_urls = extract_latest_horse_urls(response.text, args.url) if args.urls_out else []
 
     with open(args.out, "w", encoding="utf-8", newline="\n") as f:
         f.write(text + "\n")
@@ -104,11 +132,17 @@ def main() -> int:
         with open(args.news_out, "w", encoding="utf-8", newline="\n") as f:
             f.write(news_text + "\n")
 
+    if args.urls_out:
+        with open(args.urls_out, "w", encoding="utf-8", newline="\n") as f:
+            f.writelines(url + "\n" for url in horse_urls)
+
     print(f"Saved: {args.out}")
     print(text)
     if args.news_out:
         print(f"Saved: {args.news_out}")
         print(news_text)
+    if args.urls_out:
+        print(f"Saved: {args.urls_out} ({len(horse_urls)} urls)")
     return 0
 
 
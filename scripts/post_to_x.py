@@ -1,16 +1,44 @@
 ﻿from __future__ import annotations
 
+import argparse
+import glob
 import json
 import mimetypes
 import os
+import random
+import re
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Callable
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 
-TOKEN_URL = "https://api.x.com/2/oauth2/token"
-POST_URL = "https://api.x.com/2/tweets"
-MEDIA_UPLOAD_URL = "https://api.x.com/2/media/upload"
+API_BASE = "https://api.x.com"
+TOKEN_PATH = "/2/oauth2/token"
+POST_PATH = "/2/tweets"
+MEDIA_UPLOAD_PATH = "/2/media/upload"
+TOKEN_URL = API_BASE + TOKEN_PATH
+POST_URL = API_BASE + POST_PATH
+MEDIA_UPLOAD_URL = API_BASE + MEDIA_UPLOAD_PATH
+# X の 1 ポストに添付できる画像の上限。
+MAX_MEDIA = 4
+
+# 一時エラーの再試行。media は何度送っても孤立メディアが残るだけなので 5xx も再試行し、
+# 投稿は二重投稿を避けるため 429（未処理が確実）と接続失敗だけを再試行する。
+# token 更新は refresh token が使い捨てなので、サーバーに届いていない接続失敗だけを再試行する。
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+MEDIA_RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+POST_RETRY_STATUSES = frozenset({429})
+# (接続, 読み取り) タイムアウト秒。
+TOKEN_TIMEOUT = (10, 30)
+MEDIA_TIMEOUT = (10, 120)
+POST_TIMEOUT = (10, 30)
 
 
 def get_env(name: str) -> str:
@@ -20,13 +48,84 @@ def get_env(name: str) -> str:
     return value
 
 
-def refresh_access_token(client_id: str, refresh_token: str) -> dict:
+def make_session(pool_size: int = MAX_MEDIA) -> requests.Session:
+    """token / media / 投稿で共有する接続プール付きセッション。"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _retry_delay(response: requests.Response | None, attempt: int, backoff: float) -> float:
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), MAX_BACKOFF)
+    # 指数バックオフ + ジッター（同時に失敗した並列アップロードが揃って再送しないように）。
+    return min(MAX_BACKOFF, backoff * (2 ** attempt)) * (0.5 + random.random() / 2)
+
+
+def _is_connect_error(error: Exception) -> bool:
+    """接続確立前の失敗（リクエストがサーバーへ届いていない）なら True。"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def request_with_retries(
+    send: Callable[[], requests.Response],
+    label: str,
+    retries: int,
+    backoff: float,
+    retry_statuses: frozenset[int] = frozenset(),
+    connect_errors_only: bool = False,
+) -> requests.Response:
+    """
+    `send()` を最大 1 + retries 回呼ぶ。`retry_statuses` の応答と通信エラーを再試行し、
+    最後の応答（または例外）をそのまま返す。`connect_errors_only` なら通信エラーのうち
+    接続確立の失敗だけを再試行する。
+    """
+    attempt = 0
+    while True:
+        try:
+            response = send()
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= retries or (connect_errors_only and not _is_connect_error(e)):
+                raise
+            delay = _retry_delay(None, attempt, backoff)
+            print(f"[retry] {label}: {type(e).__name__}; retrying in {delay:.1f}s ({attempt + 1}/{retries})")
+        else:
+            if response.status_code not in retry_statuses or attempt >= retries:
+                return response
+            delay = _retry_delay(response, attempt, backoff)
+            print(f"[retry] {label}: HTTP {response.status_code}; retrying in {delay:.1f}s ({attempt + 1}/{retries})")
+        time.sleep(delay)
+        attempt += 1
+
+
+def refresh_access_token(
+    client_id: str,
+    refresh_token: str,
+    session: requests.Session | None = None,
+    api_base: str = API_BASE,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+) -> dict:
+    session = session or make_session()
     data = {
         "refresh_token": refresh_token,
         "grant_type": "refresh_token",
         "client_id": client_id,
     }
-    response = requests.post(TOKEN_URL, data=data, timeout=30)
+    response = request_with_retries(
+        lambda: session.post(api_base + TOKEN_PATH, data=data, timeout=TOKEN_TIMEOUT),
+        "token refresh",
+        retries,
+        backoff,
+        connect_errors_only=True,
+    )
     if response.status_code >= 400:
         raise RuntimeError(f"Token refresh failed: {response.status_code} {response.text}")
     return response.json()
@@ -47,29 +146,69 @@ def mask_for_github_logs(value: str) -> None:
         print(f"::add-mask::{value}")
 
 
-def upload_image(access_token: str, image_path: str) -> str:
+def _natural_key(path: str) -> list[object]:
+    # latest_stallions-2.png < latest_stallions-10.png になるよう数字は数値で比べる。
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", path)]
+
+
+def resolve_media_paths(spec: str) -> list[str]:
+    """
+    X_MEDIA_PATH（改行またはカンマ区切り、各要素はワイルドカード可）を添付順のパス列にする。
+
+    ワイルドカードは一致したファイルを自然順で並べる（一致なしは無視）。重複は除き、
+    MAX_MEDIA 枚を超えた分は警告して添付しない。
+    """
+    paths: list[str] = []
+    for item in re.split(r"[\n,]", spec):
+        item = item.strip()
+        if not item:
+            continue
+        if glob.has_magic(item):
+            matches = sorted(glob.glob(item), key=_natural_key)
+        else:
+            matches = [item]
+        for path in matches:
+            if path not in paths:
+                paths.append(path)
+    if len(paths) > MAX_MEDIA:
+        print(f"[warn] {len(paths)} media files given; attaching the first {MAX_MEDIA}: {paths[MAX_MEDIA:]} skipped")
+        paths = paths[:MAX_MEDIA]
+    return paths
+
+
+def upload_image(
+    access_token: str,
+    image_path: str,
+    session: requests.Session | None = None,
+    api_base: str = API_BASE,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+) -> str:
+    session = session or make_session()
     path = Path(image_path)
     if not path.exists():
         raise FileNotFoundError(f"Image file not found: {path}")
 
     media_type = mimetypes.guess_type(path.name)[0] or "image/png"
     headers = {"Authorization": f"Bearer {access_token}"}
-
-    with path.open("rb") as fp:
-        files = {
-            "media": (path.name, fp, media_type),
-        }
-        data = {
-            "media_category": "tweet_image",
-            "media_type": media_type,
-        }
-        response = requests.post(
-            MEDIA_UPLOAD_URL,
+    content = path.read_bytes()
+    data = {
+        "media_category": "tweet_image",
+        "media_type": media_type,
+    }
+    response = request_with_retries(
+        lambda: session.post(
+            api_base + MEDIA_UPLOAD_PATH,
             headers=headers,
-            files=files,
+            files={"media": (path.name, content, media_type)},
             data=data,
-            timeout=120,
-        )
+            timeout=MEDIA_TIMEOUT,
+        ),
+        f"media upload {path.name}",
+        retries,
+        backoff,
+        retry_statuses=MEDIA_RETRY_STATUSES,
+    )
 
     if response.status_code >= 400:
         hint = " Ensure your token includes media.write scope."
@@ -82,42 +221,138 @@ def upload_image(access_token: str, image_path: str) -> str:
     return str(media_id)
 
 
-def post_tweet(access_token: str, text: str, media_id: str | None = None) -> dict:
+def upload_images(
+    access_token: str,
+    image_paths: list[str],
+    session: requests.Session,
+    api_base: str = API_BASE,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+) -> list[str]:
+    """画像を並列にアップロードし、media id を `image_paths` と同じ順で返す。"""
+    if not image_paths:
+        return []
+    with ThreadPoolExecutor(max_workers=len(image_paths)) as pool:
+        return list(
+            pool.map(
+                lambda path: upload_image(access_token, path, session, api_base, retries, backoff),
+                image_paths,
+            )
+        )
+
+
+def post_tweet(
+    access_token: str,
+    text: str,
+    media_ids: list[str] | None = None,
+    session: requests.Session | None = None,
+    api_base: str = API_BASE,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+) -> dict:
+    session = session or make_session()
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json",
     }
     payload: dict[str, object] = {"text": text}
-    if media_id:
-        payload["media"] = {"media_ids": [media_id]}
+    if media_ids:
+        payload["media"] = {"media_ids": media_ids}
 
-    response = requests.post(POST_URL, headers=headers, json=payload, timeout=30)
+    response = request_with_retries(
+        lambda: session.post(api_base + POST_PATH, headers=headers, json=payload, timeout=POST_TIMEOUT),
+        "post",
+        retries,
+        backoff,
+        retry_statuses=POST_RETRY_STATUSES,
+        connect_errors_only=True,
+    )
     if response.status_code >= 400:
         raise RuntimeError(f"Post failed: {response.status_code} {response.text}")
     return response.json()
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Refresh the X token, upload media and post (settings from env).")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        default=os.getenv("X_DRY_RUN") == "1",
+        help="Run the whole flow against a local X API stub (or X_API_BASE) instead of api.x.com (env X_DRY_RUN=1)",
+    )
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="Dry-run: stub response delay in seconds")
+    parser.add_argument("--stub-fail-rate", type=float, default=0.0, help="Dry-run: stub transient error rate")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="Retries per request on transient errors")
+    parser.add_argument("--backoff", type=float, default=DEFAULT_BACKOFF, help="Base backoff in seconds")
+    return parser.parse_args()
+
+
 def main() -> int:
-    client_id = get_env("X_CLIENT_ID")
-    refresh_token = get_env("X_REFRESH_TOKEN")
-    text = get_env("X_TWEET_TEXT")
-    media_path = (os.getenv("X_MEDIA_PATH") or "").strip()
-
-    token_response = refresh_access_token(client_id, refresh_token)
-    access_token = token_response.get("access_token")
-    if not access_token:
-        raise RuntimeError(f"No access_token in response: {token_response}")
-
-    refreshed_token = token_response.get("refresh_token")
-    if isinstance(refreshed_token, str) and refreshed_token:
-        mask_for_github_logs(refreshed_token)
-        set_github_output("new_refresh_token", refreshed_token)
+    args = parse_args()
+    stub = None
+    api_base = API_BASE
+    if args.dry_run:
+        # 接続先の差し替え（X_API_BASE、別プロセスで起動したスタブなど）は dry-run でだけ受け付ける。
+        # 本番の認証情報を api.x.com 以外へ送らない。
+        api_base = os.getenv("X_API_BASE") or ""
+        if not api_base:
+            from x_api_stub import XApiStub
+
+            stub = XApiStub(latency=args.stub_latency, fail_rate=args.stub_fail_rate)
+            api_base = stub.start()
+        client_id = os.getenv("X_CLIENT_ID") or "dry-run-client"
+        refresh_token = os.getenv("X_REFRESH_TOKEN") or "dry-run-refresh"
+        text = os.getenv("X_TWEET_TEXT") or "dry-run"
+        print(f"dry-run: X API stub at {api_base}")
     else:
-        set_github_output("new_refresh_token", "")
+        client_id = get_env("X_CLIENT_ID")
+        refresh_token = get_env("X_REFRESH_TOKEN")
+        text = get_env("X_TWEET_TEXT")
+    media_paths = resolve_media_paths(os.getenv("X_MEDIA_PATH") or "")
+
+    session = make_session(max(1, len(media_paths)))
+    timings: dict[str, float] = {}
+    try:
+        started = time.perf_counter()
+        token_response = refresh_access_token(
+            client_id, refresh_token, session, api_base, args.retries, args.backoff
+        )
+        timings["token"] = time.perf_counter() - started
+        access_token = token_response.get("access_token")
+        if not access_token:
+            raise RuntimeError(f"No access_token in response: {token_response}")
 
-    media_id = upload_image(access_token, media_path) if media_path else None
-    post_response = post_tweet(access_token, text, media_id=media_id)
+        refreshed_token = token_response.get("refresh_token")
+        if args.dry_run:
+            # スタブの token で本物の Secrets をローテーションしない。
+            pass
+        elif isinstance(refreshed_token, str) and refreshed_token:
+            mask_for_github_logs(refreshed_token)
+            set_github_output("new_refresh_token", refreshed_token)
+        else:
+            set_github_output("new_refresh_token", "")
+
+        started = time.perf_counter()
+        media_ids = upload_images(access_token, media_paths, session, api_base, args.retries, args.backoff)
+        timings["media"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        post_response = post_tweet(
+            access_token, text, media_ids=media_ids, session=session, api_base=api_base,
+            retries=args.retries, backoff=args.backoff,
+        )
+        timings["post"] = time.perf_counter() - started
+    finally:
+        session.close()
+        if stub is not None:
+            stub.stop()
     print(json.dumps(post_response, ensure_ascii=False))
+    print(
+        "timings: " + ", ".join(f"{name}={seconds:.3f}s" for name, seconds in timings.items())
+        + f" ({len(media_ids)} media)"
+    )
+    if stub is not None:
+        print(f"dry-run: stub requests {stub.counts}, uploaded {stub.uploaded_bytes} bytes")
     return 0
 
 
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+serve_dabimas.py
+
+公開 JSON（summary + detail chunk）を索引付きでメモリに載せ、読み取り専用の
+HTTP API として返すローカルサーバー。標準ライブラリ（asyncio）だけで動く。
+
+エンドポイント（GET / HEAD のみ。応答はすべて JSON）:
+- `/horses/<id>`: summary レコード + descendants
+- `/pedigree/<id>`: 血統 15 頭。各祖先に同名馬の id 候補（`ids`）を付ける
+- `/similar/<id>?limit=<n>&sex=<0|1>`: 血統が似ている馬（MinHash / LSH の候補を重み付き Jaccard で順位付け）
+- `/search?q=<text>&limit=<n>`: `normalize_search_text` による部分一致（アプリと同じ判定）
+- `/horses?factor=<略称>&factor=...&parentLine=<code>&sex=<0|1>&limit=<n>&offset=<n>`: 因子・親系統の絞り込み
+- `/stats`: 件数、読み込み世代、chunk 読み込み数
+
+応答には本文の SHA-1 由来の ETag を付け、`If-None-Match` 一致なら 304 を返す。
+`Accept-Encoding: gzip` なら一定サイズ以上を gzip で返す。公開物の更新を定期的に確認し、
+読み込みに成功したら新しい索引へ差し替える。manifest（`dabimas.publish`）があれば manifest の
+差し替えだけを更新とみなし、読み込むまでは旧世代のディレクトリから応答を続ける。旧世代の
+ディレクトリが消された後に chunk を引いてしまった場合だけ 503（Retry-After）を返し、すぐ再読み込みする。
+キャッシュに無い応答はスレッドで組み立てるので、chunk の読み込み中も他の接続は止まらない
+（類似索引は読み込み時に作っておく）。壊れた要求には 400、処理中の例外には 500 を返す。
+
+`--bench N` を付けると同じプロセスでサーバーを起動し、`--concurrency` 本の keep-alive
+接続から N リクエストを投げてスループットとレイテンシを表示する。
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from dabimas.publish import MANIFEST_FILENAME, GenerationChangedError
+from dabimas.query import DETAILS_DIRNAME, SUMMARY_FILENAME, DabimasDataset
+
+
+# これ未満の本文は gzip しない（ヘッダ込みで逆に大きくなるため）。
+GZIP_MIN_BYTES = 512
+# 応答本文のキャッシュ件数（読み込み世代が変わると捨てる）。
+RESPONSE_CACHE_SIZE = 1024
+# `/search` と `/horses` の既定・上限件数。
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 1000
+# リクエストヘッダの上限（これを超える接続は切る）。
+MAX_HEADER_BYTES = 16 * 1024
+# GET / HEAD に付いてきた本文の上限（読み捨てる。超えたら 400 で切る）。
+MAX_BODY_BYTES = 64 * 1024
+
+STATUS_TEXT = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+def load_dataset(json_dir: Path, cache_chunks: int) -> DabimasDataset:
+    """データセットを開き、初回の `/similar` で作る類似索引も先に作っておく。"""
+    dataset = DabimasDataset.open(json_dir, cache_chunks=cache_chunks)
+    dataset.similarity_index()
+    return dataset
+
+
+def artifacts_signature(json_dir: Path) -> tuple:
+    """
+    更新検知用の (名前, mtime_ns, size) 列。manifest があれば manifest だけ（公開のコミット点）、
+    無ければ summary と各 detail chunk。
+    """
+    manifest_path = json_dir / MANIFEST_FILENAME
+    if manifest_path.exists():
+        paths = [manifest_path]
+    else:
+        paths = [json_dir / SUMMARY_FILENAME]
+        details_dir = json_dir / DETAILS_DIRNAME
+        if details_dir.is_dir():
+            paths.extend(sorted(details_dir.glob("dabimasFactor.details.*.json")))
+    signature = []
+    for path in paths:
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        signature.append((path.name, st.st_mtime_ns, st.st_size))
+    return tuple(signature)
+
+
+class CachedResponse:
+    """エンコード済み応答本文と ETag。gzip 版は初回要求時に作る。"""
+
+    __slots__ = ("status", "body", "etag", "_gzipped")
+
+    def __init__(self, status: int, obj: object):
+        self.status = status
+        self.body = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest()[:20] + '"'
+        self._gzipped: Optional[bytes] = None
+
+    def gzipped(self) -> bytes:
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=5, mtime=0)
+        return self._gzipped
+
+
+class ApiServer:
+    """読み込み済みデータセットと応答キャッシュを持ち、HTTP 接続を捌く。"""
+
+    def __init__(self, json_dir: Path, cache_chunks: int, reload_interval: float):
+        self.json_dir = json_dir
+        self.cache_chunks = cache_chunks
+        self.reload_interval = reload_interval
+        self.signature = artifacts_signature(json_dir)
+        self.dataset = load_dataset(json_dir, cache_chunks)
+        self.generation = 1
+        self.requests = 0
+        self._responses: OrderedDict[str, CachedResponse] = OrderedDict()
+        # 開いている世代のファイルが消されていたときに立て、watch() の待機を打ち切る。
+        self._stale = asyncio.Event()
+
+    async def watch(self) -> None:
+        """公開物の更新を監視し、読み込めたら差し替える。読めなければ旧世代のまま次回再試行。"""
+        while True:
+            try:
+                await asyncio.wait_for(self._stale.wait(), timeout=self.reload_interval)
+            except asyncio.TimeoutError:
+                pass
+            stale = self._stale.is_set()
+            self._stale.clear()
+            signature = artifacts_signature(self.json_dir)
+            if signature == self.signature and not stale:
+                continue
+            try:
+                dataset = await asyncio.to_thread(load_dataset, self.json_dir, self.cache_chunks)
+            except (OSError, ValueError, KeyError, GenerationChangedError) as e:
+                print(f"[warn] reload failed, keeping generation {self.generation}: {e}")
+                continue
+            self.dataset = dataset
+            self.signature = signature
+            self.generation += 1
+            self._responses.clear()
+            print(
+                f"reloaded: generation {self.generation} ({len(dataset)} horses, "
+                f"published generation {dataset.generation})"
+            )
+
+    async def respond(self, target: str) -> CachedResponse:
+        """
+        リクエストターゲット（path + query）の応答。同じ世代の同じターゲットはキャッシュを返す。
+        キャッシュに無ければ `route()` をスレッドで実行し、chunk の読み込み中も他の接続を止めない。
+        """
+        cached = self._responses.get(target)
+        if cached is not None:
+            self._responses.move_to_end(target)
+            return cached
+        generation = self.generation
+        try:
+            status, obj = await asyncio.to_thread(self.route, target)
+        except GenerationChangedError:
+            self._stale.set()
+            return CachedResponse(503, {"error": "dataset is being republished, retry"})
+        except Exception as e:
+            print(f"[error] {target}: {type(e).__name__}: {e}")
+            return CachedResponse(500, {"error": "internal server error"})
+        response = CachedResponse(status, obj)
+        # /stats は毎回変わるのでキャッシュしない。処理中に世代が変わった応答も載せない。
+        if status in (200, 404) and not target.startswith("/stats") and generation == self.generation:
+            self._responses[target] = response
+            while len(self._responses) > RESPONSE_CACHE_SIZE:
+                self._responses.popitem(last=False)
+        return response
+
+    def route(self, target: str) -> tuple[int, object]:
+        """ターゲットを解釈して (status, JSON 化するオブジェクト) を返す。"""
+        parts = urlsplit(target)
+        path = unquote(parts.path).rstrip("/") or "/"
+        query = parse_qs(parts.query)
+        dataset = self.dataset
+
+        if path.startswith("/horses/"):
+            horse = dataset.horse(path[len("/horses/"):])
+            if horse is None:
+                return 404, {"error": "horse not found"}
+            return 200, horse
+
+        if path.startswith("/pedigree/"):
+            horse_id = path[len("/pedigree/"):]
+            horse = dataset.by_id(horse_id)
+            if horse is None:
+                return 404, {"error": "horse not found"}
+            descendants = dataset.descendants(horse_id) or []
+            return 200, {
+                "id": horse_id,
+                "name": horse.get("name"),
+                "subName": horse.get("subName"),
+                "descendants": [
+                    {**d, "ids": [h["id"] for h in dataset.by_name(d.get("name", ""))]}
+                    for d in descendants
+                ],
+            }
+
+        limit, offset = self._paging(query)
+        if limit is None:
+            return 400, {"error": "limit/offset must be integers"}
+
+        if path.startswith("/similar/"):
+            similar = dataset.similar(path[len("/similar/"):], limit, sex=query.get("sex", [None])[0])
+            if similar is None:
+                return 404, {"error": "horse not found"}
+            return 200, {"total": len(similar), "horseLists": similar}
+
+        if path == "/search":
+            hits = dataset.search(query.get("q", [""])[0])
+            return 200, {"total": len(hits), "horseLists": hits[offset:offset + limit]}
+
+        if path == "/horses":
+            sex = query.get("sex", [None])[0]
+            parent_line = query.get("parentLine", [None])[0]
+            hits = dataset.select(factors=query.get("factor", []), parent_line=parent_line, sex=sex)
+            return 200, {"total": len(hits), "horseLists": hits[offset:offset + limit]}
+
+        if path == "/stats":
+            return 200, {
+                "horses": len(dataset),
+                "generation": self.generation,
+                "publishedGeneration": dataset.generation,
+                "chunkReads": dataset.chunk_reads,
+                "requests": self.requests,
+                "cachedResponses": len(self._responses),
+            }
+
+        return 404, {"error": "not found"}
+
+    @staticmethod
+    def _paging(query: dict[str, list[str]]) -> tuple[Optional[int], int]:
+        try:
+            limit = int(query.get("limit", [DEFAULT_LIMIT])[0])
+            offset = int(query.get("offset", [0])[0])
+        except ValueError:
+            return None, 0
+        return max(0, min(limit, MAX_LIMIT)), max(0, offset)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """1 接続分のリクエストを keep-alive で順に処理する。"""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                if len(head) > MAX_HEADER_BYTES:
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                headers: dict[str, str] = {}
+                for line in lines[1:]:
+                    name, sep, value = line.partition(":")
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                    length = int(headers.get("content-length", "0") or 0)
+                    if not 0 <= length <= MAX_BODY_BYTES:
+                        raise ValueError(length)
+                except ValueError:
+                    # 要求行や Content-Length が壊れていると次の要求の境目が分からないので、400 を返して切る。
+                    response = CachedResponse(400, {"error": "malformed request"})
+                    writer.write(self._encode("GET", response, {}, keep_alive=False))
+                    await writer.drain()
+                    return
+                # GET / HEAD しか受けないので本文は読み捨てる。
+                if length:
+                    try:
+                        await reader.readexactly(length)
+                    except (asyncio.IncompleteReadError, ConnectionError):
+                        return
+
+                self.requests += 1
+                if method not in ("GET", "HEAD"):
+                    response = CachedResponse(405, {"error": "method not allowed"})
+                else:
+                    response = await self.respond(target)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write(self._encode(method, response, headers, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _encode(method: str, response: CachedResponse, headers: dict[str, str], keep_alive: bool) -> bytes:
+        """ETag / gzip を考慮して応答バイト列を組み立てる。"""
+        status = response.status
+        body = response.body
+        extra = [f"ETag: {response.etag}", "Vary: Accept-Encoding"]
+        if status == 503:
+            extra.append("Retry-After: 1")
+        if status == 200 and headers.get("if-none-match") == response.etag:
+            status = 304
+            body = b""
+        elif len(body) >= GZIP_MIN_BYTES and "gzip" in headers.get("accept-encoding", ""):
+            body = response.gzipped()
+            extra.append("Content-Encoding: gzip")
+        head = [
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, 'OK')}",
+            "Content-Type: application/json; charset=utf-8",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+            *extra,
+        ]
+        payload = ("\r\n".join(head) + "\r\n\r\n").encode("latin-1")
+        return payload if method == "HEAD" or status == 304 else payload + body
+
+
+async def run_load(host: str, port: int, targets: list[str], total: int, concurrency: int) -> dict:
+    """
+    `concurrency` 本の keep-alive 接続から合計 `total` リクエストを投げる簡易負荷生成器。
+
+    `targets` を順に巡回し、各リクエストのレイテンシを集めて集計を返す。
+    """
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    counter = iter(range(total))
+
+    async def worker() -> None:
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for n in counter:
+                target = targets[n % len(targets)]
+                started = time.perf_counter()
+                writer.write(
+                    f"GET {target} HTTP/1.1\r\nHost: {host}\r\nAccept-Encoding: gzip\r\n\r\n".encode("utf-8")
+                )
+                head = await reader.readuntil(b"\r\n\r\n")
+                status = int(head.split(b" ", 2)[1])
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                if length:
+                    await reader.readexactly(length)
+                latencies.append(time.perf_counter() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def pct(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+    return {
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(pct(0.50), 3),
+        "p95_ms": round(pct(0.95), 3),
+        "p99_ms": round(pct(0.99), 3),
+        "statuses": statuses,
+    }
+
+
+def bench_targets(dataset: DabimasDataset, count: int = 200) -> list[str]:
+    """負荷試験用に、id 参照・血統・検索・因子絞り込みを混ぜたターゲット列を作る。"""
+    targets: list[str] = []
+    step = max(1, len(dataset.horses) // count) if dataset.horses else 1
+    factors = dataset.factors()
+    for n, horse in enumerate(dataset.horses[::step][:count]):
+        targets.append(f"/horses/{horse['id']}")
+        targets.append(f"/pedigree/{horse['id']}")
+        targets.append(f"/search?q={horse.get('ruby', '')[:2]}&limit=20")
+        if factors:
+            targets.append(f"/horses?factor={factors[n % len(factors)]}&limit=20")
+    return targets or ["/stats"]
+
+
+async def serve(args: argparse.Namespace) -> None:
+    server = ApiServer(Path(args.json_dir), args.cache_chunks, args.reload_interval)
+    tcp = await asyncio.start_server(server.handle, args.host, args.port)
+    port = tcp.sockets[0].getsockname()[1]
+    print(f"serving {len(server.dataset)} horses on http://{args.host}:{port}/")
+    watcher = asyncio.create_task(server.watch()) if args.reload_interval > 0 else None
+    try:
+        if args.bench > 0:
+            result = await run_load(
+                args.host, port, bench_targets(server.dataset), args.bench, args.concurrency
+            )
+            print(json.dumps(result, ensure_ascii=False))
+        else:
+            async with tcp:
+                await tcp.serve_forever()
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        tcp.close()
+        await tcp.wait_closed()
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="公開 JSON を返す読み取り専用のローカル HTTP API サーバー。")
+    parser.add_argument("--json-dir", default="json", help="summary と detail chunk を含むディレクトリ。")
+    parser.add_argument("--host", default="127.0.0.1", help="待ち受けアドレス（既定はローカルのみ）。")
+    parser.add_argument("--port", type=int, default=8765, help="待ち受けポート（0 で空きポート）。")
+    parser.add_argument("--cache-chunks", type=int, default=8, help="デコード済み detail chunk の保持数。")
+    parser.add_argument(
+        "--reload-interval",
+        type=float,
+        default=2.0,
+        help="公開物の更新確認間隔（秒）。0 で無効。",
+    )
+    parser.add_argument("--bench", type=int, default=0, help="N リクエストの負荷試験を実行して終了する。")
+    parser.add_argument("--concurrency", type=int, default=16, help="負荷試験の同時接続数。")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+top_mates.py
+
+種牡馬ごとの「お勧め繁殖牝馬」上位 k 頭をオフラインで計算し、種牡馬の id をキーにした
+JSON（`dabimasFactor.top-mates.json`）にまとめる。
+
+- 組み合わせの評価は `dabimas.mating.judge_crosses`（アプリの judgeInbreed と同じクロス数）。
+  `--rank-by crosses` はクロス数 -> 因子の種類数 -> 因子の本数、`coverage` は種類数を先に比べる。
+  同点は summary で先に出る繁殖牝馬を上にする。クロスが 0 の組は載せない。
+- 種牡馬を `--shards` 個に分け（summary 順に交互に割り当てて重さを均す）、`--workers` 個の
+  プロセスで並列に処理する。各プロセスは初期化時に公開 JSON と繁殖牝馬側の血統表を 1 回だけ
+  読み、shard の種牡馬ごとに大きさ k のヒープで上位を保つ。shard の結果は `--shard-dir` に
+  1 ファイルずつ書き、最後に親プロセスが summary 順にマージする。
+- shard は互いに独立なので、処理時間は CPU 数にほぼ比例して縮む（マージは件数 x k に比例するだけ）。
+  shard ごと・全体のスループット（組み合わせ / 秒）を表示する。
+
+出力:
+
+    {"version": 1, "generation": G, "k": 10, "rankBy": "crosses",
+     "fields": ["id", "crosses", "coverage", "factors"],
+     "mates": {"s123": [["b456", 7, 5, 9], ...], ...}}
+
+`generation` は読んだ公開物の世代（manifest が無ければ null）。
+"""
+
+from __future__ import annotations
+
+import argparse
+import heapq
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from dabimas.mating import INBREED_EXCEPTIONS_FILENAME, dam_side, judge_crosses, load_exceptions, sire_side
+from dabimas.publish import replace_file
+from dabimas.query import DabimasDataset
+
+
+TOP_MATES_FILENAME = "dabimasFactor.top-mates.json"
+FIELDS = ["id", "crosses", "coverage", "factors"]
+RANK_KEYS = {
+    "crosses": lambda result: (result.count, result.coverage, result.factors),
+    "coverage": lambda result: (result.coverage, result.count, result.factors),
+}
+STALLION, BROODMARE = "0", "1"
+
+# ワーカープロセスごとの状態（initializer で 1 回だけ作る）。
+_worker: dict = {}
+
+
+def shard_filename(shard: int) -> str:
+    return f"top-mates.shard-{shard:03d}.json"
+
+
+def init_worker(json_dir: str, exceptions_path: str, k: int, rank_by: str, shard_dir: str) -> None:
+    """公開 JSON・例外ルールを読み、繁殖牝馬側の血統表を作っておく。"""
+    dataset = DabimasDataset.open(Path(json_dir))
+    dams = [
+        (horse["id"], dam_side(dataset.descendants(horse["id"])))
+        for horse in dataset.horses
+        if horse.get("sex") == BROODMARE
+    ]
+    _worker.update(
+        dataset=dataset,
+        dams=dams,
+        rules=load_exceptions(Path(exceptions_path)),
+        k=k,
+        rank_key=RANK_KEYS[rank_by],
+        shard_dir=Path(shard_dir),
+    )
+
+
+def run_shard(shard: int, shards: int) -> dict:
+    """shard 番号 `shard` の種牡馬すべてを評価し、shard ファイルを書いて統計を返す。"""
+    started = time.perf_counter()
+    dataset, dams, rules, k, rank_key = (
+        _worker["dataset"], _worker["dams"], _worker["rules"], _worker["k"], _worker["rank_key"]
+    )
+    stallions = [h for h in dataset.horses if h.get("sex") == STALLION][shard::shards]
+    mates: dict[str, list] = {}
+    pairs = 0
+    for horse in stallions:
+        sire = sire_side(horse, dataset.descendants(horse["id"]))
+        # (順位キー, -繁殖牝馬の位置, 行) の最小ヒープ。根が k 位なので、それより良ければ入れ替える。
+        heap: list[tuple] = []
+        for position, (dam_id, dam) in enumerate(dams):
+            result = judge_crosses(sire, dam, rules)
+            pairs += 1
+            if not result.indexes:
+                continue
+            item = (rank_key(result), -position, [dam_id, result.count, result.coverage, result.factors])
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item[:2] > heap[0][:2]:
+                heapq.heappushpop(heap, item)
+        mates[horse["id"]] = [row for _, _, row in sorted(heap, key=lambda item: item[:2], reverse=True)]
+
+    path = _worker["shard_dir"] / shard_filename(shard)
+    with path.open("w", encoding="utf-8", newline="\n") as fp:
+        json.dump({"shard": shard, "generation": dataset.generation, "mates": mates}, fp,
+                  ensure_ascii=False, separators=(",", ":"))
+    return {
+        "shard": shard,
+        "path": str(path),
+        "stallions": len(stallions),
+        "pairs": pairs,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def merge_shards(paths: list[Path], order: list[str]) -> dict[str, list]:
+    """shard ファイルを読み、summary の種牡馬順に並べた id -> 上位の表にする。"""
+    merged: dict[str, list] = {}
+    for path in paths:
+        with path.open("r", encoding="utf-8") as fp:
+            merged.update(json.load(fp)["mates"])
+    missing = [horse_id for horse_id in order if horse_id not in merged]
+    if missing:
+        raise RuntimeError(f"{len(missing)} stallions are missing from the shard results (e.g. {missing[0]})")
+    return {horse_id: merged[horse_id] for horse_id in order}
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="種牡馬ごとのお勧め繁殖牝馬（上位 k 頭）を並列に計算する。")
+    parser.add_argument("--json-dir", default="json", help="summary と detail chunk を含むディレクトリ。")
+    parser.add_argument("--output", default=None, help=f"出力 JSON パス（既定は --json-dir/{TOP_MATES_FILENAME}）。")
+    parser.add_argument(
+        "--inbreed-exceptions",
+        default=None,
+        help=f"例外ルールの JSON（既定は --json-dir/{INBREED_EXCEPTIONS_FILENAME}）。",
+    )
+    parser.add_argument("--k", type=int, default=10, help="種牡馬ごとに残す繁殖牝馬の数。")
+    parser.add_argument("--rank-by", choices=sorted(RANK_KEYS), default="crosses", help="順位付けの基準。")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="ワーカープロセス数（既定は CPU 数）。")
+    parser.add_argument("--shards", type=int, default=0, help="種牡馬の分割数（0=ワーカー数 x 4）。")
+    parser.add_argument(
+        "--shard-dir",
+        default=None,
+        help="shard ごとの結果の書き出し先（既定は一時ディレクトリ。指定時は残す）。",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.k <= 0:
+        raise SystemExit("--k must be positive")
+    json_dir = Path(args.json_dir)
+    output_path = Path(args.output) if args.output else json_dir / TOP_MATES_FILENAME
+    exceptions_path = Path(args.inbreed_exceptions) if args.inbreed_exceptions else json_dir / INBREED_EXCEPTIONS_FILENAME
+    workers = max(1, args.workers)
+    shards = args.shards if args.shards > 0 else workers * 4
+
+    dataset = DabimasDataset.open(json_dir)
+    order = [h["id"] for h in dataset.horses if h.get("sex") == STALLION]
+    dams = sum(1 for h in dataset.horses if h.get("sex") == BROODMARE)
+    shards = max(1, min(shards, len(order)))
+    print(f"stallions={len(order)} broodmares={dams} pairs={len(order) * dams} workers={workers} shards={shards}")
+
+    with tempfile.TemporaryDirectory(prefix="top-mates-") as tmp:
+        shard_dir = Path(args.shard_dir) if args.shard_dir else Path(tmp)
+        shard_dir.mkdir(parents=True, exist_ok=True)
+        init_args = (str(json_dir), str(exceptions_path), args.k, args.rank_by, str(shard_dir))
+        started = time.perf_counter()
+        stats = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=init_args) as pool:
+            futures = [pool.submit(run_shard, shard, shards) for shard in range(shards)]
+            for future in futures:
+                stat = future.result()
+                stats.append(stat)
+                rate = stat["pairs"] / stat["seconds"] if stat["seconds"] else 0.0
+                print(
+                    f"shard {stat['shard']:03d}: stallions={stat['stallions']} pairs={stat['pairs']} "
+                    f"{stat['seconds']:.2f}s ({rate:,.0f} pairs/s)"
+                )
+        elapsed = time.perf_counter() - started
+        mates = merge_shards([Path(stat["path"]) for stat in stats], order)
+
+    output = {
+        "version": 1,
+        "generation": dataset.generation,
+        "k": args.k,
+        "rankBy": args.rank_by,
+        "fields": FIELDS,
+        "mates": mates,
+    }
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(output_path.name + ".partial")
+    with tmp_path.open("w", encoding="utf-8", newline="\n") as fp:
+        json.dump(output, fp, ensure_ascii=False, separators=(",", ":"))
+        fp.write("\n")
+    replace_file(tmp_path, output_path)
+
+    pairs = sum(stat["pairs"] for stat in stats)
+    busy = sum(stat["seconds"] for stat in stats)
+    print(
+        f"wrote {output_path}: {len(mates)} stallions, {pairs} pairs in {elapsed:.2f}s "
+        f"({pairs / elapsed if elapsed else 0.0:,.0f} pairs/s overall, "
+        f"{pairs / busy if busy else 0.0:,.0f} pairs/s per worker)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
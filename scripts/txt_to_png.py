@@ -1,9 +1,35 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+from typing import NamedTuple
 
 from PIL import Image, ImageDraw, ImageFont
+from PIL.PngImagePlugin import PngInfo
+
+# PNG の tEXt チャンクに入れる描画入力のハッシュ。一致すれば再描画しない。
+RENDER_HASH_KEY = "render-hash"
+RENDER_PAGES_KEY = "render-pages"
+
+# 1 枚の高さ上限（px）。超える分は同じ高さのページに分ける。X は長辺 4096px を超えると縮小する。
+DEFAULT_MAX_HEIGHT = 2400
+# エンコード設定: 速度優先 / 既定（64 色パレット化、フル RGB の約 1/3 のサイズでほぼ同速）/ サイズ優先。
+# 文字と帯だけの画像なので 64 色でも見た目はほぼ変わらない。
+ENCODE_PROFILES: dict[str, dict[str, object]] = {
+    "fast": {"palette": 0, "compress_level": 1},
+    "balanced": {"palette": 64, "compress_level": 6},
+    "small": {"palette": 64, "compress_level": 9},
+}
+DEFAULT_ENCODE = "balanced"
+
+ACCENT_HEIGHT = 14
+SECTION_GAP = 28
 
 
 def _read_non_empty_lines(path: Path) -> list[str]:
@@ -11,31 +37,217 @@ def _read_non_empty_lines(path: Path) -> list[str]:
     return [line for line in lines if line]
 
 
+@lru_cache(maxsize=None)
+def _load_font(font_path: str, size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font_path, size)
+
+
+class _TextMeasurer:
+    """1 フォント分の幅計測。文字ごとの advance を覚えておき、折り返し位置の見積もりに使う。"""
+
+    __slots__ = ("font", "_advances")
+
+    def __init__(self, font: ImageFont.FreeTypeFont):
+        self.font = font
+        self._advances: dict[str, float] = {}
+
+    def advance(self, ch: str) -> float:
+        width = self._advances.get(ch)
+        if width is None:
+            width = self._advances[ch] = self.font.getlength(ch)
+        return width
+
+    def length(self, text: str) -> float:
+        return self.font.getlength(text)
+
+    def fit(self, text: str, max_width: int) -> int:
+        """
+        `text[:n]` の幅が max_width に収まる最大の n（最低 1）。
+
+        advance の累積から n を見積もり、見積もりの前後を倍々に広げて実測で挟んでから
+        二分探索で確定する（カーニング等で累積と実測がずれても結果は実測どおり）。
+        実測するのは 1 行分前後の長さの部分文字列だけなので、長い行でも計測は数回で済む。
+        """
+        estimate = 0
+        total = 0.0
+        for ch in text:
+            total += self.advance(ch)
+            if total > max_width:
+                break
+            estimate += 1
+
+        def fits(n: int) -> bool:
+            return self.length(text[:n]) <= max_width
+
+        # lo は収まる（または 1）、hi は収まらない（または len+1）長さ。
+        size = len(text)
+        step = 1
+        if estimate >= 1 and fits(estimate):
+            lo, hi = estimate, estimate + 1
+            while hi <= size and fits(hi):
+                lo = hi
+                hi = min(size + 1, hi + step)
+                step *= 2
+        else:
+            lo, hi = estimate - 1, max(estimate, 1)
+            while lo > 1 and not fits(lo):
+                hi = lo
+                lo = max(1, lo - step)
+                step *= 2
+            lo = max(lo, 1)
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if fits(mid):
+                lo = mid
+            else:
+                hi = mid
+        return min(lo, size)
+
+
+@lru_cache(maxsize=None)
+def _measurer(font_path: str, size: int) -> _TextMeasurer:
+    return _TextMeasurer(_load_font(font_path, size))
+
+
 def _text_height(font: ImageFont.FreeTypeFont) -> int:
     bbox = font.getbbox("Ag")
     return bbox[3] - bbox[1]
 
 
-def _wrap_line(draw: ImageDraw.ImageDraw, text: str, font: ImageFont.FreeTypeFont, max_width: int) -> list[str]:
+def _wrap_line(measurer: _TextMeasurer, text: str, max_width: int) -> list[str]:
     if not text:
         return [""]
-    if draw.textlength(text, font=font) <= max_width:
+    if measurer.length(text) <= max_width:
         return [text]
 
     wrapped: list[str] = []
-    current = ""
-    for ch in text:
-        candidate = current + ch
-        if not current or draw.textlength(candidate, font=font) <= max_width:
-            current = candidate
-            continue
-        wrapped.append(current)
-        current = ch
-    if current:
-        wrapped.append(current)
+    rest = text
+    while rest:
+        n = measurer.fit(rest, max_width)
+        wrapped.append(rest[:n])
+        rest = rest[n:]
     return wrapped
 
 
+def render_hash(text_lines: list[str], font_path: Path, title: str, options: dict[str, object]) -> str:
+    """描画結果を決める入力（本文・タイトル・寸法・ページ分割・エンコード・フォントファイル）のハッシュ。"""
+    stat = font_path.stat()
+    payload = {
+        "lines": text_lines,
+        "font": [str(font_path), stat.st_size, stat.st_mtime_ns],
+        "title": title,
+        "options": options,
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _render_info(output_path: Path) -> dict:
+    try:
+        with Image.open(output_path) as image:
+            return dict(image.info)
+    except (OSError, ValueError):
+        return {}
+
+
+def existing_render_hash(output_path: Path) -> str | None:
+    """既存 PNG に埋め込んだ描画ハッシュ。無い・読めない場合は None。"""
+    return _render_info(output_path).get(RENDER_HASH_KEY)
+
+
+def is_up_to_date(output_path: Path, input_hash: str) -> bool:
+    """前回の全ページが同じ入力ハッシュで描かれ、ページが欠けていなければ True。"""
+    pages = existing_pages(output_path)
+    if not pages:
+        return False
+    first = _render_info(pages[0])
+    if first.get(RENDER_HASH_KEY) != input_hash or first.get(RENDER_PAGES_KEY) != str(len(pages)):
+        return False
+    return all(existing_render_hash(path) == input_hash for path in pages[1:])
+
+
+def page_path(output_path: Path, page_no: int) -> Path:
+    """1 ページ目は output_path そのもの、2 ページ目以降は `<stem>-<n><suffix>`。"""
+    if page_no == 1:
+        return output_path
+    return output_path.with_name(f"{output_path.stem}-{page_no}{output_path.suffix}")
+
+
+def existing_pages(output_path: Path) -> list[Path]:
+    """前回の出力ページ（1 ページ目 + `<stem>-<n>` をページ順で）。"""
+    pattern = re.compile(rf"^{re.escape(output_path.stem)}-(\d+){re.escape(output_path.suffix)}$")
+    numbered = []
+    for path in output_path.parent.glob(f"{output_path.stem}-*{output_path.suffix}"):
+        m = pattern.match(path.name)
+        if m:
+            numbered.append((int(m.group(1)), path))
+    pages = [output_path] if output_path.exists() else []
+    return pages + [path for _, path in sorted(numbered)]
+
+
+class _Page(NamedTuple):
+    """1 ページ分の描画指示。ワーカープロセスへそのまま渡す。"""
+
+    output_path: Path
+    font_path: str
+    title_lines: list[str]
+    body_lines: list[str]
+    label: str
+    page_count: int
+    width: int
+    height: int
+    padding: int
+    title_size: int
+    body_size: int
+    line_spacing: int
+    encode: str
+    input_hash: str | None
+
+
+def _block_height(lines: int, line_height: int, line_spacing: int) -> int:
+    return lines * line_height + max(0, lines - 1) * line_spacing
+
+
+def _save_page(page: _Page) -> Path:
+    title_font = _load_font(page.font_path, page.title_size)
+    body_font = _load_font(page.font_path, page.body_size)
+    title_height = _text_height(title_font)
+    body_height = _text_height(body_font)
+    padding = page.padding
+
+    image = Image.new("RGB", (page.width, page.height), "#FFFFFF")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, page.width, ACCENT_HEIGHT), fill="#2B6CB0")
+
+    y = padding + ACCENT_HEIGHT
+    for line in page.title_lines:
+        draw.text((padding, y), line, fill="#111111", font=title_font)
+        y += title_height + page.line_spacing
+
+    y += SECTION_GAP - page.line_spacing
+    for line in page.body_lines:
+        draw.text((padding, y), line, fill="#1F2937", font=body_font)
+        y += body_height + page.line_spacing
+
+    if page.label:
+        # ページ番号は下余白の右端に置く（本文・タイトルの折り返しに影響しない）。
+        label_x = page.width - padding - body_font.getlength(page.label)
+        label_y = page.height - padding + (padding - body_height) // 2
+        draw.text((label_x, label_y), page.label, fill="#6B7280", font=body_font)
+
+    profile = ENCODE_PROFILES[page.encode]
+    colors = int(profile["palette"])
+    if colors:
+        image = image.quantize(colors, method=Image.Quantize.FASTOCTREE)
+    pnginfo = None
+    if page.input_hash:
+        pnginfo = PngInfo()
+        pnginfo.add_text(RENDER_HASH_KEY, page.input_hash)
+        pnginfo.add_text(RENDER_PAGES_KEY, str(page.page_count))
+    page.output_path.parent.mkdir(parents=True, exist_ok=True)
+    image.save(page.output_path, format="PNG", compress_level=profile["compress_level"], pnginfo=pnginfo)
+    return page.output_path
+
+
 def build_image(
     text_lines: list[str],
     output_path: Path,
@@ -46,46 +258,136 @@ def build_image(
     title_size: int,
     body_size: int,
     line_spacing: int,
-) -> None:
-    title_font = ImageFont.truetype(str(font_path), title_size)
-    body_font = ImageFont.truetype(str(font_path), body_size)
+    max_height: int = DEFAULT_MAX_HEIGHT,
+    encode: str = DEFAULT_ENCODE,
+    input_hash: str | None = None,
+    workers: int = 1,
+) -> list[Path]:
+    """
+    本文を折り返し、高さが max_height（0 で無制限）に収まるようページに分けて描画する。
 
-    dummy_draw = ImageDraw.Draw(Image.new("RGB", (1, 1), "white"))
+    2 ページ以上になるときは全ページを同じ高さにし、右下に「n/N」を入れる。ページは
+    `workers` 個のプロセスで並列に描画・エンコードする。書いたページのパスを返し、前回の
+    出力で今回より後ろのページは消す。
+    """
+    title_measurer = _measurer(str(font_path), title_size)
+    body_measurer = _measurer(str(font_path), body_size)
     content_width = width - padding * 2
 
     wrapped_title: list[str] = []
     for line in title.splitlines():
-        wrapped_title.extend(_wrap_line(dummy_draw, line.strip(), title_font, content_width))
+        wrapped_title.extend(_wrap_line(title_measurer, line.strip(), content_width))
 
-    wrapped_body: list[str] = []
-    for line in text_lines:
-        wrapped_body.extend(_wrap_line(dummy_draw, line, body_font, content_width))
+    # 元の 1 行ごとの折り返し結果。ページ分割ではなるべく 1 行を 2 ページに分けない。
+    wrapped_groups = [_wrap_line(body_measurer, line, content_width) for line in text_lines]
+    wrapped_count = sum(len(group) for group in wrapped_groups)
 
-    title_height = _text_height(title_font)
-    body_height = _text_height(body_font)
-    title_block_height = len(wrapped_title) * title_height + max(0, len(wrapped_title) - 1) * line_spacing
-    body_block_height = len(wrapped_body) * body_height + max(0, len(wrapped_body) - 1) * line_spacing
+    title_height = _text_height(title_measurer.font)
+    body_height = _text_height(body_measurer.font)
+    fixed_height = (
+        padding + ACCENT_HEIGHT + SECTION_GAP
+        + _block_height(len(wrapped_title), title_height, line_spacing)
+        + SECTION_GAP + padding
+    )
 
-    accent_height = 14
-    section_gap = 28
-    height = padding + accent_height + section_gap + title_block_height + section_gap + body_block_height + padding
+    per_page = max(1, wrapped_count)
+    if max_height > 0:
+        per_page = max(1, (max_height - fixed_height + line_spacing) // (body_height + line_spacing))
+    # 元の行単位で詰める。1 行だけで 1 ページを超える場合に限り、その行をページ境界で切る。
+    page_lines: list[list[str]] = [[]]
+    for group in wrapped_groups:
+        if page_lines[-1] and len(page_lines[-1]) + len(group) > per_page:
+            page_lines.append([])
+        while len(group) > per_page:
+            page_lines[-1].extend(group[:per_page])
+            page_lines.append([])
+            group = group[per_page:]
+        page_lines[-1].extend(group)
+    page_count = len(page_lines)
+    # 全ページ同じ高さ（いちばん行数の多いページに合わせる）。
+    height = fixed_height + _block_height(max(len(lines) for lines in page_lines), body_height, line_spacing)
 
-    image = Image.new("RGB", (width, height), "#FFFFFF")
-    draw = ImageDraw.Draw(image)
-    draw.rectangle((0, 0, width, accent_height), fill="#2B6CB0")
+    pages = [
+        _Page(
+            output_path=page_path(output_path, n + 1),
+            font_path=str(font_path),
+            title_lines=wrapped_title,
+            body_lines=page_lines[n],
+            label=f"{n + 1}/{page_count}" if page_count > 1 else "",
+            page_count=page_count,
+            width=width,
+            height=height,
+            padding=padding,
+            title_size=title_size,
+            body_size=body_size,
+            line_spacing=line_spacing,
+            encode=encode,
+            input_hash=input_hash,
+        )
+        for n in range(page_count)
+    ]
+    workers = min(workers, page_count)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            written = list(pool.map(_save_page, pages))
+    else:
+        written = [_save_page(page) for page in pages]
 
-    y = padding + accent_height
-    for line in wrapped_title:
-        draw.text((padding, y), line, fill="#111111", font=title_font)
-        y += title_height + line_spacing
+    for stale in existing_pages(output_path)[page_count:]:
+        stale.unlink()
+    return written
 
-    y += section_gap - line_spacing
-    for line in wrapped_body:
-        draw.text((padding, y), line, fill="#1F2937", font=body_font)
-        y += body_height + line_spacing
 
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    image.save(output_path, format="PNG", optimize=True)
+def render_file(
+    input_path: Path, output_path: Path, title: str, args: argparse.Namespace
+) -> tuple[list[Path], bool]:
+    """
+    1 ジョブ分を描画し、(ページのパス, 描画したか) を返す。入力ハッシュが前回の全ページと
+    同じなら描画しない。
+    """
+    font_path = Path(args.font_path)
+    if not input_path.exists():
+        raise FileNotFoundError(f"Input text file not found: {input_path}")
+
+    lines = _read_non_empty_lines(input_path)
+    if not lines:
+        raise ValueError(f"Input text has no non-empty lines: {input_path}")
+
+    options = {
+        "width": args.width,
+        "padding": args.padding,
+        "title_size": args.title_size,
+        "body_size": args.body_size,
+        "line_spacing": args.line_spacing,
+        "max_height": args.max_height,
+        "encode": args.encode,
+    }
+    input_hash = render_hash(lines, font_path, title, options)
+    if not args.force and is_up_to_date(output_path, input_hash):
+        return existing_pages(output_path), False
+    pages = build_image(
+        text_lines=lines,
+        output_path=output_path,
+        font_path=font_path,
+        title=title,
+        input_hash=input_hash,
+        workers=max(1, args.workers),
+        **options,
+    )
+    return pages, True
+
+
+def load_batch(path: Path, default_title: str) -> list[tuple[Path, Path, str]]:
+    """バッチ定義 JSON（`[{"input": ..., "output": ..., "title": 任意}, ...]`）を読む。"""
+    jobs = json.loads(path.read_text(encoding="utf-8"))
+    if not isinstance(jobs, list):
+        raise ValueError(f"Batch file must be a JSON array: {path}")
+    result: list[tuple[Path, Path, str]] = []
+    for i, job in enumerate(jobs):
+        if not isinstance(job, dict) or "input" not in job or "output" not in job:
+            raise ValueError(f"Batch job #{i} needs 'input' and 'output': {job!r}")
+        result.append((Path(job["input"]), Path(job["output"]), job.get("title", default_title)))
+    return result
 
 
 def parse_args() -> argparse.Namespace:
@@ -99,36 +401,43 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--title-size", type=int, default=54, help="Title font size in px")
     parser.add_argument("--body-size", type=int, default=40, help="Body font size in px")
     parser.add_argument("--line-spacing", type=int, default=14, help="Line spacing in px")
+    parser.add_argument(
+        "--max-height",
+        type=int,
+        default=DEFAULT_MAX_HEIGHT,
+        help="Split into pages of at most this height in px; extra pages are <stem>-2.png, ... (0 = one image)",
+    )
+    parser.add_argument(
+        "--encode",
+        choices=sorted(ENCODE_PROFILES),
+        default=DEFAULT_ENCODE,
+        help="PNG encoder profile: fast (RGB, low compression), balanced (64-color palette), small (palette, max compression)",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes used to render pages")
+    parser.add_argument(
+        "--batch",
+        default=None,
+        help='JSON array of {"input", "output", "title"?} jobs rendered in one process (overrides --input/--output)',
+    )
+    parser.add_argument("--force", action="store_true", help="Render even if the output was made from the same input")
     return parser.parse_args()
 
 
 def main() -> int:
     args = parse_args()
-    input_path = Path(args.input)
-    output_path = Path(args.output)
     font_path = Path(args.font_path)
-
-    if not input_path.exists():
-        raise FileNotFoundError(f"Input text file not found: {input_path}")
     if not font_path.exists():
         raise FileNotFoundError(f"Font file not found: {font_path}")
 
-    lines = _read_non_empty_lines(input_path)
-    if not lines:
-        raise ValueError(f"Input text has no non-empty lines: {input_path}")
+    if args.batch:
+        jobs = load_batch(Path(args.batch), args.title)
+    else:
+        jobs = [(Path(args.input), Path(args.output), args.title)]
 
-    build_image(
-        text_lines=lines,
-        output_path=output_path,
-        font_path=font_path,
-        title=args.title,
-        width=args.width,
-        padding=args.padding,
-        title_size=args.title_size,
-        body_size=args.body_size,
-        line_spacing=args.line_spacing,
-    )
-    print(f"Saved: {output_path}")
+    for input_path, output_path, title in jobs:
+        pages, rendered = render_file(input_path, output_path, title, args)
+        for path in pages:
+            print(f"{'Saved' if rendered else 'Unchanged'}: {path}")
     return 0
 
 
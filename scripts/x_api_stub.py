@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# post_to_x.py の dry-run が叩く X API（token / media upload / tweets）のローカル代用品。
+# 応答の形は本物に合わせ、遅延と一時エラー（503 / 429）を注入できる。
+
+
+class XApiStub:
+    """
+    スレッドで動く X API スタブ。`start()` で起動し `base_url` を返す。
+
+    `latency` 秒だけ応答を遅らせ、`fail_rate` の確率で 503（media）/ 429（tweets）を返す。
+    受けたリクエスト数とアップロードされたバイト数を数える。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, fail_rate: float = 0.0,
+                 seed: int | None = None):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.counts: dict[str, int] = {}
+        self.uploaded_bytes = 0
+        self.tweets: list[dict] = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, key: str, nbytes: int = 0) -> bool:
+        """呼び出しを数え、この呼び出しを失敗させるなら True。"""
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.uploaded_bytes += nbytes
+            return self._random.random() < self.fail_rate
+
+    def _handler_class(self) -> type[BaseHTTPRequestHandler]:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format: str, *args: object) -> None:
+                return
+
+            def _reply(self, status: int, body: dict, headers: dict[str, str] | None = None) -> None:
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if stub.latency > 0:
+                    time.sleep(stub.latency)
+                if self.path == "/2/oauth2/token":
+                    stub._count("token")
+                    self._reply(200, {
+                        "token_type": "bearer",
+                        "access_token": f"stub-access-{uuid.uuid4().hex}",
+                        "refresh_token": f"stub-refresh-{uuid.uuid4().hex}",
+                        "expires_in": 7200,
+                    })
+                elif self.path == "/2/media/upload":
+                    if stub._count("media", len(body)):
+                        self._reply(503, {"title": "Service Unavailable"}, {"Retry-After": "0"})
+                        return
+                    self._reply(200, {"data": {"id": str(uuid.uuid4().int >> 64)}})
+                elif self.path == "/2/tweets":
+                    if stub._count("tweets"):
+                        self._reply(429, {"title": "Too Many Requests"}, {"Retry-After": "0"})
+                        return
+                    payload = json.loads(body or b"{}")
+                    with stub._lock:
+                        stub.tweets.append(payload)
+                    self._reply(201, {"data": {"id": str(uuid.uuid4().int >> 64), "text": payload.get("text", "")}})
+                else:
+                    self._reply(404, {"title": "Not Found"})
+
+        return Handler
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run a local stub of the X API endpoints used by post_to_x.py.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to delay every response")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Probability of a transient media/tweet error")
+    args = parser.parse_args()
+
+    stub = XApiStub(args.host, args.port, args.latency, args.fail_rate)
+    print(f"X API stub on {stub.base_url} (use it with X_API_BASE=... post_to_x.py --dry-run)")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,60 @@
+"""AllRowsReader（`--all-output` の mmap + 位置索引）で引いた行が、NDJSON を先頭から読んだ行と一致すること。"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+from dabimas.allrows import AllRowsReader, AllRowsWriter, index_path_for  # noqa: E402
+
+
+def rows(count):
+    """id, URL, sparse ALL 行（非 ASCII・長さの違う行を混ぜる）。"""
+    for i in range(count):
+        sparse = {"1": str(i % 2), "3": f"馬{i}" * (i % 5 + 1), "40": "" if i % 3 else "https://example.com/f.png"}
+        yield f"s{i}", f"https://dabimas.jp/kouryaku/stallions/{i}.html", {k: v for k, v in sparse.items() if v}
+
+
+def write(path, count):
+    writer = AllRowsWriter(path)
+    for horse_id, url, sparse in rows(count):
+        writer.write(horse_id, url, sparse)
+    writer.close()
+
+
+def test_index_matches_sequential_read(tmp_path):
+    path = tmp_path / "dabimasFactor.all.ndjson"
+    write(path, 50)
+    sequential = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    expected = list(rows(50))
+    assert sequential == [sparse for _, _, sparse in expected]
+
+    with AllRowsReader(path) as reader:
+        assert len(reader) == 50
+        assert reader.ids() == [horse_id for horse_id, _, _ in expected]
+        for (horse_id, url, _), line in zip(expected, sequential):
+            assert reader.get(horse_id) == line
+            assert reader.get(url) == line
+        assert reader.get("s999") is None
+        assert "s10" in reader and "s999" not in reader
+
+
+def test_stale_index_is_rejected(tmp_path):
+    path = tmp_path / "dabimasFactor.all.ndjson"
+    write(path, 3)
+    with path.open("ab") as fp:
+        fp.write(b'{"1":"0"}\n')
+    with pytest.raises(ValueError):
+        AllRowsReader(path)
+
+
+def test_empty_dump(tmp_path):
+    path = tmp_path / "dabimasFactor.all.ndjson"
+    write(path, 0)
+    assert index_path_for(path).exists()
+    with AllRowsReader(path) as reader:
+        assert len(reader) == 0
+        assert reader.get("s0") is None
@@ -0,0 +1,66 @@
+"""CheckpointJournal（`--checkpoint` / `--resume`）の記録・途中で切れた末尾行の修復・URL での再生。"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+import build_dabimas_stream as b  # noqa: E402
+
+
+def url(num):
+    return f"{b.BASE_URL}/kouryaku/stallions/{num}.html"
+
+
+def row(name, serial):
+    r = b.AllRow()
+    r.gender = "0"
+    r.serial_number = f"{serial:05d}"
+    r.horse_name = name
+    return r
+
+
+def record_all(journal, records, resume=False):
+    journal.open(resume=resume)
+    for idx, u, r in records:
+        journal.record(idx, u, r)
+    journal.close()
+
+
+def test_torn_tail_is_dropped_and_closed_on_resume(tmp_path):
+    journal = b.CheckpointJournal(tmp_path / "checkpoint.ndjson")
+    record_all(journal, [(1, url(1), row("A", 1)), (2, url(2), None)])
+    # 3 件目を書いている途中で落ちた。
+    with journal.path.open("a", encoding="utf-8") as fp:
+        fp.write('{"idx":3,"url":"' + url(3))
+
+    loaded = journal.load()
+    assert list(loaded) == [url(1), url(2)]
+    assert loaded[url(1)].horse_name == "A"
+    assert loaded[url(2)] is None
+
+    record_all(journal, [(3, url(3), row("C", 3))], resume=True)
+    loaded = journal.load()
+    assert list(loaded) == [url(1), url(2), url(3)]
+    assert loaded[url(3)].horse_name == "C"
+
+
+def test_open_without_resume_starts_over(tmp_path):
+    journal = b.CheckpointJournal(tmp_path / "checkpoint.ndjson")
+    record_all(journal, [(1, url(1), row("A", 1))])
+    record_all(journal, [(1, url(2), row("B", 1))])
+    assert list(journal.load()) == [url(2)]
+
+
+def test_replay_follows_urls_when_list_shifts(tmp_path):
+    journal = b.CheckpointJournal(tmp_path / "checkpoint.ndjson")
+    record_all(journal, [(1, url(1), row("A", 1)), (2, url(2), None), (3, url(3), row("C", 3))])
+    # 再開までに先頭へ 1 頭増え、2 番目の馬が一覧から消えた。
+    urls = [url(0), url(1), url(3), url(4)]
+    replayed = journal.replay(urls)
+    assert sorted(replayed) == [2, 3]
+    assert replayed[2][0] == url(1)
+    assert replayed[2][1].horse_name == "A"
+    assert replayed[2][1].serial_number == "00002"
+    assert replayed[3][0] == url(3)
+    assert replayed[3][1].serial_number == "00003"
@@ -0,0 +1,73 @@
+"""HorseDatabase（`--sqlite-output`）: 全入れ替えと、同じ馬を 2 回 upsert しても行が増えないこと。"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+from dabimas.database import OWN_SLOT, HorseDatabase  # noqa: E402
+from dabimas.siblings import SiblingIndex  # noqa: E402
+
+
+def horse(hid, name, factor=""):
+    return {
+        "id": hid,
+        "name": name,
+        "ruby": name,
+        "subName": "",
+        "nature": "天性",
+        "sex": "0",
+        "parentLine": "Ec",
+        "son": "",
+        "factors": [factor, "", ""],
+        "descendants": [
+            {"name": f"{name}-{slot}", "parentLine": "Ec", "son": "", "factors": ["速", "", ""] if slot == 1 else []}
+            for slot in range(15)
+        ],
+    }
+
+
+def counts(db):
+    return {
+        table: db.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ("horses", "descendants", "factors", "sibling_groups")
+    }
+
+
+def test_upsert_twice_is_idempotent(tmp_path):
+    path = tmp_path / "dabimas.sqlite"
+    with HorseDatabase.open(path) as db:
+        db.replace([horse("s1", "A", "短"), horse("s2", "B")])
+        before = counts(db)
+        assert before == {"horses": 2, "descendants": 30, "factors": 3, "sibling_groups": 0}
+
+        updated = horse("s2", "B2", "長")
+        for _ in range(2):
+            stats = db.upsert([updated, horse("s3", "C")])
+            assert (stats.horses, stats.descendants, stats.factors) == (2, 30, 3)
+        assert counts(db) == {"horses": 3, "descendants": 45, "factors": 5, "sibling_groups": 0}
+
+    # 開き直しても upsert の結果が残り、触れていない馬はそのまま。
+    with HorseDatabase.open(path) as db:
+        names = dict(db.conn.execute("SELECT id, name FROM horses"))
+        assert names == {"s1": "A", "s2": "B2", "s3": "C"}
+        own = db.conn.execute(
+            "SELECT factor FROM factors WHERE horse_id = 's2' AND slot = ?", (OWN_SLOT,)
+        ).fetchall()
+        assert own == [("長",)]
+        first = db.conn.execute("SELECT name FROM descendants WHERE horse_id = 's2' AND slot = 0").fetchone()
+        assert first == ("B2-0",)
+
+
+def test_upsert_with_siblings_replaces_groups(tmp_path):
+    siblings = SiblingIndex.from_bros_data({
+        "brosData": [
+            {"key": "A", "bros": {"fullBrothers": ["B"], "fullSisters": [""]}},
+            {"key": "B", "bros": {"fullBrothers": ["A"], "fullSisters": [""]}},
+        ]
+    })
+    with HorseDatabase.open(tmp_path / "dabimas.sqlite") as db:
+        db.upsert([horse("s1", "A")], siblings)
+        db.upsert([horse("s1", "A")], siblings)
+        assert counts(db)["sibling_groups"] == 2
+        assert len(set(db.conn.execute("SELECT group_id FROM sibling_groups"))) == 1
@@ -0,0 +1,86 @@
+"""`--diff-output` の突き合わせ（diff_entries / diff_entry_fields）と、公開済み summary からの読み戻し。"""
+
+import copy
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+import build_dabimas_stream as b  # noqa: E402
+
+
+def entry(hid, name, factors=("", "", "")):
+    descendants = [
+        {"name": f"{name}-{slot}", "parentLine": "Ec", "son": "", "factors": []} for slot in range(15)
+    ]
+    return {
+        "id": hid,
+        "name": name,
+        "ruby": name,
+        "subName": "",
+        "nature": "天性",
+        "sex": "0",
+        "parentLine": "Ec",
+        "son": "",
+        "factors": list(factors),
+        "descendants": descendants,
+    }
+
+
+def by_id(entries):
+    return {e["id"]: copy.deepcopy(e) for e in entries}
+
+
+def test_added_removed_changed_unchanged():
+    a, b_, c = entry("s1", "A"), entry("s2", "B"), entry("s3", "C")
+    previous = by_id([a, b_, c])
+    renamed = {**b_, "name": "B2"}
+    d = entry("s4", "D")
+    diff = b.diff_entries(previous, [a, renamed, d])
+
+    assert diff["counts"] == {"added": 1, "removed": 1, "changed": 1, "unchanged": 1}
+    assert [h["id"] for h in diff["added"]] == ["s4"]
+    assert [h["id"] for h in diff["removed"]] == ["s3"]
+    assert diff["changed"] == [
+        {"id": "s2", "name": "B2", "subName": "", "sex": "0", "fields": {"name": {"old": "B", "new": "B2"}}}
+    ]
+
+
+def test_descendants_change_reports_only_the_changed_slot():
+    old = entry("s1", "A")
+    new = copy.deepcopy(old)
+    new["descendants"][7]["factors"] = ["短"]
+    diff = b.diff_entries(by_id([old]), [new])
+
+    assert diff["counts"]["changed"] == 1
+    slots = diff["changed"][0]["fields"]["descendants"]
+    assert slots == [{"slot": 7, "old": old["descendants"][7], "new": new["descendants"][7]}]
+    assert list(diff["changed"][0]["fields"]) == ["descendants"]
+
+
+def test_base_without_detail_chunk_compares_scalar_fields_only(tmp_path):
+    old_a, old_b = entry("s1", "A"), entry("s2", "B")
+    summary = tmp_path / "dabimasFactor.summary.json"
+    b.write_summary(summary, [old_a, old_b], chunk_size=128)
+    # detail chunk が無い（--details-output-dir なし）公開物: descendants は None で読み戻る。
+    previous = b.load_published_entries(summary, tmp_path / "missing-details")
+    assert all(e["descendants"] is None for e in previous.values())
+
+    new_a = copy.deepcopy(old_a)
+    new_a["descendants"][0]["name"] = "X"
+    new_b = {**old_b, "factors": ["短", "", ""]}
+    diff = b.diff_entries(previous, [new_a, new_b])
+
+    assert diff["counts"] == {"added": 0, "removed": 0, "changed": 1, "unchanged": 1}
+    assert diff["changed"][0]["id"] == "s2"
+    assert diff["changed"][0]["fields"] == {"factors": {"old": ["", "", ""], "new": ["短", "", ""]}}
+
+
+def test_published_round_trip_is_unchanged(tmp_path):
+    entries = [entry("s1", "A"), entry("s2", "B", ("短", "", ""))]
+    summary = tmp_path / "dabimasFactor.summary.json"
+    details = tmp_path / "dabimasFactor-details"
+    b.write_summary(summary, entries, chunk_size=1)
+    b.write_details(details, entries, chunk_size=1)
+    diff = b.diff_entries(b.load_published_entries(summary, details), entries)
+    assert diff["counts"] == {"added": 0, "removed": 0, "changed": 0, "unchanged": 2}
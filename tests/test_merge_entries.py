@@ -0,0 +1,63 @@
+"""--merge の差し込み結果が全件クロールと同じ並びになること（同じ ruby の馬を含む）。"""
+
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+import build_dabimas_stream as b  # noqa: E402
+
+
+def listing(seed, count=40):
+    """一覧ページ: 性別グループごとに ruby 昇順。同じ ruby（別カード）は一覧に出た順。"""
+    rnd = random.Random(seed)
+    entries = []
+    for sex in b.SEX_ORDER:
+        rubies = sorted(rnd.choice("あいうえおか") for _ in range(count))
+        entries.extend({"id": f"{sex}-{i}", "sex": sex, "ruby": ruby} for i, ruby in enumerate(rubies))
+    return entries
+
+
+def test_merge_matches_full_crawl_with_equal_rubies():
+    for seed in range(50):
+        full = listing(seed)
+        list_order = {entry["id"]: position for position, entry in enumerate(full)}
+        rnd = random.Random(seed)
+        new = rnd.sample(full, 5)
+        new_ids = {entry["id"] for entry in new}
+        base = [entry for entry in full if entry["id"] not in new_ids]
+        assert b.merge_entries(base, new, list_order) == full
+
+
+def test_updated_entry_moves_to_its_new_ruby():
+    full = listing(0)
+    list_order = {entry["id"]: position for position, entry in enumerate(full)}
+    moved = {**full[0], "ruby": "ん"}
+    merged = b.merge_entries(full, [moved], list_order)
+    stallions = [entry for entry in merged if entry["sex"] == b.SEX_ORDER[0]]
+    assert stallions[-1] == moved
+    assert len(merged) == len(full)
+
+
+def stallion_url(num):
+    return f"{b.BASE_URL}/kouryaku/stallions/{num}.html"
+
+
+def test_duplicate_skipped_by_full_crawl_is_not_refetched():
+    # 一覧: A(1), A の重複(2), B(3), 新馬 C(4)。全件クロールは 2 を落とし、url-state に記録した。
+    listed = [stallion_url(n) for n in (1, 2, 3, 4)]
+    base_ids = {b.derive_horse_id("0", listed[0]), b.derive_horse_id("0", listed[2])}
+    duplicates = {listed[1]: b.derive_horse_id("0", listed[0])}
+    assert b.select_merge_urls([], listed, base_ids, duplicates) == [listed[3]]
+    # 残した馬が既存から消えていれば、重複だった馬も取り直して判定し直す。
+    assert b.select_merge_urls([], listed, base_ids - {duplicates[listed[1]]}, duplicates) == listed[:2] + [listed[3]]
+
+
+def test_url_state_keeps_skipped_duplicates(tmp_path):
+    path = tmp_path / "horse_urls.json"
+    listed = [stallion_url(n) for n in (1, 2, 3)]
+    state, _, _ = b.diff_url_state(None, listed, "t0")
+    b.write_url_state(path, state, [], [], "t0", {listed[1]: "s1", stallion_url(9): "s1"})
+    assert b.load_url_state(path) == state
+    assert b.load_url_duplicates(path) == {listed[1]: "s1"}
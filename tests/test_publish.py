@@ -0,0 +1,73 @@
+"""GenerationPublisher: 世代ディレクトリ + manifest での公開と、開いたままの読み手が旧世代を読み続けること。"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+import build_dabimas_stream as b  # noqa: E402
+from dabimas.publish import GenerationPublisher, load_manifest  # noqa: E402
+from dabimas.query import DabimasDataset  # noqa: E402
+
+
+def entries(count, tag):
+    return [
+        {
+            "id": f"s{i}",
+            "name": f"馬{i}",
+            "ruby": f"うま{i:03d}",
+            "subName": "",
+            "nature": "天性",
+            "sex": "0",
+            "parentLine": "Ec",
+            "son": "",
+            "factors": ["", "", ""],
+            "descendants": [
+                {"name": f"{tag}{i}-{slot}", "parentLine": "Ec", "son": "", "factors": ["", "", ""]}
+                for slot in range(15)
+            ],
+        }
+        for i in range(count)
+    ]
+
+
+def publish(json_dir, horses, chunk_size=2):
+    publisher = GenerationPublisher(json_dir / "dabimasFactor.summary.json", json_dir / "dabimasFactor-details")
+    publisher.begin()
+    b.write_summary(publisher.staged_summary, horses, chunk_size)
+    b.write_details(publisher.staged_details, horses, chunk_size)
+    return publisher.publish(chunk_size, len(horses))
+
+
+def test_each_generation_gets_its_own_directory(tmp_path):
+    first = publish(tmp_path, entries(5, "a"))
+    second = publish(tmp_path, entries(3, "b"))
+    assert (first["generation"], second["generation"]) == (1, 2)
+    assert load_manifest(tmp_path / "dabimasFactor.manifest.json") == second
+    for manifest in (first, second):
+        for item in [manifest["summary"], *manifest["chunks"]]:
+            assert item["path"].startswith(manifest["directory"] + "/")
+            assert (tmp_path / item["path"]).stat().st_size == item["size"]
+    # 互換ミラーは最新の世代と同じ内容で、旧世代にしか無い chunk は残らない。
+    mirror = tmp_path / "dabimasFactor.summary.json"
+    assert mirror.read_bytes() == (tmp_path / second["summary"]["path"]).read_bytes()
+    assert sorted(p.name for p in (tmp_path / "dabimasFactor-details").iterdir()) == [
+        Path(item["path"]).name for item in second["chunks"]
+    ]
+    assert not (tmp_path / ".staging").exists()
+
+
+def test_open_reader_keeps_its_generation(tmp_path):
+    publish(tmp_path, entries(5, "a"))
+    reader = DabimasDataset.open(tmp_path, cache_chunks=1)
+    publish(tmp_path, entries(3, "b"))
+    # 開いた後に公開された世代とは混ざらず、chunk を読み直しても旧世代のまま。
+    assert reader.generation == 1
+    assert [reader.descendants(f"s{i}")[0]["name"] for i in range(5)] == [f"a{i}-0" for i in range(5)]
+    assert DabimasDataset.open(tmp_path).descendants("s0")[0]["name"] == "b0-0"
+
+
+def test_only_current_and_previous_generations_are_kept(tmp_path):
+    for tag in "abcd":
+        publish(tmp_path, entries(3, tag))
+    assert sorted(p.name for p in (tmp_path / "dabimasFactor-generations").iterdir()) == ["000003", "000004"]
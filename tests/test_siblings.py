@@ -0,0 +1,50 @@
+"""SiblingIndex が json/brosData.json を一覧の並びまで元どおりに作り直せること。"""
+
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "scripts"))
+
+from dabimas.siblings import SiblingIndex  # noqa: E402
+
+BROS_DATA = ROOT / "json" / "brosData.json"
+
+
+def load_source():
+    with BROS_DATA.open("r", encoding="utf-8") as fp:
+        return json.load(fp)
+
+
+def test_bros_data_round_trip():
+    source = load_source()
+    index = SiblingIndex.from_bros_data(source)
+    assert index.problems == []
+    assert index.to_bros_data() == source
+
+
+def test_compact_round_trip_keeps_listed_order():
+    source = load_source()
+    compact = json.loads(json.dumps(SiblingIndex.from_bros_data(source).to_compact(), ensure_ascii=False))
+    assert SiblingIndex.from_compact(compact).to_bros_data() == source
+
+
+def test_write_bros_data_reproduces_file(tmp_path):
+    path = tmp_path / "brosData.json"
+    SiblingIndex.load(BROS_DATA).write_bros_data(path)
+    assert path.read_bytes() == BROS_DATA.read_bytes()
+
+
+def test_first_listed_brother_is_kept():
+    # アプリは fullBrothers[0] を使う。グループの並びと違う一覧も先頭を変えない。
+    source = {
+        "brosData": [
+            {"key": "A", "bros": {"fullBrothers": ["B", "C"], "fullSisters": ["", ""]}},
+            {"key": "B", "bros": {"fullBrothers": ["A", "C"], "fullSisters": ["", ""]}},
+            {"key": "C", "bros": {"fullBrothers": ["B", "A"], "fullSisters": ["", ""]}},
+        ]
+    }
+    index = SiblingIndex.from_bros_data(source)
+    assert index.to_bros_data() == source
+    assert index.to_compact()["order"] == {"C": ["B", "A"]}
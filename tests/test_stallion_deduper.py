@@ -0,0 +1,120 @@
+"""StallionDeduper と VBA 互換の「直前に書いた種牡馬と同じならスキップ」の突き合わせ。"""
+
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+import build_dabimas_stream as b  # noqa: E402
+
+
+def stallion(name, ability):
+    row = b.AllRow()
+    row.gender = "0"
+    row.horse_name = name
+    row.ability = ability
+    return row
+
+
+def broodmare(name):
+    row = b.AllRow()
+    row.gender = "1"
+    row.horse_name = name
+    return row
+
+
+# URL 順の結果。行は AllRow、"error" は取得エラー、None はパーサがスキップした行。
+A, A2, B = stallion("A", "x"), stallion("A", "y"), stallion("B", "x")
+M = broodmare("M")
+
+
+def legacy_kept(results):
+    """旧実装（バッチの URL 順で、直前に書いた種牡馬の馬名 + 非凡と比べる）で書き出す URL 番号。"""
+    kept = []
+    last_name = last_ability = ""
+    for idx, row in enumerate(results, start=1):
+        if row == "error" or row is None:
+            continue
+        if row.gender == "0":
+            if row.horse_name == last_name and row.ability == last_ability:
+                continue
+            last_name, last_ability = row.horse_name, row.ability
+        kept.append(idx)
+    return kept
+
+
+def deduper_kept(results, order):
+    """結果を `order`（as_completed の完了順）で届け、main と同じ並べ直しで書き出す URL 番号。"""
+    deduper = b.StallionDeduper()
+    pending = {}
+    next_idx = 1
+    kept = []
+    for idx in order:
+        row = results[idx - 1]
+        pending[idx] = row
+        if row != "error" and row is not None:
+            deduper.offer(idx, row)
+        while next_idx in pending:
+            row = pending.pop(next_idx)
+            if row != "error" and row is not None and deduper.keep(next_idx, row):
+                kept.append(next_idx)
+            next_idx += 1
+    assert not pending
+    return kept, [idx for idx, _ in deduper.non_adjacent]
+
+
+def shuffled_orders(n, count=50, seed=0):
+    rnd = random.Random(seed)
+    yield list(range(1, n + 1))
+    yield list(range(n, 0, -1))
+    for _ in range(count):
+        order = list(range(1, n + 1))
+        rnd.shuffle(order)
+        yield order
+
+
+@pytest.mark.parametrize(
+    "results",
+    [
+        [A, A, B],
+        [A, A, A, B, B],
+        [A, A2, A2],
+        [A, M, A, B],
+        [A, "error", A, B],
+        [A, None, A],
+        [M, A, M, "error", None, A, B, B],
+    ],
+    ids=["adjacent", "adjacent-runs", "same-name-other-ability", "broodmare-between", "error-between",
+         "skipped-between", "mixed"],
+)
+def test_adjacent_duplicates_match_legacy_in_any_completion_order(results):
+    expected = legacy_kept(results)
+    for order in shuffled_orders(len(results)):
+        kept, non_adjacent = deduper_kept(results, order)
+        assert kept == expected, order
+        assert non_adjacent == []
+
+
+def test_non_adjacent_duplicate_is_dropped_and_reported():
+    results = [A, B, A, A]
+    # 旧実装は 2 頭目の A（3 番）を残し、4 番だけ落とす。
+    assert legacy_kept(results) == [1, 2, 3]
+    for order in shuffled_orders(len(results)):
+        kept, non_adjacent = deduper_kept(results, order)
+        assert kept == [1, 2]
+        assert non_adjacent == [3]
+
+
+def test_random_sequences_differ_from_legacy_only_by_reported_non_adjacent():
+    rnd = random.Random(1)
+    pool = [A, A2, B, M, "error", None]
+    for _ in range(200):
+        results = [rnd.choice(pool) for _ in range(rnd.randint(1, 12))]
+        expected = legacy_kept(results)
+        for order in shuffled_orders(len(results), count=5, seed=rnd.random()):
+            kept, non_adjacent = deduper_kept(results, order)
+            assert kept == [idx for idx in expected if idx not in non_adjacent]
+            assert set(non_adjacent) <= set(expected)
@@ -0,0 +1,96 @@
+"""ArtifactValidator: build と同じ手順でステージングに書いた公開物を検査し、公開した世代も検査し直す。"""
+
+import copy
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "scripts"))
+
+import build_dabimas_stream as b  # noqa: E402
+from dabimas.aggregates import SummaryAggregates  # noqa: E402
+from dabimas.publish import GenerationPublisher  # noqa: E402
+from dabimas.validate import ArtifactValidator  # noqa: E402
+
+
+FACTOR = "速"
+
+
+def horse(i, sex="0"):
+    return {
+        "id": f"{'s' if sex == '0' else 'b'}{i}",
+        "name": f"馬{i}",
+        "ruby": f"うま{i:03d}",
+        "subName": "",
+        "nature": "天性",
+        "sex": sex,
+        "parentLine": "Ec",
+        "son": "",
+        "factors": ["短", "", ""],
+        "descendants": [
+            {"name": f"祖先{slot}", "parentLine": "Na", "son": "", "factors": [FACTOR if slot < 2 else "", "", ""]}
+            for slot in range(15)
+        ],
+    }
+
+
+ENTRIES = [horse(1), horse(2), horse(3, "1")]
+
+
+def validator():
+    return ArtifactValidator(b.FACTOR_SHORT_DICT.values(), b.PARENT_LINES.codes)
+
+
+def stage(json_dir, entries, aggregates=None):
+    publisher = GenerationPublisher(json_dir / "dabimasFactor.summary.json", json_dir / "dabimasFactor-details")
+    publisher.begin()
+    b.write_summary(publisher.staged_summary, entries, 2, aggregates)
+    b.write_details(publisher.staged_details, entries, 2)
+    return publisher
+
+
+def test_staged_and_published_round_trip(tmp_path):
+    aggregates = SummaryAggregates.from_codes(b.FACTOR_SHORT_DICT.values(), b.PARENT_LINES.codes)
+    publisher = stage(tmp_path, ENTRIES, aggregates)
+    check = validator()
+    assert check.validate_files(publisher.staged_summary, publisher.staged_details) == []
+
+    manifest = publisher.publish(2, len(ENTRIES))
+    summary = tmp_path / manifest["summary"]["path"]
+    details = (tmp_path / manifest["chunks"][0]["path"]).parent
+    assert check.validate_files(summary, details) == []
+    # 互換ミラーも同じ内容なので通る。片側だけの検査もできる。
+    assert check.validate_files(tmp_path / "dabimasFactor.summary.json", tmp_path / "dabimasFactor-details") == []
+    assert check.validate_files(summary, None) == []
+    assert check.validate_files(None, details) == []
+
+
+def test_repository_hand_written_json_is_valid():
+    assert validator().validate_files(
+        None, None, ROOT / "json" / "brosData.json", ROOT / "json" / "inbreed-exceptions.json"
+    ) == []
+
+
+def test_broken_artifacts_are_reported_and_not_published(tmp_path):
+    broken = copy.deepcopy(ENTRIES)
+    broken[0]["factors"] = ["?", "", ""]
+    broken[1]["descendants"] = broken[1]["descendants"][:14]
+    broken[2]["id"] = broken[0]["id"]
+    publisher = stage(tmp_path, broken)
+    problems = validator().validate_files(publisher.staged_summary, publisher.staged_details)
+    assert "summary.s1.factors: unknown factor '?'" in problems
+    assert "chunk[0].s2: expected 15 descendants, got 14" in problems
+    assert "summary.s1: duplicate id" in problems
+    publisher.abort()
+    assert not (tmp_path / "dabimasFactor.manifest.json").exists()
+
+
+def test_aggregates_must_match_details(tmp_path):
+    aggregates = SummaryAggregates.from_codes(b.FACTOR_SHORT_DICT.values(), b.PARENT_LINES.codes)
+    publisher = stage(tmp_path, ENTRIES, aggregates)
+    summary = json.loads(publisher.staged_summary.read_text(encoding="utf-8"))
+    summary["horseLists"][0]["factorAncestors"] = 7
+    publisher.staged_summary.write_text(json.dumps(summary, ensure_ascii=False), encoding="utf-8")
+    problems = validator().validate_files(publisher.staged_summary, publisher.staged_details)
+    assert problems == ["summary.s1.factorAncestors: 7 but the detail gives 2"]